@@ -1,78 +1,332 @@
-from datetime import datetime
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from sqlalchemy.orm import Session
-from sqlalchemy import select, text
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.engine import make_url
 
 from app.settings import settings
-from app.database import SessionLocal
+from app.database import CronSessionLocal, cron_engine
 from app.models import DataSource, JobRun
-from app.utils.db_connect import make_engine
-from app.utils.sheets_loader import load_sheet
-from app.utils.transforms import store_staging, materialize_curated
+from app.utils.db_connect import get_engine
+from app.utils.result_cache import invalidate_tenant
+from app.utils.sheets_loader import load_sheet_since
+from app.utils.transforms import (
+    STAGING_BATCH_SIZE, iter_batches, store_staging_batch, materialize_curated, materialize_from_query,
+    curated_plan, materialize_curated_columns, refresh_curated_stats, ingest_csv_file,
+)
 
 
 scheduler: AsyncIOScheduler | None = None
 
+# Chave do advisory lock que elege o único worker que roda o cron
+_SCHEDULER_LOCK_KEY = 7263002
+_lock_conn = None
+# Os jobs rodam em threads do executor e podem coincidir no mesmo instante; a Connection
+# do SQLAlchemy não é thread-safe, então todo uso de _lock_conn passa por aqui
+_lock_conn_lock = Lock()
 
-def _run_recurring_ingest():
-    db: Session = SessionLocal()
+# Canal LISTEN/NOTIFY para fontes alteradas e frequência com que é verificado
+DIRTY_CHANNEL = 'datasource_dirty'
+DIRTY_POLL_SECONDS = 30
+
+# Limite de fontes ingeridas ao mesmo tempo em cada execução do cron
+MAX_PARALLEL_SOURCES = 8
+
+# Fontes sendo ingeridas agora (compartilhado pelos dois jobs: uma fonte nunca roda
+# duas vezes em paralelo) e notificações adiadas por isso
+_inflight: set[int] = set()
+_inflight_lock = Lock()
+_dirty_backlog: set[int] = set()
+
+# Ingestões disparadas pela API (/ingest/sql, /ingest/csv/async) rodam aqui, fora do
+# threadpool dos requests; o excedente espera na fila do executor
+INGEST_WORKERS = 4
+_ingest_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+
+
+def _config(ds: DataSource) -> dict:
+    # config_json pode chegar como texto (JSON1 do SQLite / dados antigos)
+    cfg = ds.config_json
+    if isinstance(cfg, str):
+        try:
+            cfg = json.loads(cfg)
+        except ValueError:
+            cfg = None
+    return cfg if isinstance(cfg, dict) else {}
+
+
+def _is_due(ds: DataSource, db: Session) -> bool:
+    # Respeita interval_minutes da fonte: o cron roda no intervalo global, mas
+    # fontes com cadência maior só são checadas quando o prazo venceu
+    if not ds.interval_minutes:
+        return True
+    last = db.scalar(
+        select(func.max(JobRun.started_at)).where(JobRun.target_type == 'datasource', JobRun.target_id == ds.id)
+    )
+    return last is None or datetime.utcnow() - last >= timedelta(minutes=ds.interval_minutes)
+
+
+def _is_warehouse(url: str, db: Session) -> bool:
+    # O caminho server-side usa to_json/CAST do Postgres
     try:
-        dss = db.scalars(select(DataSource).where(DataSource.is_recurring == True)).all()  # noqa: E712
-        for ds in dss:
-            jr = JobRun(organization_id=ds.organization_id, target_type='datasource', target_id=ds.id, status='running', started_at=datetime.utcnow())
-            db.add(jr)
-            db.commit()
-            db.refresh(jr)
-            try:
-                if ds.type == 'sql' and ds.sqlalchemy_url:
-                    query = None
-                    if ds.config_json and isinstance(ds.config_json, dict):
-                        query = ds.config_json.get('query')
-                    if not query:
-                        jr.status = 'error'
-                        jr.logs = 'config_json.query ausente'
-                    else:
-                        eng = make_engine(ds.sqlalchemy_url)
-                        with eng.connect() as conn:
-                            result = conn.execute(text(query))
-                            rows = [dict(r._mapping) for r in result]
-                        store_staging(rows, ds.organization_id, db)
-                        credor = None
-                        if ds.config_json and isinstance(ds.config_json, dict):
-                            credor = ds.config_json.get('credor_code')
-                        materialize_curated(rows, ds.organization_id, db, credor)
-                        jr.status = 'success'
-                        jr.logs = f"Ingeridos {len(rows)} registros"
-                elif ds.type == 'google_sheets' and ds.config_json:
-                    spreadsheet_id = ds.config_json.get('spreadsheet_id')
-                    range_name = ds.config_json.get('range')
-                    rows = load_sheet(spreadsheet_id, range_name)
-                    store_staging(rows, ds.organization_id, db)
-                    credor = None
-                    if ds.config_json and isinstance(ds.config_json, dict):
-                        credor = ds.config_json.get('credor_code')
-                    materialize_curated(rows, ds.organization_id, db, credor)
-                    jr.status = 'success'
-                    jr.logs = f"Ingeridos {len(rows)} registros"
+        return db.get_bind().dialect.name == 'postgresql' and make_url(url) == make_url(settings.DATABASE_URL)
+    except Exception:
+        return False
+
+
+def _ingest_rows(rows, organization_id: int, db: Session, credor: str | None) -> int:
+    # Staging + curadoria em lotes fixos: O(N / lote) round-trips em vez de O(N).
+    # Sem commit: quem chama grava tudo numa transação só (junto com o cursor da fonte)
+    total = 0
+    for chunk in iter_batches(rows, STAGING_BATCH_SIZE):
+        store_staging_batch(chunk, organization_id, db)
+        total += materialize_curated(chunk, organization_id, db, credor, commit=False)
+    return total
+
+
+def _ingest_query(url: str, query: str, organization_id: int, db: Session, credor: str | None) -> int:
+    """Staging + curadoria do resultado de um SELECT numa fonte SQL; devolve o total de linhas."""
+    total = None
+    if _is_warehouse(url, db):
+        # Fonte = próprio banco: INSERT ... SELECT sem trazer linhas ao Python
+        try:
+            total = materialize_from_query(query, organization_id, db, credor)
+        except Exception:
+            db.rollback()
+    if total is None:
+        eng = get_engine(url)
+        total = 0
+        # Cursor no servidor: cada partição vai direto para o INSERT em lote,
+        # sem montar a lista completa de dicts em memória
+        with eng.connect().execution_options(stream_results=True, yield_per=STAGING_BATCH_SIZE) as conn:
+            result = conn.execute(text(query))
+            columns = list(result.keys())
+            plan = curated_plan(columns)
+            for partition in result.partitions(STAGING_BATCH_SIZE):
+                store_staging_batch([dict(zip(columns, r)) for r in partition], organization_id, db)
+                db.commit()
+                total += materialize_curated_columns(plan, partition, organization_id, db, credor)
+    refresh_curated_stats(db, total)
+    return total
+
+
+def _ingest_datasource(ds_id: int, force: bool = False) -> None:
+    """Ingere uma fonte; o desfecho vai para o JobRun assim que ela termina."""
+    # Sessão própria por fonte: uma falha ou conexão presa não contamina as demais
+    with CronSessionLocal() as db:
+        ds = db.get(DataSource, ds_id)
+        if ds is None or not (force or _is_due(ds, db)):
+            return
+        # INSERT ... RETURNING: o id já volta no insert, sem refresh
+        jr_id = db.execute(
+            insert(JobRun).returning(JobRun.id),
+            {"organization_id": ds.organization_id, "target_type": 'datasource', "target_id": ds.id, "status": 'running', "started_at": datetime.utcnow()},
+        ).scalar_one()
+        db.commit()
+        try:
+            cfg = _config(ds)
+            credor = cfg.get('credor_code')
+            if ds.type == 'sql' and ds.sqlalchemy_url:
+                query = cfg.get('query')
+                if not query:
+                    status, logs = 'error', 'config_json.query ausente'
                 else:
-                    jr.status = 'success'
-                    jr.logs = 'Sem ação (csv_upload não recorrente)'
-            except Exception as e:
-                jr.status = 'error'
-                jr.logs = str(e)
-            finally:
-                jr.finished_at = datetime.utcnow()
+                    total = _ingest_query(ds.sqlalchemy_url, query, ds.organization_id, db, credor)
+                    status, logs = 'success', f"Ingeridos {total} registros"
+            elif ds.type == 'google_sheets' and cfg:
+                # Incremental: só as linhas depois do cursor salvo na fonte. Linhas e cursor
+                # no mesmo commit: uma falha no meio não deixa linhas gravadas com o cursor parado
+                rows, last_row = load_sheet_since(cfg.get('spreadsheet_id'), cfg.get('range'), cfg.get('last_row') or 1)
+                _ingest_rows(rows, ds.organization_id, db, credor)
+                ds.config_json = {**cfg, 'last_row': last_row}
                 db.commit()
+                if rows:
+                    invalidate_tenant(ds.organization_id)
+                    refresh_curated_stats(db, len(rows))
+                status, logs = 'success', f"Ingeridos {len(rows)} registros"
+            else:
+                status, logs = 'success', 'Sem ação (csv_upload não recorrente)'
+        except Exception as e:
+            db.rollback()
+            status, logs = 'error', str(e)
+        db.execute(update(JobRun).where(JobRun.id == jr_id).values(status=status, logs=logs, finished_at=datetime.utcnow()))
+        db.commit()
+
+
+def _run_sql_ingest_job(jr_id: int, ds_id: int, query: str) -> None:
+    # Sessão do cron (sem pool): o job vive além do request que o disparou
+    with CronSessionLocal() as db:
+        try:
+            ds = db.get(DataSource, ds_id)
+            total = _ingest_query(ds.sqlalchemy_url, query, ds.organization_id, db, None)
+            status, logs = 'success', f"Ingeridos {total} registros"
+        except Exception as e:
+            db.rollback()
+            status, logs = 'error', str(e)
+        db.execute(update(JobRun).where(JobRun.id == jr_id).values(status=status, logs=logs, finished_at=datetime.utcnow()))
+        db.commit()
+
+
+def enqueue_sql_ingest(jr_id: int, ds_id: int, query: str) -> None:
+    """Roda a ingestão SQL disparada pela API em segundo plano; o desfecho fica no JobRun."""
+    _ingest_pool.submit(_run_sql_ingest_job, jr_id, ds_id, query)
+
+
+def _run_csv_ingest_job(jr_id: int, organization_id: int, path: str, credor: str | None) -> None:
+    # Sessão do cron, nunca a do request; o arquivo temporário é apagado no fim
+    with CronSessionLocal() as db:
+        try:
+            with open(path, 'rb') as f:
+                total = ingest_csv_file(f, organization_id, db, credor)
+            refresh_curated_stats(db, total)
+            status, logs = 'success', f"Ingeridos {total} registros"
+        except Exception as e:
+            db.rollback()
+            status, logs = 'error', str(e)
+        finally:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        db.execute(update(JobRun).where(JobRun.id == jr_id).values(status=status, logs=logs, finished_at=datetime.utcnow()))
+        db.commit()
+
+
+def enqueue_csv_ingest(jr_id: int, organization_id: int, path: str, credor: str | None = None) -> None:
+    """Ingere em segundo plano um CSV já salvo em `path` (o job apaga o arquivo)."""
+    _ingest_pool.submit(_run_csv_ingest_job, jr_id, organization_id, path, credor)
+
+
+def _drop_lock_conn() -> None:
+    # Conexão do lock morta ou suspeita: descarta; o lock (se ainda existir) sai junto.
+    # Quem chama segura _lock_conn_lock
+    global _lock_conn
+    conn, _lock_conn = _lock_conn, None
+    if conn is None:
+        return
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _holds_scheduler_lock() -> bool:
+    """Com vários workers (uvicorn/gunicorn) todos agendam o job, mas só o processo
+    que segura o advisory lock do Postgres ingere. O lock fica preso a uma conexão
+    dedicada e é liberado sozinho se o processo morrer; outro worker assume no tick seguinte."""
+    global _lock_conn
+    if cron_engine.dialect.name != 'postgresql':
+        return True
+    with _lock_conn_lock:
+        if _lock_conn is not None:
+            # Sem tráfego a conexão parece viva mesmo após restart/failover do Postgres
+            # (e o lock de sessão já era): testa a cada tick e, se caiu, cede a vez
+            try:
+                _lock_conn.execute(text("SELECT 1"))
+                _lock_conn.commit()
+                return True
+            except Exception:
+                _drop_lock_conn()
+                return False
+        try:
+            conn = cron_engine.connect()
+            locked = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _SCHEDULER_LOCK_KEY}).scalar()
+            conn.commit()
+        except Exception:
+            return False
+        if not locked:
+            conn.close()
+            return False
+        # O mesmo worker escuta as fontes marcadas como alteradas
+        conn.execute(text(f"LISTEN {DIRTY_CHANNEL}"))
+        conn.commit()
+        _lock_conn = conn
+        return True
+
+
+def _drain_dirty_sources() -> list[int]:
+    # Lê as notificações pendentes na conexão do lock (psycopg2), mais as que ficaram
+    # para trás no tick anterior porque a fonte ainda estava sendo ingerida
+    ids = set(_dirty_backlog)
+    _dirty_backlog.clear()
+    # Mesmo lock do _holds_scheduler_lock: o outro job pode estar usando ou fechando a conexão
+    with _lock_conn_lock:
+        if _lock_conn is None or _lock_conn.closed or _lock_conn.invalidated:
+            return sorted(ids)
+        raw = _lock_conn.connection.dbapi_connection
+        if not hasattr(raw, 'poll'):
+            return sorted(ids)
+        try:
+            # Erro direto no driver: o SQLAlchemy não invalida a conexão sozinho
+            raw.poll()
+        except Exception:
+            _drop_lock_conn()
+            return sorted(ids)
+        while raw.notifies:
+            payload = raw.notifies.pop(0).payload
+            try:
+                ids.add(int(payload))
+            except (TypeError, ValueError):
+                pass
+    return sorted(ids)
+
+
+def _ingest_many(ds_ids: list[int], force: bool = False) -> list[int]:
+    """Ingere as fontes em paralelo e devolve as que ficaram de fora por já estarem
+    sendo ingeridas por outro job (dirty_ingest e recurring_ingest podem se sobrepor)."""
+    with _inflight_lock:
+        busy = [i for i in ds_ids if i in _inflight]
+        ds_ids = [i for i in ds_ids if i not in _inflight]
+        _inflight.update(ds_ids)
+    if not ds_ids:
+        return busy
+    try:
+        # Fontes independentes em paralelo: uma planilha lenta não segura as demais
+        with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_SOURCES, len(ds_ids))) as ex:
+            list(ex.map(lambda i: _ingest_datasource(i, force), ds_ids))
+    finally:
+        with _inflight_lock:
+            _inflight.difference_update(ds_ids)
+    return busy
+
+
+def _run_dirty_ingest():
+    """Ingere na hora as fontes notificadas com
+    SELECT pg_notify('datasource_dirty', '<data_source_id>') no banco da aplicação
+    (ex.: por um trigger nas tabelas de origem), sem esperar o intervalo do cron."""
+    if not _holds_scheduler_lock():
+        return
+    try:
+        # Fonte ocupada: a notificação é reaproveitada no próximo tick, não perdida
+        _dirty_backlog.update(_ingest_many(_drain_dirty_sources(), force=True))
+    finally:
+        cron_engine.dispose()
+
+
+def _run_recurring_ingest():
+    if not _holds_scheduler_lock():
+        return
+    try:
+        with CronSessionLocal() as db:
+            ds_ids = db.scalars(select(DataSource.id).where(DataSource.is_recurring == True)).all()  # noqa: E712
+        _ingest_many(list(ds_ids))
     finally:
-        db.close()
+        cron_engine.dispose()
 
 
 def init_scheduler():
     global scheduler
     if scheduler:
         return scheduler
-    scheduler = AsyncIOScheduler()
+    # Um tick atrasado não empilha execuções: as perdidas viram uma só e nunca há duas simultâneas
+    scheduler = AsyncIOScheduler(job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 60})
     minutes = settings.CRON_DEFAULT_MINUTES or 60
     scheduler.add_job(_run_recurring_ingest, 'interval', minutes=minutes, id='recurring_ingest', replace_existing=True)
+    if cron_engine.dialect.name == 'postgresql':
+        scheduler.add_job(_run_dirty_ingest, 'interval', seconds=DIRTY_POLL_SECONDS, id='dirty_ingest', replace_existing=True)
     scheduler.start()
     return scheduler
@@ -1,14 +1,69 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy.pool import NullPool
 from app.settings import settings
+try:
+    import orjson
+except Exception:  # orjson é opcional; sem ele o SQLAlchemy usa o json da stdlib
+    orjson = None
 
 
 class Base(DeclarativeBase):
     pass
 
 
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True, future=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
+def _json_serializer(value) -> str:
+    # Colunas JSON (raw_json do staging, config/layout): serialização em Rust, com
+    # escalares numpy e chaves não-texto como no json.dumps
+    return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _engine_kwargs(url: str) -> dict:
+    # Pre-ping desligado por padrão (um SELECT 1 a cada checkout): conexões são recicladas por
+    # idade e, numa queda, o SQLAlchemy invalida o pool inteiro no primeiro erro de desconexão
+    kwargs: dict = {"future": True, "pool_pre_ping": settings.DB_POOL_PRE_PING}
+    if orjson is not None:
+        kwargs["json_serializer"] = _json_serializer
+    u = make_url(url)
+    if u.get_backend_name() != 'sqlite':
+        # LIFO: as conexões mais usadas ficam quentes e as ociosas envelhecem até o recycle
+        kwargs.update(
+            pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT, pool_recycle=1800, pool_use_lifo=True,
+        )
+    # psycopg2: executemany vira um único INSERT multi-VALUES por página
+    if u.get_driver_name() == 'psycopg2':
+        kwargs.update(executemany_mode='values_plus_batch', insertmanyvalues_page_size=10000)
+        # JIT do Postgres custa mais do que economiza nas consultas curtas da API
+        kwargs['connect_args'] = {"options": "-c jit=off"}
+    return kwargs
+
+
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    # WAL: leituras não bloqueiam a escrita do cron; cache de 64MB e temporárias em memória
+    cur = dbapi_conn.cursor()
+    for pragma in ("journal_mode=WAL", "synchronous=NORMAL", "cache_size=-64000", "temp_store=MEMORY"):
+        cur.execute(f"PRAGMA {pragma}")
+    cur.close()
+
+
+def _tune_sqlite(eng) -> None:
+    if eng.dialect.name == 'sqlite' and eng.url.database not in (None, '', ':memory:'):
+        event.listen(eng, "connect", _sqlite_pragmas)
+
+
+engine = create_engine(settings.DATABASE_URL, **_engine_kwargs(settings.DATABASE_URL))
+_tune_sqlite(engine)
+# expire_on_commit=False: sessões vivem só um request; ler um objeto depois do commit
+# não dispara SELECT de recarga (refresh passa a ser necessário só p/ defaults do servidor)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine, future=True)
+
+# Engine exclusivo do APScheduler: sem pool, conexões fecham ao fim de cada sessão
+_cron_kwargs = {k: v for k, v in _engine_kwargs(settings.DATABASE_URL).items() if k not in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle', 'pool_use_lifo', 'pool_pre_ping')}
+cron_engine = create_engine(settings.DATABASE_URL, **_cron_kwargs, poolclass=NullPool)
+_tune_sqlite(cron_engine)
+CronSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=cron_engine, future=True)
 
 
 def get_db():
@@ -1,3 +1,6 @@
+import time
+from collections import OrderedDict
+from threading import Lock
 from typing import Annotated
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -5,25 +8,82 @@ from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app.security import decode_token
+from app.utils.filters import cached_text
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/dev-login")
 
 
 class RequestContext:
-    def __init__(self, user_id: int, organization_id: int):
+    def __init__(self, user_id: int, organization_id: int, role: str | None = None):
         self.user_id = user_id
         self.organization_id = organization_id
+        # Papel no momento do login (informativo; permissões continuam checadas no banco)
+        self.role = role
+        # Membership do usuário na organização, carregada uma vez por request por quem checa permissão
+        self.membership = None
+
+
+# Tokens já validados: token -> (exp, user_id, org_id, role). Evita refazer a
+# verificação do JWT a cada request; a entrada vale só até o exp do próprio token.
+TOKEN_CACHE_SIZE = 4096
+_token_cache: "OrderedDict[str, tuple[int, int, int, str | None]]" = OrderedDict()
+_token_cache_lock = Lock()
+
+
+def _cached_claims(token: str) -> tuple[int, int, str | None] | None:
+    with _token_cache_lock:
+        hit = _token_cache.get(token)
+        if hit is None:
+            return None
+        if hit[0] <= time.time():
+            del _token_cache[token]
+            return None
+        _token_cache.move_to_end(token)
+        return hit[1], hit[2], hit[3]
+
+
+def _remember_claims(token: str, exp, user_id: int, org_id: int, role: str | None) -> None:
+    if not exp:
+        return
+    with _token_cache_lock:
+        _token_cache[token] = (int(exp), user_id, org_id, role)
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
 
 
 def get_current_ctx(token: Annotated[str, Depends(oauth2_scheme)]) -> RequestContext:
+    cached = _cached_claims(token)
+    if cached is not None:
+        return RequestContext(user_id=cached[0], organization_id=cached[1], role=cached[2])
     payload = decode_token(token)
     user_id = int(payload.get("sub"))
     org_id = int(payload.get("org"))
     if not user_id or not org_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
-    return RequestContext(user_id=user_id, organization_id=org_id)
+    role = payload.get("role")
+    _remember_claims(token, payload.get("exp"), user_id, org_id, role)
+    return RequestContext(user_id=user_id, organization_id=org_id, role=role)
 
 
 DbSession = Annotated[Session, Depends(get_db)]
 
+
+def mutate_owned(db: Session, sql: str, params: dict, not_found: str):
+    """Executa um UPDATE/DELETE já restrito por organization_id e faz commit.
+
+    O próprio WHERE faz a checagem de posse (sem SELECT prévio nem corrida entre os dois):
+    nenhuma linha afetada vira 404. Com RETURNING, devolve a linha gravada.
+    """
+    result = db.execute(cached_text(sql), params)
+    if result.returns_rows:
+        row = result.mappings().first()
+        missing = row is None
+    else:
+        row = None
+        missing = result.rowcount == 0
+    if missing:
+        db.rollback()
+        raise HTTPException(status_code=404, detail=not_found)
+    db.commit()
+    return row
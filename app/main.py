@@ -1,8 +1,13 @@
+import hashlib
+import os
+
+import anyio
 from fastapi import FastAPI
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.database import Base, engine
-from sqlalchemy import text
+from app.responses import DefaultResponse
+from app.settings import settings
 from app.routers import auth, datasources, ingest, dashboards
 from app.routers import indicators_v2
 from app.routers import indicators_ext
@@ -10,10 +15,15 @@ from app.routers import datasets as datasets_router
 from app.routers import meta
 from app.routers import org as org_router
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
 from app.cron import init_scheduler
+from app.schema_sync import ensure_schema, ensure_tables
+from app.utils.transforms import shutdown_csv_prep_pool
 
 
-app = FastAPI(title="SaaS Dashboards")
+app = FastAPI(title="SaaS Dashboards", default_response_class=DefaultResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,6 +34,25 @@ app.add_middleware(
 )
 
 
+class HealthzShortCircuit:
+    """Responde /healthz (sondas do load balancer) antes de CORS e do roteamento."""
+
+    _response = Response(content=b'{"status":"ok"}', media_type="application/json")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/healthz":
+            await self._response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+# Adicionado por último = camada mais externa
+app.add_middleware(HealthzShortCircuit)
+
+
 app.include_router(auth.router)
 app.include_router(datasources.router)
 app.include_router(ingest.router)
@@ -38,99 +67,98 @@ app.include_router(org_router.router)
 @app.on_event("startup")
 def on_startup():
     # DB tables are managed by Alembic, but create if not exists for local dev.
-    Base.metadata.create_all(bind=engine)
-    # Ensure optional columns exist for local SQLite (adds without migration)
+    if settings.NEXEN_FAST_STARTUP:
+        ensure_tables(engine, Base.metadata)
+    else:
+        Base.metadata.create_all(bind=engine)
+    # Ensure optional columns exist (introspection: DDL only for what is missing)
     try:
-        with engine.begin() as conn:
-            try:
-                conn.execute(text("ALTER TABLE curated_records ADD COLUMN devedor VARCHAR(200)"))
-            except Exception:
-                pass
-            try:
-                conn.execute(text("ALTER TABLE curated_records ADD COLUMN cpf_cnpj VARCHAR(32)"))
-            except Exception:
-                pass
-            try:
-                conn.execute(text("ALTER TABLE curated_records ADD COLUMN processo VARCHAR(100)"))
-            except Exception:
-                pass
-            try:
-                conn.execute(text("ALTER TABLE curated_records ADD COLUMN credor_code VARCHAR(50)"))
-            except Exception:
-                pass
-            # Campos adicionais (idempotentes)
-            for ddl in [
-                "ALTER TABLE curated_records ADD COLUMN vl_saldo FLOAT",
-                "ALTER TABLE curated_records ADD COLUMN dt_ultimo_credito DATETIME",
-                "ALTER TABLE curated_records ADD COLUMN portador VARCHAR(100)",
-                "ALTER TABLE curated_records ADD COLUMN motivo_devolucao VARCHAR(200)",
-                "ALTER TABLE curated_records ADD COLUMN vl_honorario_devedor FLOAT",
-                "ALTER TABLE curated_records ADD COLUMN vl_tx_contrato FLOAT",
-                "ALTER TABLE curated_records ADD COLUMN comercial VARCHAR(100)",
-                "ALTER TABLE curated_records ADD COLUMN cobrador VARCHAR(100)",
-                "ALTER TABLE curated_records ADD COLUMN dt_encerrado DATETIME",
-                "ALTER TABLE curated_records ADD COLUMN dias_vencidos_cadastro INTEGER",
-            ]:
-                try:
-                    conn.execute(text(ddl))
-                except Exception:
-                    pass
-            # Add credor_code to datasets and indicators if missing
-            try:
-                conn.execute(text("ALTER TABLE datasets ADD COLUMN credor_code VARCHAR(50)"))
-            except Exception:
-                pass
-            try:
-                conn.execute(text("ALTER TABLE indicators ADD COLUMN credor_code VARCHAR(50)"))
-            except Exception:
-                pass
-            # Create categories table if not exists (for indicator folders)
-            try:
-                conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS indicator_categories (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    organization_id INTEGER NOT NULL,
-                    name VARCHAR(200) NOT NULL,
-                    color VARCHAR(7),
-                    UNIQUE(organization_id, name)
-                )
-                """))
-            except Exception:
-                pass
-            try:
-                conn.execute(text("ALTER TABLE indicator_categories ADD COLUMN color VARCHAR(7)"))
-            except Exception:
-                pass
+        ensure_schema(engine)
     except Exception:
         pass
     init_scheduler()
 
 
-@app.get("/")
-def root():
-    return RedirectResponse(url="/app/login.html")
+@app.on_event("shutdown")
+def on_shutdown():
+    shutdown_csv_prep_pool()
 
 
-@app.get("/app/")
-def app_home_redirect():
+@app.on_event("startup")
+async def tune_threadpool():
+    # Rotas e dependências são síncronas: a concorrência é limitada pelo threadpool do anyio
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
+
+
+# Redirects fixos: respostas montadas uma vez e servidas por rotas Starlette
+# assíncronas (sem DI do FastAPI nem ida ao threadpool)
+REDIRECTS = {
+    "/": "/app/login.html",
     # Serve the fixed dashboard file to avoid cached/broken index.html links
-    return RedirectResponse(url="/app/index2.html")
+    "/app/": "/app/index2.html",
+    # Compatibility redirects for older static filenames
+    "/app/indicators.html": "/app/indicators-fixed.html",
+    # Compatibility: some links might point to /app/static/login.html
+    "/app/static/login.html": "/app/login.html",
+}
+
+
+def _redirect_endpoint(response: RedirectResponse):
+    async def endpoint(request):
+        return response
+    return endpoint
+
 
+for _path, _target in REDIRECTS.items():
+    app.add_route(_path, _redirect_endpoint(RedirectResponse(url=_target)), methods=["GET"], include_in_schema=False)
 
-# Compatibility redirects for older static filenames
-@app.get("/app/indicators.html")
-def redirect_indicators():
-    return RedirectResponse(url="/app/indicators-fixed.html")
 
-# Compatibility: some links might point to /app/static/login.html
-@app.get("/app/static/login.html")
-def redirect_login_static():
-    return RedirectResponse(url="/app/login.html")
 
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles com ETags de conteúdo (md5) em vez dos de mtime/tamanho do Starlette.
+
+    O md5 fica em cache por (mtime, tamanho) do stat que o Starlette já faz: arquivo
+    trocado sem restart (deploy no lugar, --reload que só olha .py) ganha ETag novo.
+    """
+
+    MAX_CACHED_SIZE = 1024 * 1024  # arquivos maiores (geojson, imagens) seguem o fluxo padrão
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # caminho real -> (mtime_ns, tamanho, etag); aquecido no boot
+        self._etags: dict[str, tuple[int, int, str]] = {}
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                full = os.path.realpath(os.path.join(root, name))
+                try:
+                    self._etag(full, os.stat(full))
+                except OSError:
+                    continue
+
+    def _etag(self, full_path, stat_result) -> str | None:
+        if stat_result.st_size >= self.MAX_CACHED_SIZE:
+            return None
+        key = (stat_result.st_mtime_ns, stat_result.st_size)
+        hit = self._etags.get(full_path)
+        if hit is not None and hit[:2] == key:
+            return hit[2]
+        try:
+            with open(full_path, "rb") as fh:
+                etag = f'"{hashlib.md5(fh.read()).hexdigest()}"'
+        except OSError:
+            return None
+        self._etags[full_path] = (*key, etag)
+        return etag
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        etag = self._etag(str(full_path), stat_result)
+        if etag is not None:
+            response.headers["etag"] = etag
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
 
-@app.get("/healthz")
-def healthz():
-    return {"status": "ok"}
 
 # Static UI mounted at /app
-app.mount("/app", StaticFiles(directory="app/static", html=True), name="app_static")
+app.mount("/app", CachedStaticFiles(directory="app/static", html=True), name="app_static")
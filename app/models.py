@@ -1,9 +1,12 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Text, JSON, Float
+from sqlalchemy import Column, Index, Integer, String, DateTime, ForeignKey, Boolean, Text, JSON, Float, func
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from app.database import Base
 
 
+# created_at: now() do banco, sem relógio do Python. default= põe o now() no próprio INSERT
+# (bancos locais criados pelo create_all antigo têm a coluna NOT NULL sem DEFAULT);
+# server_default= vale para COPY e INSERTs que não citam a coluna
 class Organization(Base):
     __tablename__ = 'organizations'
 
@@ -11,7 +14,7 @@ class Organization(Base):
     name: Mapped[str] = mapped_column(String(200), nullable=False)
     slug: Mapped[str] = mapped_column(String(100), unique=True, index=True, nullable=False)
     plan: Mapped[str] = mapped_column(String(50), default='free')
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), server_default=func.now())
 
 
 class User(Base):
@@ -21,7 +24,11 @@ class User(Base):
     email: Mapped[str] = mapped_column(String(200), unique=True, index=True, nullable=False)
     name: Mapped[str] = mapped_column(String(200), nullable=False)
     password_hash: Mapped[str] = mapped_column(String(200), nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), server_default=func.now())
+
+    # lazy="raise_on_sql": relacionamentos só carregam de forma explícita (selectinload/joinedload);
+    # um acesso que emitiria SELECT por objeto (N+1) vira erro em vez de query silenciosa
+    memberships: Mapped[list["Membership"]] = relationship(back_populates="user", lazy="raise_on_sql", passive_deletes=True)
 
 
 class Membership(Base):
@@ -35,6 +42,9 @@ class Membership(Base):
     can_manage_indicators: Mapped[bool] = mapped_column(Boolean, default=False)
     can_manage_members: Mapped[bool] = mapped_column(Boolean, default=False)
 
+    user: Mapped["User"] = relationship(back_populates="memberships", lazy="raise_on_sql")
+    organization: Mapped["Organization"] = relationship(lazy="raise_on_sql")
+
 
 class DataSource(Base):
     __tablename__ = 'data_sources'
@@ -46,18 +56,23 @@ class DataSource(Base):
     config_json: Mapped[dict | None] = mapped_column(JSON, nullable=True)
     is_recurring: Mapped[bool] = mapped_column(Boolean, default=False)
     interval_minutes: Mapped[int | None] = mapped_column(Integer, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), server_default=func.now())
 
 
 class IndicatorFolderPermission(Base):
     __tablename__ = 'indicator_folder_permissions'
+    # Uma linha por pasta de cada membro (alvo do upsert em /org/members); no Postgres
+    # o can_edit vai na folha (migration 0014)
+    __table_args__ = (
+        Index('ux_indicator_folder_perm_org_user_folder', 'organization_id', 'user_id', 'folder', unique=True, postgresql_include=['can_edit']),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     organization_id: Mapped[int] = mapped_column(Integer, index=True, nullable=False)
     user_id: Mapped[int] = mapped_column(Integer, index=True, nullable=False)
     folder: Mapped[str] = mapped_column(String(120), nullable=False)
     can_edit: Mapped[bool] = mapped_column(Boolean, default=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), server_default=func.now())
 
 
 class StagingRecord(Base):
@@ -66,7 +81,7 @@ class StagingRecord(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     organization_id: Mapped[int] = mapped_column(Integer, index=True, nullable=False)
     raw_json: Mapped[dict] = mapped_column(JSON)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), server_default=func.now())
 
 
 class CuratedRecord(Base):
@@ -77,6 +92,8 @@ class CuratedRecord(Base):
     # Código do credor (pasta/grupo da Fonte de Dados)
     credor_code: Mapped[str | None] = mapped_column(String(50), nullable=True, index=True)
     dt_cadastro: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # Ano-mês (YYYY-MM) do dt_cadastro gravado na ingestão: agrupa sem função por linha
+    ym: Mapped[str | None] = mapped_column(String(7), nullable=True)
     uf: Mapped[str | None] = mapped_column(String(4), nullable=True, index=True)
     processo: Mapped[str | None] = mapped_column(String(100), nullable=True, index=True)
     # Identificação do devedor (nome e documento) — úteis para contagens distintas
@@ -99,11 +116,13 @@ class CuratedRecord(Base):
     cobrador: Mapped[str | None] = mapped_column(String(100), nullable=True)
     dt_encerrado: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     dias_vencidos_cadastro: Mapped[int | None] = mapped_column(Integer, nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), server_default=func.now())
 
 
 class Indicator(Base):
     __tablename__ = 'indicators'
+    # Um indicador por chave em cada organização (alvo do upsert do bootstrap)
+    __table_args__ = (Index('ux_indicators_org_key', 'organization_id', 'key', unique=True),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     organization_id: Mapped[int] = mapped_column(Integer, index=True, nullable=False)
@@ -113,7 +132,7 @@ class Indicator(Base):
     formula_sql: Mapped[str | None] = mapped_column(Text)
     default_filters_json: Mapped[dict | None] = mapped_column(JSON)
     fmt: Mapped[str | None] = mapped_column(String(50))
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), server_default=func.now())
 
 
 class Dashboard(Base):
@@ -127,7 +146,10 @@ class Dashboard(Base):
     is_public: Mapped[bool] = mapped_column(Boolean, default=False)
     public_token: Mapped[str | None] = mapped_column(String(200))
     theme_json: Mapped[dict | None] = mapped_column(JSON)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), server_default=func.now())
+
+    # Gráficos: carregar com selectinload(Dashboard.charts); contagens via outerjoin + group_by
+    charts: Mapped[list["Chart"]] = relationship(back_populates="dashboard", lazy="raise_on_sql")
 
 
 class Chart(Base):
@@ -140,7 +162,9 @@ class Chart(Base):
     query_sql: Mapped[str] = mapped_column(Text)
     options_json: Mapped[dict | None] = mapped_column(JSON)
     position: Mapped[int | None] = mapped_column(Integer)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=func.now(), server_default=func.now())
+
+    dashboard: Mapped["Dashboard"] = relationship(back_populates="charts", lazy="raise_on_sql")
 
 
 class JobRun(Base):
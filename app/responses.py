@@ -0,0 +1,8 @@
+try:
+    import orjson  # noqa: F401
+    from fastapi.responses import ORJSONResponse as DefaultResponse
+except Exception:  # orjson é opcional; sem ele fica o json da stdlib
+    from fastapi.responses import JSONResponse as DefaultResponse
+
+
+__all__ = ["DefaultResponse"]
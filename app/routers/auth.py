@@ -1,6 +1,7 @@
+from functools import lru_cache
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import and_, bindparam, lambda_stmt, select
 
 from app.database import get_db
 from app.deps import get_current_ctx, DbSession
@@ -12,41 +13,78 @@ from app.security import create_access_token, hash_password, verify_password
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
+# Consultas montadas uma vez por processo; por request só entram os parâmetros
+_ORG_BY_SLUG = lambda_stmt(lambda: select(Organization).where(Organization.slug == bindparam('slug')))
+_USER_BY_EMAIL = lambda_stmt(lambda: select(User).where(User.email == bindparam('email')))
+_MEMBERSHIP = lambda_stmt(lambda: select(Membership).where(
+    Membership.user_id == bindparam('user_id'), Membership.organization_id == bindparam('org_id'),
+))
+
+_LOGIN_COLUMNS = (User.id, User.password_hash, Organization.id.label('org_id'), Membership.user_id.label('member_id'), Membership.role)
+# Com slug: a organização pedida e o vínculo (se houver) com ela
+_LOGIN_BY_SLUG = lambda_stmt(lambda: select(*_LOGIN_COLUMNS).select_from(User)
+    .outerjoin(Organization, Organization.slug == bindparam('slug'))
+    .outerjoin(Membership, and_(Membership.user_id == User.id, Membership.organization_id == Organization.id))
+    .where(User.email == bindparam('email')).limit(1))
+# Sem slug: primeira organização em que o usuário é membro
+_LOGIN_FIRST_ORG = lambda_stmt(lambda: select(*_LOGIN_COLUMNS).select_from(User)
+    .outerjoin(Membership, Membership.user_id == User.id)
+    .outerjoin(Organization, Organization.id == Membership.organization_id)
+    .where(User.email == bindparam('email')).limit(1))
+
+_CURRENT_USER = lambda_stmt(lambda: select(User.id, User.email, User.name, Organization.id.label('org_id'), Organization.slug, Membership.role)
+    .select_from(User)
+    .join(Organization, Organization.id == bindparam('org_id'))
+    .outerjoin(Membership, and_(Membership.user_id == User.id, Membership.organization_id == Organization.id))
+    .where(User.id == bindparam('user_id')))
+
+
+@lru_cache(maxsize=1)
+def _dev_password_hash() -> str:
+    # Hash da senha fixa do dev-login calculado uma vez por processo
+    return hash_password("dev")
+
+
 @router.post("/dev-login", response_model=TokenOut)
 def dev_login(payload: DevLoginIn, db: Session = Depends(get_db)):
     # Create organization if not exists
-    org = db.scalar(select(Organization).where(Organization.slug == payload.org_slug))
+    org = db.scalar(_ORG_BY_SLUG, {'slug': payload.org_slug})
     if not org:
         org = Organization(name=payload.org_name, slug=payload.org_slug, plan='dev')
         db.add(org)
         db.flush()
 
     # Create user if not exists
-    user = db.scalar(select(User).where(User.email == payload.email))
+    user = db.scalar(_USER_BY_EMAIL, {'email': payload.email})
     if not user:
-        user = User(email=payload.email, name=payload.name, password_hash=hash_password("dev"))
+        user = User(email=payload.email, name=payload.name, password_hash=_dev_password_hash())
         db.add(user)
         db.flush()
 
     # Ensure membership
-    member = db.scalar(select(Membership).where(Membership.user_id == user.id, Membership.organization_id == org.id))
+    member = db.scalar(_MEMBERSHIP, {'user_id': user.id, 'org_id': org.id})
     if not member:
-        db.add(Membership(user_id=user.id, organization_id=org.id, role='Owner'))
+        member = Membership(user_id=user.id, organization_id=org.id, role='Owner')
+        db.add(member)
+    role = member.role
 
     db.commit()
 
-    token = create_access_token(user_id=user.id, organization_id=org.id)
+    token = create_access_token(user_id=user.id, organization_id=org.id, role=role)
     return TokenOut(access_token=token)
 
 
 @router.post("/register", response_model=TokenOut)
 def register(payload: RegisterIn, db: Session = Depends(get_db)):
+    # pbkdf2 antes de tocar no banco: o hash não segura uma conexão do pool
+    password_hash = hash_password(payload.password)
+
     # Check existing user/org
-    user = db.scalar(select(User).where(User.email == payload.email))
+    user = db.scalar(_USER_BY_EMAIL, {'email': payload.email})
     if user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email já cadastrado")
 
-    org = db.scalar(select(Organization).where(Organization.slug == payload.org_slug))
+    org = db.scalar(_ORG_BY_SLUG, {'slug': payload.org_slug})
     if org:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Slug de organização já em uso")
 
@@ -54,61 +92,47 @@ def register(payload: RegisterIn, db: Session = Depends(get_db)):
     db.add(org)
     db.flush()
 
-    user = User(email=payload.email, name=payload.name, password_hash=hash_password(payload.password))
+    user = User(email=payload.email, name=payload.name, password_hash=password_hash)
     db.add(user)
     db.flush()
 
     db.add(Membership(user_id=user.id, organization_id=org.id, role='Owner'))
     db.commit()
 
-    token = create_access_token(user_id=user.id, organization_id=org.id)
+    token = create_access_token(user_id=user.id, organization_id=org.id, role='Owner')
     return TokenOut(access_token=token)
 
 
 @router.post("/login", response_model=TokenOut)
 def login(payload: LoginIn, db: Session = Depends(get_db)):
-    user = db.scalar(select(User).where(User.email == payload.email))
-    if not user or not verify_password(payload.password, user.password_hash):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais inválidas")
-
-    # Resolve org: by slug if provided else first membership
-    org = None
+    # Usuário + organização + vínculo numa única consulta
     if payload.org_slug:
-        org = db.scalar(select(Organization).where(Organization.slug == payload.org_slug))
+        row = db.execute(_LOGIN_BY_SLUG, {'email': payload.email, 'slug': payload.org_slug}).first()
     else:
-        m = db.scalar(select(Membership).where(Membership.user_id == user.id))
-        if m:
-            org = db.scalar(select(Organization).where(Organization.id == m.organization_id))
-    if not org:
+        row = db.execute(_LOGIN_FIRST_ORG, {'email': payload.email}).first()
+    # Devolve a conexão ao pool antes do pbkdf2 (CPU, dezenas de ms)
+    db.rollback()
+    if not row or not verify_password(payload.password, row.password_hash):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Credenciais inválidas")
+    if row.org_id is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Organização não encontrada para este usuário")
-
-    # Ensure membership exists
-    member = db.scalar(select(Membership).where(Membership.user_id == user.id, Membership.organization_id == org.id))
-    if not member:
+    if row.member_id is None:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Sem acesso à organização")
 
-    token = create_access_token(user_id=user.id, organization_id=org.id)
+    token = create_access_token(user_id=row.id, organization_id=row.org_id, role=row.role)
     return TokenOut(access_token=token)
 
 
 @router.get("/me", response_model=CurrentUserOut)
 def current_user(db: DbSession, ctx=Depends(get_current_ctx)):
-    user = db.get(User, ctx.user_id)
-    org = db.get(Organization, ctx.organization_id)
-    if not user or not org:
+    row = db.execute(_CURRENT_USER, {'user_id': ctx.user_id, 'org_id': ctx.organization_id}).first()
+    if not row:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Usuário ou organização não encontrados")
-    membership = db.scalar(
-        select(Membership.role).where(
-            Membership.user_id == user.id,
-            Membership.organization_id == org.id,
-        )
-    )
-    role = membership or None
     return CurrentUserOut(
-        id=user.id,
-        email=user.email,
-        name=user.name,
-        role=role,
-        organization_id=org.id,
-        organization_slug=org.slug,
+        id=row.id,
+        email=row.email,
+        name=row.name,
+        role=row.role or None,
+        organization_id=row.org_id,
+        organization_slug=row.slug,
     )
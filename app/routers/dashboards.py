@@ -1,35 +1,41 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import bindparam, insert, lambda_stmt, select
 from app.deps import get_current_ctx, DbSession
-from app.schemas import DashboardCreateIn, DashboardOut
+from app.schemas import DashboardCreateIn, DashboardOut, DashboardSummaryOut
 from app.models import Dashboard
 import secrets
 
 
 router = APIRouter(prefix="/dashboards", tags=["dashboards"])
 
+# Listagem sem os blobs JSON de layout/tema, montada uma vez por processo
+_DASHBOARD_SUMMARIES = lambda_stmt(lambda: select(Dashboard)
+    .options(load_only(Dashboard.id, Dashboard.name, Dashboard.description, Dashboard.is_public, Dashboard.public_token))
+    .where(Dashboard.organization_id == bindparam('org_id')))
+
 
 @router.post('', response_model=DashboardOut)
 def create_dashboard(payload: DashboardCreateIn, db: DbSession, ctx=Depends(get_current_ctx)):
-    d = Dashboard(
-        organization_id=ctx.organization_id,
-        name=payload.name,
-        description=payload.description,
-        layout_json=payload.layout_json or {},
-        is_public=payload.is_public,
-        public_token=secrets.token_urlsafe(16) if payload.is_public else None,
-        theme_json=payload.theme_json or {},
-    )
-    db.add(d)
+    # INSERT ... RETURNING: a linha criada volta no próprio insert, sem refresh
+    d = db.execute(
+        insert(Dashboard).values(
+            organization_id=ctx.organization_id,
+            name=payload.name,
+            description=payload.description,
+            layout_json=payload.layout_json or {},
+            is_public=payload.is_public,
+            public_token=secrets.token_hex(16) if payload.is_public else None,
+            theme_json=payload.theme_json or {},
+        ).returning(Dashboard)
+    ).scalar_one()
     db.commit()
-    db.refresh(d)
     return d
 
 
-@router.get('', response_model=list[DashboardOut])
+@router.get('', response_model=list[DashboardSummaryOut])
 def list_dashboards(db: DbSession, ctx=Depends(get_current_ctx)):
-    return db.scalars(select(Dashboard).where(Dashboard.organization_id == ctx.organization_id)).all()
+    return db.scalars(_DASHBOARD_SUMMARIES, {'org_id': ctx.organization_id}).all()
 
 
 @router.get('/{dashboard_id}', response_model=DashboardOut)
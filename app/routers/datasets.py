@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
 from sqlalchemy import select, text
-from datetime import datetime
 
-from app.deps import get_current_ctx, DbSession
-from app.utils.filters import is_safe_select, apply_placeholders
+from app.deps import get_current_ctx, DbSession, mutate_owned
+from app.utils.filters import is_safe_select, apply_placeholders, cached_text
+from app.utils.streaming import json_rows
 from app.models import DataSource  # placeholder import to keep consistency if later we link
 from pydantic import BaseModel
 from typing import Optional
@@ -42,8 +43,7 @@ def list_datasets(db: DbSession, ctx=Depends(get_current_ctx), credor_code: Opti
         sql += " AND credor_code = :credor_code"
         params["credor_code"] = credor_code
     sql += " ORDER BY id DESC"
-    rows = db.execute(text(sql), params).mappings().all()
-    return rows
+    return Response(json_rows(db.execute(text(sql), params), key=None), media_type="application/json")
 
 
 @router.post("")
@@ -53,12 +53,13 @@ def create_dataset(payload: DatasetCreateIn, db: DbSession, ctx=Depends(get_curr
     # Require tenant placeholder or an explicit filter
     if "{{tenant_id}}" not in payload.query_sql and "organization_id" not in payload.query_sql.lower():
         raise HTTPException(status_code=400, detail="Inclua {{tenant_id}} ou filtre por organization_id")
-    db.execute(text("""
-        INSERT INTO datasets (organization_id, name, description, query_sql, credor_code, created_at)
-        VALUES (:org, :n, :d, :q, :c, :now)
-    """), {"org": ctx.organization_id, "n": payload.name, "d": payload.description, "q": payload.query_sql, "c": payload.credor_code, "now": datetime.utcnow()})
-    db.commit()
-    row = db.execute(text("SELECT id, name, description, query_sql, credor_code FROM datasets WHERE organization_id=:org ORDER BY id DESC LIMIT 1"), {"org": ctx.organization_id}).mappings().first()
+    # RETURNING: a linha criada volta no próprio INSERT (sem o SELECT "último id" depois)
+    with db.begin():
+        row = db.execute(text("""
+            INSERT INTO datasets (organization_id, name, description, query_sql, credor_code, created_at)
+            VALUES (:org, :n, :d, :q, :c, CURRENT_TIMESTAMP)
+            RETURNING id, name, description, query_sql, credor_code
+        """), {"org": ctx.organization_id, "n": payload.name, "d": payload.description, "q": payload.query_sql, "c": payload.credor_code}).mappings().one()
     return row
 
 
@@ -85,15 +86,11 @@ def preview_dataset(payload: PreviewIn, db: DbSession, ctx=Depends(get_current_c
     })
     # Wrap with LIMIT for preview
     wrapped = f"SELECT * FROM ({sql}) t LIMIT 50"
-    rows = db.execute(text(wrapped), params).mappings().all()
+    rows = db.execute(cached_text(wrapped), params).mappings().all()
     return {"rows": rows, "count": len(rows)}
 
 
 @router.delete('/{dataset_id}')
 def delete_dataset(dataset_id: int, db: DbSession, ctx=Depends(get_current_ctx)):
-    row = db.execute(text("SELECT id FROM datasets WHERE id=:i AND organization_id=:o"), {"i": dataset_id, "o": ctx.organization_id}).first()
-    if not row:
-        raise HTTPException(status_code=404, detail="Dataset not found")
-    db.execute(text("DELETE FROM datasets WHERE id=:i"), {"i": dataset_id})
-    db.commit()
+    mutate_owned(db, "DELETE FROM datasets WHERE id=:i AND organization_id=:o", {"i": dataset_id, "o": ctx.organization_id}, "Dataset not found")
     return {"ok": True}
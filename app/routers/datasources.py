@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import delete, select
 
 from app.deps import get_current_ctx, DbSession
 from app.schemas import DataSourceTestIn, DataSourceCreateIn, DataSourceOut
@@ -31,7 +31,6 @@ def create_datasource(payload: DataSourceCreateIn, db: DbSession, ctx=Depends(ge
     )
     db.add(ds)
     db.commit()
-    db.refresh(ds)
     return ds
 
 
@@ -43,9 +42,10 @@ def list_datasources(db: DbSession, ctx=Depends(get_current_ctx)):
 
 @router.delete('/{data_source_id}')
 def delete_datasource(data_source_id: int, db: DbSession, ctx=Depends(get_current_ctx)):
-    ds = db.get(DataSource, data_source_id)
-    if not ds or ds.organization_id != ctx.organization_id:
+    # DELETE condicional: sem carregar a linha; rowcount 0 = inexistente ou de outro tenant
+    result = db.execute(delete(DataSource).where(DataSource.id == data_source_id, DataSource.organization_id == ctx.organization_id))
+    if result.rowcount == 0:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Data source not found")
-    db.delete(ds)
     db.commit()
     return {"ok": True}
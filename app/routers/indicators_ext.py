@@ -2,12 +2,27 @@
 from sqlalchemy import text
 from pydantic import BaseModel, field_validator
 
-from app.deps import get_current_ctx, DbSession
+from app.deps import get_current_ctx, DbSession, mutate_owned
 
 
 router = APIRouter(prefix="/indicators", tags=["indicators"])  # endpoints extras para categorias/pastas
 
 
+def _validate_hex_color(value: str | None) -> str | None:
+    if not value:
+        return None
+    value = value.strip()
+    digits = value[1:]
+    # int(..., 16) também aceitaria sinal, '_', espaços, dígitos unicode e o prefixo 0x
+    if not value.startswith('#') or len(digits) != 6 or not (digits.isascii() and digits.isalnum()) or digits[:2].lower() == '0x':
+        raise ValueError('Cor deve estar no formato #RRGGBB')
+    try:
+        int(digits, 16)
+    except ValueError:
+        raise ValueError('Cor deve estar no formato #RRGGBB')
+    return value
+
+
 class CategoryCreate(BaseModel):
     name: str
     color: str | None = None
@@ -23,16 +38,7 @@ class CategoryCreate(BaseModel):
     @field_validator('color')
     @classmethod
     def validate_color(cls, value: str | None) -> str | None:
-        if not value:
-            return None
-        value = value.strip()
-        if not value.startswith('#') or len(value) != 7:
-            raise ValueError('Cor deve estar no formato #RRGGBB')
-        hex_digits = set('0123456789abcdefABCDEF')
-        for ch in value[1:]:
-            if ch not in hex_digits:
-                raise ValueError('Cor deve estar no formato #RRGGBB')
-        return value
+        return _validate_hex_color(value)
 
 
 class CategoryUpdate(BaseModel):
@@ -52,51 +58,37 @@ class CategoryUpdate(BaseModel):
     @field_validator('color')
     @classmethod
     def validate_color(cls, value: str | None) -> str | None:
-        if not value:
-            return None
-        value = value.strip()
-        if not value.startswith('#') or len(value) != 7:
-            raise ValueError('Cor deve estar no formato #RRGGBB')
-        hex_digits = set('0123456789abcdefABCDEF')
-        for ch in value[1:]:
-            if ch not in hex_digits:
-                raise ValueError('Cor deve estar no formato #RRGGBB')
-        return value
+        return _validate_hex_color(value)
 
 
 @router.post('/{indicator_id}/move')
 def move_indicator(indicator_id: int, payload: dict, db: DbSession, ctx=Depends(get_current_ctx)):
     category = payload.get('category')
-    row = db.execute(text("SELECT id FROM indicators WHERE id=:i AND organization_id=:o"), {"i": indicator_id, "o": ctx.organization_id}).first()
-    if not row:
-        raise HTTPException(status_code=404, detail='Indicador nao encontrado')
-    db.execute(text("UPDATE indicators SET category=:c WHERE id=:i"), {"c": category, "i": indicator_id})
-    db.commit()
-    out = db.execute(text("SELECT id, key, name, dataset, fmt, category FROM indicators WHERE id=:i"), {"i": indicator_id}).mappings().first()
-    return out
+    return mutate_owned(
+        db, "UPDATE indicators SET category=:c WHERE id=:i AND organization_id=:o RETURNING id, key, name, dataset, fmt, category",
+        {"c": category, "i": indicator_id, "o": ctx.organization_id}, 'Indicador nao encontrado',
+    )
+
+
+# Pastas cadastradas primeiro, depois as categorias usadas só nos indicadores (mesma ordem de antes)
+_LIST_CATEGORIES = text(
+    """
+    SELECT name, color FROM (
+        SELECT 0 AS src, name, color FROM indicator_categories WHERE organization_id=:o
+        UNION ALL
+        SELECT DISTINCT 1 AS src, category AS name, NULL AS color
+        FROM indicators
+        WHERE organization_id=:o AND category IS NOT NULL AND category <> ''
+          AND category NOT IN (SELECT name FROM indicator_categories WHERE organization_id=:o)
+    ) c
+    ORDER BY src, name
+    """
+)
 
 
 @router.get('/categories')
 def list_categories(db: DbSession, ctx=Depends(get_current_ctx)):
-    existing = db.execute(
-        text("SELECT name, color FROM indicator_categories WHERE organization_id=:o ORDER BY name"),
-        {"o": ctx.organization_id}
-    ).mappings().all()
-    known = {row['name'] for row in existing}
-    extras = sorted(db.execute(
-        text(
-            """
-            SELECT DISTINCT category AS name
-            FROM indicators
-            WHERE organization_id=:o AND category IS NOT NULL AND category <> ''
-            """
-        ),
-        {"o": ctx.organization_id}
-    ).scalars().all())
-    for name in extras:
-        if name not in known:
-            existing.append({"name": name, "color": None})
-    return existing
+    return db.execute(_LIST_CATEGORIES, {"o": ctx.organization_id}).mappings().all()
 
 
 @router.post('/categories')
@@ -104,16 +96,17 @@ def create_category(payload: CategoryCreate, db: DbSession, ctx=Depends(get_curr
     name = payload.name
     color = payload.color
     try:
-        result = db.execute(
-            text("UPDATE indicator_categories SET color=:c WHERE organization_id=:o AND name=:n"),
-            {"o": ctx.organization_id, "n": name, "c": color}
-        )
-        if result.rowcount == 0:
-            db.execute(
-                text("INSERT INTO indicator_categories (organization_id, name, color) VALUES (:o, :n, :c)"),
+        # Uma transação explícita: commit único (ou rollback) ao sair do bloco
+        with db.begin():
+            result = db.execute(
+                text("UPDATE indicator_categories SET color=:c WHERE organization_id=:o AND name=:n"),
                 {"o": ctx.organization_id, "n": name, "c": color}
             )
-        db.commit()
+            if result.rowcount == 0:
+                db.execute(
+                    text("INSERT INTO indicator_categories (organization_id, name, color) VALUES (:o, :n, :c)"),
+                    {"o": ctx.organization_id, "n": name, "c": color}
+                )
         return {"ok": True, "name": name, "color": color}
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc))
@@ -127,34 +120,35 @@ def update_category(current_name: str, payload: CategoryUpdate, db: DbSession, c
     new_name = payload.name.strip() if payload.name else original
     color = payload.color
     try:
-        row = db.execute(
-            text("SELECT id FROM indicator_categories WHERE organization_id=:o AND name=:n"),
-            {"o": ctx.organization_id, "n": original}
-        ).first()
-        if not row:
-            db.execute(
-                text("INSERT OR IGNORE INTO indicator_categories (organization_id, name, color) VALUES (:o, :n, :c)"),
-                {"o": ctx.organization_id, "n": original, "c": color}
-            )
-        if new_name != original:
-            db.execute(
-                text("UPDATE indicators SET category=:new WHERE organization_id=:o AND category=:old"),
-                {"new": new_name, "o": ctx.organization_id, "old": original}
-            )
-            db.execute(
-                text("UPDATE indicator_categories SET name=:new WHERE organization_id=:o AND name=:old"),
-                {"new": new_name, "o": ctx.organization_id, "old": original}
-            )
-        if color is not None:
-            db.execute(
-                text("UPDATE indicator_categories SET color=:c WHERE organization_id=:o AND name=:n"),
-                {"c": color, "o": ctx.organization_id, "n": new_name}
-            )
-        db.commit()
-        result = db.execute(
-            text("SELECT name, color FROM indicator_categories WHERE organization_id=:o AND name=:n"),
-            {"o": ctx.organization_id, "n": new_name}
-        ).mappings().first()
+        # Todos os passos (e a leitura final) numa única transação, com um só commit
+        with db.begin():
+            exists = db.execute(
+                text("SELECT 1 FROM indicator_categories WHERE organization_id=:o AND name=:n"),
+                {"o": ctx.organization_id, "n": original}
+            ).scalar()
+            if not exists:
+                db.execute(
+                    text("INSERT OR IGNORE INTO indicator_categories (organization_id, name, color) VALUES (:o, :n, :c)"),
+                    {"o": ctx.organization_id, "n": original, "c": color}
+                )
+            if new_name != original:
+                db.execute(
+                    text("UPDATE indicators SET category=:new WHERE organization_id=:o AND category=:old"),
+                    {"new": new_name, "o": ctx.organization_id, "old": original}
+                )
+                db.execute(
+                    text("UPDATE indicator_categories SET name=:new WHERE organization_id=:o AND name=:old"),
+                    {"new": new_name, "o": ctx.organization_id, "old": original}
+                )
+            if color is not None:
+                db.execute(
+                    text("UPDATE indicator_categories SET color=:c WHERE organization_id=:o AND name=:n"),
+                    {"c": color, "o": ctx.organization_id, "n": new_name}
+                )
+            result = db.execute(
+                text("SELECT name, color FROM indicator_categories WHERE organization_id=:o AND name=:n"),
+                {"o": ctx.organization_id, "n": new_name}
+            ).mappings().first()
         return result or {"name": new_name, "color": color}
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc))
@@ -166,15 +160,15 @@ def delete_category(name: str, db: DbSession, ctx=Depends(get_current_ctx)):
     if not trimmed:
         raise HTTPException(status_code=400, detail='Nome invalido')
     try:
-        db.execute(
-            text("UPDATE indicators SET category=NULL WHERE organization_id=:o AND category=:n"),
-            {"o": ctx.organization_id, "n": trimmed}
-        )
-        db.execute(
-            text("DELETE FROM indicator_categories WHERE organization_id=:o AND name=:n"),
-            {"o": ctx.organization_id, "n": trimmed}
-        )
-        db.commit()
+        with db.begin():
+            db.execute(
+                text("UPDATE indicators SET category=NULL WHERE organization_id=:o AND category=:n"),
+                {"o": ctx.organization_id, "n": trimmed}
+            )
+            db.execute(
+                text("DELETE FROM indicator_categories WHERE organization_id=:o AND name=:n"),
+                {"o": ctx.organization_id, "n": trimmed}
+            )
         return {"ok": True, "name": trimmed}
     except Exception as exc:
         raise HTTPException(status_code=400, detail=str(exc))
@@ -1,135 +1,164 @@
-from datetime import date
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta
+from threading import Lock
+from time import monotonic
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import text
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy import DateTime, bindparam, column, func, insert, select, table, text
 from pydantic import BaseModel, Field, ConfigDict
 
-from app.deps import get_current_ctx, DbSession
-from app.utils.filters import is_safe_select, apply_placeholders
+from app.deps import get_current_ctx, DbSession, mutate_owned
+from app.responses import DefaultResponse
+from app.schema_sync import has_unique_key
+from app.utils.filters import is_safe_select, apply_placeholders, cached_text
+from app.utils.result_cache import cached_result
+from app.utils.streaming import close_stream, json_rows, stream_json_rows
 
 
 router = APIRouter(prefix="/indicators", tags=["indicators"])  # clean ASCII-only version
 
 
-@router.get('/valor-mes-a-mes')
-def valor_mes_a_mes(db: DbSession, ctx=Depends(get_current_ctx), from_: Optional[date] = None, to: Optional[date] = None,
-                    uf: Optional[str] = None, situacao_processo: Optional[str] = None):
-    sql = """
-    SELECT strftime('%Y-%m', dt_cadastro) AS ym, COALESCE(SUM(vl_titulo), 0) AS total
+def _by_period(template: str) -> dict:
+    """Uma variante da consulta por combinação de limites presentes (from, to).
+
+    O período de dt_cadastro é o intervalo semiaberto [from, to + 1 dia) e a coluna é
+    comparada crua (sem date()/CAST por linha). Só os limites informados entram no SQL,
+    sem "(:x IS NULL OR ...)", para o planner usar o range no índice (organization_id, dt_cadastro).
+    """
+    variants = {}
+    for has_from in (False, True):
+        for has_to in (False, True):
+            period = ""
+            params = []
+            if has_from:
+                period += "\n      AND dt_cadastro >= :from"
+                params.append(bindparam('from', type_=DateTime()))
+            if has_to:
+                period += "\n      AND dt_cadastro < :to"
+                params.append(bindparam('to', type_=DateTime()))
+            variants[(has_from, has_to)] = text(template.format(period=period)).bindparams(*params)
+    return variants
+
+
+SQL_VALOR_MES_A_MES = _by_period("""
+    SELECT ym, COALESCE(SUM(vl_titulo), 0) AS total
     FROM curated_records
-    WHERE organization_id = :tenant_id
-      AND (:from IS NULL OR date(dt_cadastro) >= :from)
-      AND (:to IS NULL OR date(dt_cadastro) <= :to)
+    WHERE organization_id = :tenant_id{period}
       AND (:uf IS NULL OR uf = :uf)
       AND (:situacao_processo IS NULL OR situacao_processo = :situacao_processo)
     GROUP BY ym
     ORDER BY ym
-    """
-    params = {
-        'tenant_id': ctx.organization_id,
-        'from': from_,
-        'to': to,
-        'uf': uf,
-        'situacao_processo': situacao_processo,
-    }
-    rows = db.execute(text(sql), params).mappings().all()
-    return {"series": rows}
-
+""")
 
-@router.get('/mapa-por-uf')
-def mapa_por_uf(db: DbSession, ctx=Depends(get_current_ctx), from_: Optional[date] = None, to: Optional[date] = None):
-    sql = """
+SQL_MAPA_POR_UF = _by_period("""
     SELECT uf, COALESCE(SUM(vl_titulo), 0) AS total
     FROM curated_records
-    WHERE organization_id = :tenant_id
-      AND (:from IS NULL OR date(dt_cadastro) >= :from)
-      AND (:to IS NULL OR date(dt_cadastro) <= :to)
+    WHERE organization_id = :tenant_id{period}
     GROUP BY uf
     ORDER BY total DESC
-    """
-    rows = db.execute(text(sql), {'tenant_id': ctx.organization_id, 'from': from_, 'to': to}).mappings().all()
-    return {"series": rows}
-
-
-@router.get('/total-por-faixa-vencimento')
-def total_por_faixa_vencimento(db: DbSession, ctx=Depends(get_current_ctx)):
-    # Calcula a faixa dinamicamente com base nos dias em atraso do dt_vencimento
-    # para refletir a planilha (0-30, 31-60, 61-90, 91-180, 181-360, 361-720, >720, vazio)
-    sql = """
+""")
+
+
+def _period_params(from_: Optional[date], to: Optional[date]) -> dict:
+    # "até o dia X" inclusive vira "antes da meia-noite do dia seguinte"
+    params = {}
+    if from_:
+        params['from'] = datetime.combine(from_, time.min)
+    if to:
+        params['to'] = datetime.combine(to + timedelta(days=1), time.min)
+    return params
+
+# Faixas de atraso da planilha: (limite em dias, rótulo); acima do último é 'Mais de 720 dias'
+_FAIXAS = [
+    (30, '0 a 30 dias'),
+    (60, '31 a 60 dias'),
+    (90, '61 a 90 dias'),
+    (180, '91 a 180 dias'),
+    (360, '181 a 360 dias'),
+    (720, '361 a 720 dias'),
+]
+
+
+def _faixa_sql(value_column: str):
+    # "dias em atraso <= N" equivale a "dt_vencimento >= agora - N dias": os limites são
+    # calculados uma vez por consulta (_faixa_params) e cada linha só compara a própria data,
+    # sem aritmética de datas por linha, o que deixa o índice (organization_id, dt_vencimento) servir
+    whens = "\n".join(f"          WHEN dt_vencimento >= :limite_{dias} THEN '{label}'" for dias, label in _FAIXAS)
+    order = "\n".join(f"        WHEN '{label}' THEN {pos}" for pos, (_dias, label) in enumerate(_FAIXAS, start=1))
+    return text(f"""
     WITH base AS (
       SELECT
         CASE
           WHEN dt_vencimento IS NULL THEN 'vazio'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 30 THEN '0 a 30 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 60 THEN '31 a 60 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 90 THEN '61 a 90 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 180 THEN '91 a 180 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 360 THEN '181 a 360 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 720 THEN '361 a 720 dias'
+{whens}
           ELSE 'Mais de 720 dias'
         END AS faixa_vencimento,
-        vl_titulo
+        {value_column}
       FROM curated_records
       WHERE organization_id = :tenant_id
     )
-    SELECT faixa_vencimento, COALESCE(SUM(vl_titulo), 0) AS total
+    SELECT faixa_vencimento, COALESCE(SUM({value_column}), 0) AS total
     FROM base
     GROUP BY faixa_vencimento
     ORDER BY
       CASE faixa_vencimento
-        WHEN '0 a 30 dias' THEN 1
-        WHEN '31 a 60 dias' THEN 2
-        WHEN '61 a 90 dias' THEN 3
-        WHEN '91 a 180 dias' THEN 4
-        WHEN '181 a 360 dias' THEN 5
-        WHEN '361 a 720 dias' THEN 6
-        WHEN 'Mais de 720 dias' THEN 7
-        WHEN 'vazio' THEN 8
-        ELSE 9
+{order}
+        WHEN 'Mais de 720 dias' THEN {len(_FAIXAS) + 1}
+        WHEN 'vazio' THEN {len(_FAIXAS) + 2}
+        ELSE {len(_FAIXAS) + 3}
       END
-    """
-    rows = db.execute(text(sql), {'tenant_id': ctx.organization_id}).mappings().all()
-    return {"series": rows}
+    """).bindparams(*(bindparam(f"limite_{dias}", type_=DateTime()) for dias, _label in _FAIXAS))
+
+
+def _faixa_params(organization_id: int) -> dict:
+    now = datetime.utcnow()
+    return {'tenant_id': organization_id, **{f"limite_{dias}": now - timedelta(days=dias) for dias, _label in _FAIXAS}}
+
+
+SQL_TOTAL_POR_FAIXA = _faixa_sql('vl_titulo')
+SQL_RECUPERADO_POR_FAIXA = _faixa_sql('vl_total_repasse')
+
+
+def _cached_series(endpoint: str, organization_id: int, params, run) -> Response:
+    # Corpo serializado uma vez (orjson, sem jsonable_encoder); o cache guarda os bytes
+    # prontos, que também servem ao backend Redis
+    body = cached_result(endpoint, organization_id, params,
+                         lambda: DefaultResponse({"series": [dict(row) for row in run().mappings()]}).body)
+    return Response(body, media_type="application/json")
+
+
+@router.get('/valor-mes-a-mes')
+def valor_mes_a_mes(db: DbSession, ctx=Depends(get_current_ctx), from_: Optional[date] = None, to: Optional[date] = None,
+                    uf: Optional[str] = None, situacao_processo: Optional[str] = None):
+    params = {
+        'tenant_id': ctx.organization_id,
+        **_period_params(from_, to),
+        'uf': uf,
+        'situacao_processo': situacao_processo,
+    }
+    return _cached_series('valor-mes-a-mes', ctx.organization_id, (from_, to, uf, situacao_processo),
+                          lambda: db.execute(SQL_VALOR_MES_A_MES[(from_ is not None, to is not None)], params))
+
+
+@router.get('/mapa-por-uf')
+def mapa_por_uf(db: DbSession, ctx=Depends(get_current_ctx), from_: Optional[date] = None, to: Optional[date] = None):
+    return _cached_series('mapa-por-uf', ctx.organization_id, (from_, to),
+                          lambda: db.execute(SQL_MAPA_POR_UF[(from_ is not None, to is not None)], {'tenant_id': ctx.organization_id, **_period_params(from_, to)}))
+
+
+@router.get('/total-por-faixa-vencimento')
+def total_por_faixa_vencimento(db: DbSession, ctx=Depends(get_current_ctx)):
+    return _cached_series('total-por-faixa-vencimento', ctx.organization_id, (),
+                          lambda: db.execute(SQL_TOTAL_POR_FAIXA, _faixa_params(ctx.organization_id)))
 
 
 @router.get('/recuperado-por-faixa-vencimento')
 def recuperado_por_faixa_vencimento(db: DbSession, ctx=Depends(get_current_ctx)):
-    sql = """
-    WITH base AS (
-      SELECT
-        CASE
-          WHEN dt_vencimento IS NULL THEN 'vazio'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 30 THEN '0 a 30 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 60 THEN '31 a 60 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 90 THEN '61 a 90 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 180 THEN '91 a 180 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 360 THEN '181 a 360 dias'
-          WHEN (julianday('now') - julianday(dt_vencimento)) <= 720 THEN '361 a 720 dias'
-          ELSE 'Mais de 720 dias'
-        END AS faixa_vencimento,
-        vl_total_repasse
-      FROM curated_records
-      WHERE organization_id = :tenant_id
-    )
-    SELECT faixa_vencimento, COALESCE(SUM(vl_total_repasse), 0) AS total
-    FROM base
-    GROUP BY faixa_vencimento
-    ORDER BY
-      CASE faixa_vencimento
-        WHEN '0 a 30 dias' THEN 1
-        WHEN '31 a 60 dias' THEN 2
-        WHEN '61 a 90 dias' THEN 3
-        WHEN '91 a 180 dias' THEN 4
-        WHEN '181 a 360 dias' THEN 5
-        WHEN '361 a 720 dias' THEN 6
-        WHEN 'Mais de 720 dias' THEN 7
-        WHEN 'vazio' THEN 8
-        ELSE 9
-      END
-    """
-    rows = db.execute(text(sql), {'tenant_id': ctx.organization_id}).mappings().all()
-    return {"series": rows}
+    return _cached_series('recuperado-por-faixa-vencimento', ctx.organization_id, (),
+                          lambda: db.execute(SQL_RECUPERADO_POR_FAIXA, _faixa_params(ctx.organization_id)))
 
 
 class IndicatorCreate(BaseModel):
@@ -153,8 +182,43 @@ def list_indicators(db: DbSession, ctx=Depends(get_current_ctx), credor_code: Op
         sql += " AND credor_code = :c"
         params["c"] = credor_code
     sql += " ORDER BY COALESCE(NULLIF(category,''),'~'), name"
-    rows = db.execute(text(sql), params).mappings().all()
-    return rows
+    return Response(json_rows(db.execute(text(sql), params), key=None), media_type="application/json")
+
+
+# Upsert por (organization_id, key) num único statement atômico (índice único da migration 0007)
+_CREATE_UPSERT = text("""
+    INSERT INTO indicators (organization_id, key, name, dataset, formula_sql, fmt, category, credor_code, created_at)
+    VALUES (:o, :k, :n, :d, :f, :fmt, :c, :cc, CURRENT_TIMESTAMP)
+    ON CONFLICT (organization_id, key) DO UPDATE SET
+      name=excluded.name, dataset=excluded.dataset, formula_sql=excluded.formula_sql,
+      fmt=excluded.fmt, category=excluded.category, credor_code=excluded.credor_code
+    RETURNING id, key, name, dataset, fmt, category, credor_code
+""")
+
+
+def _can_upsert(db) -> bool:
+    # ON CONFLICT exige o índice único; o caminho é escolhido pelo schema, nunca por um erro
+    return has_unique_key(db.get_bind(), 'indicators', ('organization_id', 'key'))
+
+
+def _create_without_upsert(db, params: dict):
+    # Banco sem o índice único: SELECT + UPDATE/INSERT, ainda com RETURNING
+    existing_id = db.execute(text("SELECT id FROM indicators WHERE organization_id=:o AND key=:k"), params).scalar()
+    if existing_id is not None:
+        return db.execute(text(
+            """
+            UPDATE indicators SET name=:n, dataset=:d, formula_sql=:f, fmt=:fmt, category=:c, credor_code=:cc
+            WHERE id=:id
+            RETURNING id, key, name, dataset, fmt, category, credor_code
+            """
+        ), {**params, "id": existing_id}).mappings().one()
+    return db.execute(text(
+        """
+        INSERT INTO indicators (organization_id, key, name, dataset, formula_sql, fmt, category, credor_code, created_at)
+        VALUES (:o, :k, :n, :d, :f, :fmt, :c, :cc, CURRENT_TIMESTAMP)
+        RETURNING id, key, name, dataset, fmt, category, credor_code
+        """
+    ), params).mappings().one()
 
 
 @router.post("")
@@ -162,28 +226,15 @@ def create_indicator(payload: IndicatorCreate, db: DbSession, ctx=Depends(get_cu
     sql = (payload.formula_sql or '').lstrip('\ufeff').strip()
     if not is_safe_select(sql):
         raise HTTPException(status_code=400, detail="Only SELECT statements are allowed")
-    # upsert by (org, key)
-    existing = db.execute(text("SELECT id FROM indicators WHERE organization_id=:o AND key=:k"), {"o": ctx.organization_id, "k": payload.key}).first()
-    if existing:
-        db.execute(text(
-            """
-            UPDATE indicators SET name=:n, dataset=:d, formula_sql=:f, fmt=:fmt, category=:c, credor_code=:cc
-            WHERE id=:id
-            """
-        ), {"n": payload.name, "d": payload.dataset, "f": sql, "fmt": payload.fmt, "c": payload.category, "cc": payload.credor_code, "id": existing[0]})
-        db.commit()
-        row = db.execute(text("SELECT id, key, name, dataset, fmt, category, credor_code FROM indicators WHERE id=:id"), {"id": existing[0]}).mappings().first()
-        return row
-    else:
-        db.execute(text(
-            """
-            INSERT INTO indicators (organization_id, key, name, dataset, formula_sql, fmt, category, credor_code, created_at)
-            VALUES (:o, :k, :n, :d, :f, :fmt, :c, :cc, CURRENT_TIMESTAMP)
-            """
-        ), {"o": ctx.organization_id, "k": payload.key, "n": payload.name, "d": payload.dataset, "f": sql, "fmt": payload.fmt, "c": payload.category, "cc": payload.credor_code})
-        db.commit()
-        row = db.execute(text("SELECT id, key, name, dataset, fmt, category, credor_code FROM indicators WHERE organization_id=:o AND key=:k"), {"o": ctx.organization_id, "k": payload.key}).mappings().first()
-        return row
+    params = {"o": ctx.organization_id, "k": payload.key, "n": payload.name, "d": payload.dataset, "f": sql,
+              "fmt": payload.fmt, "c": payload.category, "cc": payload.credor_code}
+    with db.begin():
+        if _can_upsert(db):
+            row = db.execute(_CREATE_UPSERT, params).mappings().one()
+        else:
+            row = _create_without_upsert(db, params)
+    _forget_sources(ctx.organization_id, row["id"])
+    return row
 
 
 class IndicatorRunIn(BaseModel):
@@ -204,18 +255,60 @@ def preview_indicator(body: IndicatorCreate, db: DbSession, ctx=Depends(get_curr
         raise HTTPException(status_code=400, detail="Only SELECT is allowed")
     sql = sql.replace("{{tenant_id}}", ":tenant_id")
     wrapped = f"SELECT * FROM ({sql}) t LIMIT 200"
-    rows = db.execute(text(wrapped), {"tenant_id": ctx.organization_id}).mappings().all()
-    return {"rows": [dict(row) for row in rows]}
+    result = db.execute(cached_text(wrapped), {"tenant_id": ctx.organization_id})
+    return Response(json_rows(result), media_type="application/json")
+
+
+# Fonte de cada indicador (SQL já limpo e validado + credor) para o /run, sem o SELECT
+# nem a validação a cada execução.
+# Por processo: create/patch/delete/bootstrap invalidam aqui; uma edição feita em outro
+# worker aparece em até _SOURCE_TTL segundos.
+_SOURCE_TTL = 60
+_SOURCE_SIZE = 10000
+_sources: "OrderedDict[tuple[int, int], tuple[float, str | None, Optional[str]]]" = OrderedDict()
+_sources_lock = Lock()
+
+
+def _indicator_source(db, organization_id: int, indicator_id: int) -> tuple[str | None, Optional[str]] | None:
+    """(sql, credor) do indicador, ou None se não existe; sql é None se não passou no is_safe_select."""
+    key = (organization_id, indicator_id)
+    now = monotonic()
+    with _sources_lock:
+        hit = _sources.get(key)
+        if hit is not None and hit[0] > now:
+            _sources.move_to_end(key)
+            return hit[1], hit[2]
+    row = db.execute(text("SELECT formula_sql, credor_code FROM indicators WHERE id=:i AND organization_id=:o"), {"i": indicator_id, "o": organization_id}).first()
+    if not row:
+        return None
+    sql = (row[0] or '').lstrip('\ufeff').strip().rstrip(';')
+    # Validado uma vez por carga; o resultado fica junto da fonte
+    if not is_safe_select(sql):
+        sql = None
+    with _sources_lock:
+        _sources[key] = (now + _SOURCE_TTL, sql, row[1])
+        _sources.move_to_end(key)
+        while len(_sources) > _SOURCE_SIZE:
+            _sources.popitem(last=False)
+    return sql, row[1]
+
+
+def _forget_sources(organization_id: int, indicator_id: int | None = None) -> None:
+    with _sources_lock:
+        if indicator_id is not None:
+            _sources.pop((organization_id, indicator_id), None)
+            return
+        for key in [k for k in _sources if k[0] == organization_id]:
+            del _sources[key]
 
 
 @router.post('/{indicator_id:int}/run')
 def run_indicator(indicator_id: int, body: IndicatorRunIn, db: DbSession, ctx=Depends(get_current_ctx)):
-    row = db.execute(text("SELECT formula_sql, credor_code FROM indicators WHERE id=:i AND organization_id=:o"), {"i": indicator_id, "o": ctx.organization_id}).first()
-    if not row:
+    source = _indicator_source(db, ctx.organization_id, indicator_id)
+    if source is None:
         raise HTTPException(status_code=404, detail="Indicator not found")
-    sql = (row[0] or '').lstrip('\ufeff').strip().rstrip(';')
-    ind_credor = row[1] if row and len(row) > 1 else None
-    if not is_safe_select(sql):
+    sql, ind_credor = source
+    if sql is None:
         raise HTTPException(status_code=400, detail="Invalid SQL")
     # apply placeholders (tenant_id + optional filters)
     sql, params = apply_placeholders(sql, {
@@ -227,12 +320,17 @@ def run_indicator(indicator_id: int, body: IndicatorRunIn, db: DbSession, ctx=De
         'credor_code': body.credor_code or ind_credor,
         'date_field': body.date_field,
     })
+    # Conexão própria com cursor em streaming: a sessão do request fecha antes do corpo
+    # ser enviado, e as linhas vão para o cliente em pedaços em vez de uma lista inteira
+    conn = db.get_bind().connect()
     try:
-        rows = db.execute(text(sql), params).mappings().all()
-        return {"rows": [dict(row) for row in rows]}
+        result = conn.execution_options(stream_results=True).execute(cached_text(sql), params)
     except Exception as e:
+        conn.close()
         # Report SQL error clearly to the client
         raise HTTPException(status_code=400, detail=f"SQL error: {e}")
+    return StreamingResponse(stream_json_rows(conn, result), media_type="application/json",
+                             background=BackgroundTask(close_stream, conn, result))
 
 
 class IndicatorUpdate(BaseModel):
@@ -241,20 +339,26 @@ class IndicatorUpdate(BaseModel):
     credor_code: Optional[str] = None
 
 
+_INDICATOR_COLUMNS = "id, key, name, dataset, fmt, category, credor_code"
+
+
 @router.patch('/{indicator_id:int}')
 def patch_indicator(indicator_id: int, payload: IndicatorUpdate, db: DbSession, ctx=Depends(get_current_ctx)):
-    row = db.execute(text("SELECT id FROM indicators WHERE id=:i AND organization_id=:o"), {"i": indicator_id, "o": ctx.organization_id}).first()
-    if not row:
-        raise HTTPException(status_code=404, detail="Indicator not found")
-    if payload.fmt is not None:
-        db.execute(text("UPDATE indicators SET fmt=:f WHERE id=:i"), {"f": payload.fmt, "i": indicator_id})
-    if payload.category is not None:
-        db.execute(text("UPDATE indicators SET category=:c WHERE id=:i"), {"c": payload.category, "i": indicator_id})
-    if payload.credor_code is not None:
-        db.execute(text("UPDATE indicators SET credor_code=:cc WHERE id=:i"), {"cc": payload.credor_code, "i": indicator_id})
-    db.commit()
-    result = db.execute(text("SELECT id, key, name, dataset, fmt, category, credor_code FROM indicators WHERE id=:i"), {"i": indicator_id}).mappings().first()
-    return result
+    # Um único UPDATE com os campos enviados (nomes fixos), restrito ao tenant, devolvendo a linha
+    values = {"fmt": payload.fmt, "category": payload.category, "credor_code": payload.credor_code}
+    sets = [f"{col}=:{col}" for col, value in values.items() if value is not None]
+    params = {"i": indicator_id, "o": ctx.organization_id, **{col: value for col, value in values.items() if value is not None}}
+    if not sets:
+        row = db.execute(text(f"SELECT {_INDICATOR_COLUMNS} FROM indicators WHERE id=:i AND organization_id=:o"), params).mappings().first()
+        if not row:
+            raise HTTPException(status_code=404, detail="Indicator not found")
+        return row
+    row = mutate_owned(
+        db, f"UPDATE indicators SET {', '.join(sets)} WHERE id=:i AND organization_id=:o RETURNING {_INDICATOR_COLUMNS}",
+        params, "Indicator not found",
+    )
+    _forget_sources(ctx.organization_id, indicator_id)
+    return row
 
 @router.get('/{indicator_id:int}')
 def get_indicator(indicator_id: int, db: DbSession, ctx=Depends(get_current_ctx)):
@@ -265,48 +369,94 @@ def get_indicator(indicator_id: int, db: DbSession, ctx=Depends(get_current_ctx)
 
 @router.delete('/{indicator_id:int}')
 def delete_indicator(indicator_id: int, db: DbSession, ctx=Depends(get_current_ctx)):
-    row = db.execute(text("SELECT id FROM indicators WHERE id=:i AND organization_id=:o"), {"i": indicator_id, "o": ctx.organization_id}).first()
-    if not row:
-        raise HTTPException(status_code=404, detail="Indicator not found")
-    db.execute(text("DELETE FROM indicators WHERE id=:i"), {"i": indicator_id})
-    db.commit()
+    mutate_owned(db, "DELETE FROM indicators WHERE id=:i AND organization_id=:o", {"i": indicator_id, "o": ctx.organization_id}, "Indicator not found")
+    _forget_sources(ctx.organization_id, indicator_id)
     return {"ok": True}
 
 
+_BOOTSTRAP_TEMPLATES = [
+    ("valor_mes_a_mes", "Valor Mes a Mes", "line", "Cobranca", """
+        SELECT ym, SUM(vl_titulo) AS total
+        FROM curated_records
+        WHERE organization_id={{tenant_id}}
+        GROUP BY ym
+        ORDER BY ym
+    """),
+    ("mapa_por_uf", "Mapa por UF", "map_br", "Cobranca", """
+        SELECT uf, SUM(vl_titulo) AS total
+        FROM curated_records
+        WHERE organization_id={{tenant_id}}
+        GROUP BY uf
+        ORDER BY total DESC
+    """),
+    ("total_por_faixa_vencimento", "Total por Faixa de Vencimento", "bar", "Cobranca", """
+        SELECT faixa_vencimento, SUM(vl_titulo) AS total
+        FROM curated_records
+        WHERE organization_id={{tenant_id}}
+        GROUP BY faixa_vencimento
+        ORDER BY total DESC
+    """),
+    ("recuperado_por_faixa_vencimento", "Recuperado por Faixa de Vencimento", "bar", "Cobranca", """
+        SELECT faixa_vencimento, SUM(vl_total_repasse) AS total
+        FROM curated_records
+        WHERE organization_id={{tenant_id}}
+        GROUP BY faixa_vencimento
+        ORDER BY total DESC
+    """),
+]
+
+# Todos os templates num único INSERT multi-linha com upsert por (organization_id, key)
+_BOOTSTRAP_UPSERT = text(
+    "INSERT INTO indicators (organization_id, key, name, dataset, formula_sql, fmt, category, credor_code, created_at) VALUES "
+    + ", ".join(f"(:o, :k{i}, :n{i}, NULL, :f{i}, :fmt{i}, :c{i}, NULL, CURRENT_TIMESTAMP)" for i in range(len(_BOOTSTRAP_TEMPLATES)))
+    + " ON CONFLICT (organization_id, key) DO UPDATE SET name=excluded.name, dataset=excluded.dataset,"
+    " formula_sql=excluded.formula_sql, fmt=excluded.fmt, category=excluded.category, credor_code=excluded.credor_code"
+)
+_BOOTSTRAP_PARAMS = {
+    name: value
+    for i, (key, label, fmt, category, sql) in enumerate(_BOOTSTRAP_TEMPLATES)
+    for name, value in ((f"k{i}", key), (f"n{i}", label), (f"f{i}", sql.strip()), (f"fmt{i}", fmt), (f"c{i}", category))
+}
+
+
+# Só as colunas gravadas pelo bootstrap (o model Indicator não mapeia category/credor_code)
+_indicators = table(
+    'indicators',
+    column('id'), column('organization_id'), column('key'), column('name'), column('dataset'),
+    column('formula_sql'), column('fmt'), column('category'), column('credor_code'), column('created_at'),
+)
+
+
+def _bootstrap_without_upsert(db, org_id: int) -> None:
+    # 1 SELECT das chaves existentes + 1 executemany de UPDATE + 1 INSERT em lote (insertmanyvalues);
+    # roda dentro da transação de quem chama
+    rows = [
+        {"organization_id": org_id, "key": key, "name": name, "dataset": None, "formula_sql": sql.strip(),
+         "fmt": fmt, "category": category, "credor_code": None}
+        for key, name, fmt, category, sql in _BOOTSTRAP_TEMPLATES
+    ]
+    existing = dict(db.execute(
+        select(_indicators.c.key, _indicators.c.id)
+        .where(_indicators.c.organization_id == org_id, _indicators.c.key.in_([r["key"] for r in rows]))
+    ).all())
+    updates = [{**r, "id": existing[r["key"]]} for r in rows if r["key"] in existing]
+    inserts = [r for r in rows if r["key"] not in existing]
+    if updates:
+        db.execute(text(
+            "UPDATE indicators SET name=:name, dataset=:dataset, formula_sql=:formula_sql, fmt=:fmt,"
+            " category=:category, credor_code=:credor_code WHERE id=:id"
+        ), updates)
+    if inserts:
+        db.execute(insert(_indicators).values(created_at=func.now()), inserts)
+
+
 @router.post('/bootstrap')
 def bootstrap_indicators(db: DbSession, ctx=Depends(get_current_ctx)):
-    templates = [
-        ("valor_mes_a_mes", "Valor Mes a Mes", "line", "Cobranca", """
-            SELECT strftime('%Y-%m', dt_cadastro) AS ym, SUM(vl_titulo) AS total
-            FROM curated_records
-            WHERE organization_id={{tenant_id}}
-            GROUP BY ym
-            ORDER BY ym
-        """),
-        ("mapa_por_uf", "Mapa por UF", "map_br", "Cobranca", """
-            SELECT uf, SUM(vl_titulo) AS total
-            FROM curated_records
-            WHERE organization_id={{tenant_id}}
-            GROUP BY uf
-            ORDER BY total DESC
-        """),
-        ("total_por_faixa_vencimento", "Total por Faixa de Vencimento", "bar", "Cobranca", """
-            SELECT faixa_vencimento, SUM(vl_titulo) AS total
-            FROM curated_records
-            WHERE organization_id={{tenant_id}}
-            GROUP BY faixa_vencimento
-            ORDER BY total DESC
-        """),
-        ("recuperado_por_faixa_vencimento", "Recuperado por Faixa de Vencimento", "bar", "Cobranca", """
-            SELECT faixa_vencimento, SUM(vl_total_repasse) AS total
-            FROM curated_records
-            WHERE organization_id={{tenant_id}}
-            GROUP BY faixa_vencimento
-            ORDER BY total DESC
-        """),
-    ]
-    created = []
-    for key, name, fmt, category, sql in templates:
-        create_indicator(IndicatorCreate(key=key, name=name, formula_sql=sql, fmt=fmt, category=category), db, ctx)
-        created.append({"key": key})
-    return {"ok": True, "created": created}
+    with db.begin():
+        if _can_upsert(db):
+            db.execute(_BOOTSTRAP_UPSERT, {"o": ctx.organization_id, **_BOOTSTRAP_PARAMS})
+        else:
+            # Banco sem o índice único (migration 0007): sem ON CONFLICT, mas ainda em lote
+            _bootstrap_without_upsert(db, ctx.organization_id)
+    _forget_sources(ctx.organization_id)
+    return {"ok": True, "created": [{"key": t[0]} for t in _BOOTSTRAP_TEMPLATES]}
@@ -1,16 +1,22 @@
+import io
+import os
+import shutil
+import tempfile
 from datetime import datetime
 from typing import List
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
-from sqlalchemy import text, select
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
 
 from app.deps import get_current_ctx, DbSession
 from app.schemas import IngestSQLIn, SheetsIn
 from app.models import DataSource, JobRun
-from app.utils.db_connect import make_engine
-from app.utils.csv_loader import load_csv_bytes, load_xlsx_bytes
+from app.cron import enqueue_csv_ingest, enqueue_sql_ingest
+from app.utils.csv_loader import iter_xlsx_rows
 from app.utils.sheets_loader import load_sheet
-from app.utils.transforms import store_staging, materialize_curated
+from app.utils.transforms import (
+    STAGING_BATCH_SIZE, iter_batches, store_staging, materialize_curated, ingest_csv_file, refresh_curated_stats,
+)
 
 
 router = APIRouter(prefix="/ingest", tags=["ingest"])
@@ -23,61 +29,129 @@ def ingest_sql(payload: IngestSQLIn, db: DbSession, ctx=Depends(get_current_ctx)
         raise HTTPException(status_code=404, detail="Fonte não encontrada")
     if ds.type != 'sql' or not ds.sqlalchemy_url:
         raise HTTPException(status_code=400, detail="Fonte não é do tipo SQL")
+    if not payload.query.strip().lower().startswith('select'):
+        raise HTTPException(status_code=400, detail="Apenas SELECT é permitido")
 
-    jr = JobRun(organization_id=ctx.organization_id, target_type='datasource', target_id=ds.id, status='running', started_at=datetime.utcnow())
-    db.add(jr)
+    # JobRun via Core: o id volta no próprio INSERT (sem refresh)
+    jr_id = db.execute(
+        insert(JobRun).returning(JobRun.id),
+        {"organization_id": ctx.organization_id, "target_type": 'datasource', "target_id": ds.id, "status": 'running', "started_at": datetime.utcnow()},
+    ).scalar_one()
     db.commit()
-    db.refresh(jr)
-    try:
-        eng = make_engine(ds.sqlalchemy_url)
-        with eng.connect() as conn:
-            if not payload.query.strip().lower().startswith('select'):
-                raise HTTPException(status_code=400, detail="Apenas SELECT é permitido")
-            result = conn.execute(text(payload.query))
-            rows = [dict(r._mapping) for r in result]
-        store_staging(rows, ctx.organization_id, db)
-        materialize_curated(rows, ctx.organization_id, db)
-        jr.status = 'success'
-        jr.logs = f"Ingeridos {len(rows)} registros"
-    except Exception as e:
-        jr.status = 'error'
-        jr.logs = str(e)
-        db.commit()
-        raise
-    finally:
-        jr.finished_at = datetime.utcnow()
-        db.commit()
-    return {"ok": True, "ingested": jr.logs}
+    # A consulta remota e os INSERTs rodam em segundo plano; o cliente acompanha por /ingest/jobs/{id}
+    enqueue_sql_ingest(jr_id, ds.id, payload.query)
+    return {"ok": True, "job_id": jr_id, "status": 'running'}
+
+
+@router.get('/jobs/{job_id}')
+def get_job(job_id: int, db: DbSession, ctx=Depends(get_current_ctx)):
+    row = db.execute(
+        select(JobRun.id, JobRun.status, JobRun.logs, JobRun.started_at, JobRun.finished_at)
+        .where(JobRun.id == job_id, JobRun.organization_id == ctx.organization_id)
+    ).mappings().first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return row
 
 
 @router.post('/csv')
-async def ingest_csv(db: DbSession, ctx=Depends(get_current_ctx), file: UploadFile = File(...), credor_code: str | None = None):
+def ingest_csv(db: DbSession, ctx=Depends(get_current_ctx), file: UploadFile = File(...), credor_code: str | None = None):
+    # Como no xlsx: lê direto do upload em disco, em lotes, no threadpool
     try:
-        data = await file.read()
-        rows = load_csv_bytes(data)
-        store_staging(rows, ctx.organization_id, db)
-        count = materialize_curated(rows, ctx.organization_id, db, credor_code)
+        file.file.seek(0)
+        count = ingest_csv_file(file.file, ctx.organization_id, db, credor_code)
+        refresh_curated_stats(db, count)
         return {"ok": True, "rows": count}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# Buffer da cópia do upload quando ele ainda está em memória
+UPLOAD_COPY_BUFFER = 8 << 20
+
+
+def _save_upload(src, dst) -> None:
+    # Upload já em disco (SpooledTemporaryFile passou do limite de spool): cópia dentro do
+    # kernel com sendfile, sem os bytes passarem pelo Python. Em memória (BytesIO, sem fd;
+    # fileno() forçaria a ida para o disco): copyfileobj em blocos grandes
+    spooled = getattr(src, '_file', src)
+    if hasattr(os, 'sendfile') and not isinstance(spooled, io.BytesIO):
+        try:
+            in_fd, out_fd = spooled.fileno(), dst.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            in_fd = None
+        if in_fd is not None:
+            offset, size = src.tell(), os.fstat(in_fd).st_size
+            while offset < size:
+                sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+                if not sent:
+                    break
+                offset += sent
+            return
+    shutil.copyfileobj(src, dst, UPLOAD_COPY_BUFFER)
+
+
+# tmpfs para o arquivo do job quando há folga (2x o tamanho): o worker relê da memória,
+# sem gravar e reler o upload inteiro do disco. Sem folga, fica no tmp padrão.
+UPLOAD_SHM_DIR = '/dev/shm'
+
+
+def _upload_tmpdir(size: int) -> str | None:
+    try:
+        if os.path.isdir(UPLOAD_SHM_DIR) and shutil.disk_usage(UPLOAD_SHM_DIR).free > size * 2:
+            return UPLOAD_SHM_DIR
+    except OSError:
+        pass
+    return None
+
+
+@router.post('/csv/async')
+def ingest_csv_async(db: DbSession, ctx=Depends(get_current_ctx), file: UploadFile = File(...), credor_code: str | None = None):
+    # O upload some ao fim do request: vai para um arquivo próprio, que o job lê e apaga
+    size = file.file.seek(0, os.SEEK_END)
+    file.file.seek(0)
+    with tempfile.NamedTemporaryFile(prefix='nexen-csv-', suffix='.csv', dir=_upload_tmpdir(size), delete=False) as out:
+        try:
+            _save_upload(file.file, out)
+        except BaseException:
+            os.unlink(out.name)
+            raise
+    try:
+        jr_id = db.execute(
+            insert(JobRun).returning(JobRun.id),
+            {"organization_id": ctx.organization_id, "target_type": 'upload', "target_id": None, "status": 'running', "started_at": datetime.utcnow()},
+        ).scalar_one()
+        db.commit()
+    except BaseException:
+        # Sem job ninguém apagaria o arquivo
+        os.unlink(out.name)
+        raise
+    # Parse e INSERTs num worker com sessão própria; o cliente acompanha por /ingest/jobs/{id}
+    enqueue_csv_ingest(jr_id, ctx.organization_id, out.name, credor_code)
+    return {"ok": True, "job_id": jr_id, "status": 'running'}
+
+
 @router.post('/xlsx')
-async def ingest_xlsx(db: DbSession, ctx=Depends(get_current_ctx), file: UploadFile = File(...), credor_code: str | None = None):
+def ingest_xlsx(db: DbSession, ctx=Depends(get_current_ctx), file: UploadFile = File(...), credor_code: str | None = None):
+    # Síncrono: a leitura da planilha e os INSERTs rodam no threadpool, fora do event loop
     try:
         # Only .xlsx is supported (openpyxl)
         filename = (file.filename or '').lower()
         if not filename.endswith('.xlsx'):
             raise HTTPException(status_code=400, detail='Apenas arquivos .xlsx são suportados. Salve seu Excel como .xlsx e tente novamente.')
-        data = await file.read()
-        rows = load_xlsx_bytes(data)
-        store_staging(rows, ctx.organization_id, db)
-        count = materialize_curated(rows, ctx.organization_id, db, credor_code)
+        # O upload já está num SpooledTemporaryFile (disco acima de 1MB): o openpyxl lê
+        # direto dele e as linhas seguem em lotes, sem o arquivo inteiro em bytes na memória
+        file.file.seek(0)
+        count = 0
+        for chunk in iter_batches(iter_xlsx_rows(file.file), STAGING_BATCH_SIZE):
+            store_staging(chunk, ctx.organization_id, db)
+            count += materialize_curated(chunk, ctx.organization_id, db, credor_code)
+        refresh_curated_stats(db, count)
         return {"ok": True, "rows": count}
     except Exception as e:
         # Melhora a mensagem para erros de engine/planilha
         msg = str(e)
-        if 'openpyxl' in msg.lower():
+        if 'openpyxl' in msg.lower() or 'calamine' in msg.lower():
             msg = 'Erro ao ler Excel. Verifique se o arquivo é .xlsx válido.'
         raise HTTPException(status_code=400, detail=msg)
 
@@ -87,4 +161,5 @@ def ingest_sheets(payload: SheetsIn, db: DbSession, ctx=Depends(get_current_ctx)
     rows = load_sheet(payload.spreadsheet_id, payload.range)
     store_staging(rows, ctx.organization_id, db)
     count = materialize_curated(rows, ctx.organization_id, db)
+    refresh_curated_stats(db, count)
     return {"ok": True, "rows": count}
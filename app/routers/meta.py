@@ -1,38 +1,34 @@
-from datetime import date
+from datetime import date, datetime, time, timedelta
 from fastapi import APIRouter, Depends
 from sqlalchemy import select, func, text
 from sqlalchemy import inspect as sqla_inspect
 
 from app.deps import get_current_ctx, DbSession
 from app.models import CuratedRecord, Dashboard, Indicator, DataSource, JobRun
+from app.utils.result_cache import invalidate_tenant
 
 
 router = APIRouter(prefix="/meta", tags=["meta"]) 
 
 
+def _count(model, organization_id: int, *where):
+    return select(func.count()).select_from(model).where(model.organization_id == organization_id, *where).scalar_subquery()
+
+
 @router.get("/summary")
 def summary(db: DbSession, ctx=Depends(get_current_ctx)):
     org = ctx.organization_id
-    datasets = db.scalar(select(func.count()).select_from(CuratedRecord).where(CuratedRecord.organization_id == org)) or 0
-    indicators = db.scalar(select(func.count()).select_from(Indicator).where(Indicator.organization_id == org)) or 0
-    dashboards = db.scalar(select(func.count()).select_from(Dashboard).where(Dashboard.organization_id == org)) or 0
-    sources = db.scalar(select(func.count()).select_from(DataSource).where(DataSource.organization_id == org)) or 0
-
-    today = date.today()
-    queries_today = db.scalar(
-        select(func.count()).select_from(JobRun).where(
-            JobRun.organization_id == org,
-            func.date(JobRun.started_at) == today,
-        )
-    ) or 0
-
-    return {
-        "datasets": datasets,
-        "indicators": indicators,
-        "dashboards": dashboards,
-        "sources": sources,
-        "queries_today": queries_today,
-    }
+    # Todas as contagens numa consulta só (subconsultas escalares: 1 round-trip).
+    # "Hoje" como intervalo em started_at (usa índice), não date(started_at) por linha
+    start = datetime.combine(date.today(), time.min)
+    row = db.execute(select(
+        _count(CuratedRecord, org).label("datasets"),
+        _count(Indicator, org).label("indicators"),
+        _count(Dashboard, org).label("dashboards"),
+        _count(DataSource, org).label("sources"),
+        _count(JobRun, org, JobRun.started_at >= start, JobRun.started_at < start + timedelta(days=1)).label("queries_today"),
+    )).mappings().one()
+    return {k: v or 0 for k, v in row.items()}
 
 
 @router.get("/curated-info")
@@ -62,6 +58,7 @@ def clear_tenant_data(db: DbSession, ctx=Depends(get_current_ctx)):
     try:
         res = db.execute(text("DELETE FROM curated_records WHERE organization_id=:o"), {"o": ctx.organization_id})
         db.commit()
+        invalidate_tenant(ctx.organization_id)
         deleted = getattr(res, 'rowcount', 0) or 0
         return {"ok": True, "deleted": deleted}
     except Exception as e:
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy import select, delete, insert
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from pydantic import TypeAdapter
+from sqlalchemy import and_, delete, func, insert, literal_column, select, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
 
-from app.deps import get_current_ctx, DbSession
+from app.deps import get_current_ctx, DbSession, RequestContext
 from app.models import Membership, User, Organization, IndicatorFolderPermission, Indicator
 from app.schemas import MemberOut, MemberInviteIn, MemberUpdateIn, IndicatorFolderPermissionOut
 from app.security import hash_password
@@ -20,21 +24,57 @@ def get_membership_record(db: Session, org_id: int, user_id: int) -> Membership
     )
 
 
-def ensure_can_manage_members(db: Session, org_id: int, user_id: int) -> Membership:
-    m = get_membership_record(db, org_id, user_id)
+def ensure_can_manage_members(db: Session, ctx: RequestContext, target_user_id: int | None = None) -> Membership | None:
+    """Checa a permissão do usuário do ctx; devolve a membership de target_user_id, se pedida.
+
+    Chamador e alvo saem do mesmo SELECT (user_id IN ...): um round-trip só. A membership
+    do chamador fica em ctx.membership para o resto do request.
+    """
+    target = None
+    if ctx.membership is None or target_user_id is not None:
+        ids = {ctx.user_id} if target_user_id is None else {ctx.user_id, target_user_id}
+        rows = db.scalars(
+            select(Membership).where(
+                Membership.organization_id == ctx.organization_id,
+                Membership.user_id.in_(ids),
+            )
+        ).all()
+        by_user = {m.user_id: m for m in rows}
+        if ctx.membership is None:
+            ctx.membership = by_user.get(ctx.user_id)
+        if target_user_id is not None:
+            target = by_user.get(target_user_id)
+    m = ctx.membership
     if not m:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permissão negada")
     role = (m.role or '').lower()
     if role in ('owner', 'admin') or m.can_manage_members:
-        return m
+        return target
     raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Permissão negada")
 
 
+_MEMBER_LIST = TypeAdapter(list[MemberOut])
+_MEMBER_FLAGS = ('can_manage_datasources', 'can_manage_datasets', 'can_manage_indicators', 'can_manage_members')
+
+
 @router.get('/members', response_model=list[MemberOut])
 def list_members(db: DbSession, ctx=Depends(get_current_ctx)):
     org = db.scalar(select(Organization).where(Organization.id == ctx.organization_id))
     if not org:
         raise HTTPException(status_code=404, detail="Organização não encontrada")
+    # Pastas agregadas como JSON no próprio SELECT (LEFT JOIN + GROUP BY): uma consulta só,
+    # sem juntar as permissões por usuário em Python
+    fp = IndicatorFolderPermission
+    has_folder = fp.folder.isnot(None)
+    # Chaves do objeto como literais no SQL (parâmetro sem tipo não passa no json_build_object)
+    pairs = (literal_column("'folder'"), fp.folder, literal_column("'can_edit'"), fp.can_edit)
+    if db.get_bind().dialect.name == 'postgresql':
+        folders = func.coalesce(
+            func.json_agg(func.json_build_object(*pairs)).filter(has_folder),
+            literal_column("'[]'::json"),
+        )
+    else:
+        folders = func.json_group_array(func.json_object(*pairs)).filter(has_folder)
     rows = db.execute(
         select(
             User.id,
@@ -45,44 +85,28 @@ def list_members(db: DbSession, ctx=Depends(get_current_ctx)):
             Membership.can_manage_datasets,
             Membership.can_manage_indicators,
             Membership.can_manage_members,
+            folders.label('folders'),
         )
         .join(Membership, Membership.user_id == User.id)
+        .outerjoin(fp, and_(fp.user_id == User.id, fp.organization_id == Membership.organization_id))
         .where(Membership.organization_id == ctx.organization_id)
+        .group_by(User.id, Membership.user_id, Membership.organization_id)
         .order_by(User.name)
     ).all()
 
-    folder_rows = db.execute(
-        select(
-            IndicatorFolderPermission.user_id,
-            IndicatorFolderPermission.folder,
-            IndicatorFolderPermission.can_edit,
-        ).where(
-            IndicatorFolderPermission.organization_id == ctx.organization_id
-        )
-    ).all()
-
-    folders_by_user: dict[int, list[IndicatorFolderPermissionOut]] = {}
-    for fr in folder_rows:
-        folders_by_user.setdefault(fr.user_id, []).append(
-            IndicatorFolderPermissionOut(folder=fr.folder, can_edit=bool(fr.can_edit))
-        )
-
-    result: list[MemberOut] = []
+    members = []
     for row in rows:
-        result.append(
-            MemberOut(
-                id=row.id,
-                email=row.email,
-                name=row.name,
-                role=row.role,
-                can_manage_datasources=bool(row.can_manage_datasources),
-                can_manage_datasets=bool(row.can_manage_datasets),
-                can_manage_indicators=bool(row.can_manage_indicators),
-                can_manage_members=bool(row.can_manage_members),
-                indicator_folders=folders_by_user.get(row.id, []),
-            )
-        )
-    return result
+        member = dict(row._mapping)
+        # NULL em bancos antigos vira False, como antes
+        for flag in _MEMBER_FLAGS:
+            member[flag] = bool(member[flag])
+        # SQLite devolve o JSON como texto; o driver do Postgres já devolve a lista
+        folders_json = member.pop('folders')
+        member['indicator_folders'] = json.loads(folders_json) if isinstance(folders_json, str) else (folders_json or [])
+        members.append(member)
+    # Validação da lista inteira (inclusive pastas e 0/1 -> bool) e JSON no pydantic-core,
+    # sem um MemberOut montado por membro nem a segunda validação do response_model
+    return Response(_MEMBER_LIST.dump_json(_MEMBER_LIST.validate_python(members)), media_type="application/json")
 
 
 def _normalize_folder_name(folder: str | None) -> str:
@@ -91,38 +115,45 @@ def _normalize_folder_name(folder: str | None) -> str:
     return folder.strip()
 
 
+# Upsert por (organization_id, user_id, folder) (índice único da migration 0013): pasta
+# mantida com o mesmo can_edit não é reescrita; as que saíram da lista são apagadas depois
+_FOLDER_UPSERT = text("""
+    INSERT INTO indicator_folder_permissions (organization_id, user_id, folder, can_edit, created_at)
+    VALUES (:organization_id, :user_id, :folder, :can_edit, CURRENT_TIMESTAMP)
+    ON CONFLICT (organization_id, user_id, folder) DO UPDATE SET can_edit = excluded.can_edit
+    WHERE indicator_folder_permissions.can_edit <> excluded.can_edit
+""")
+
+
 def _apply_indicator_folders(db: Session, org_id: int, user_id: int, folders: list[IndicatorFolderPermissionOut]):
-    db.execute(
-        delete(IndicatorFolderPermission).where(
-            IndicatorFolderPermission.organization_id == org_id,
-            IndicatorFolderPermission.user_id == user_id,
-        )
-    )
-    to_insert = []
-    seen: set[tuple[str, bool]] = set()
+    # Uma linha por pasta; repetida na lista, vale o can_edit mais permissivo
+    can_edit: dict[str, bool] = {}
     for f in folders:
         name = _normalize_folder_name(f.folder)
-        key = (name, bool(f.can_edit))
-        if not name and name != "":
-            continue
-        if key in seen:
-            continue
-        seen.add(key)
-        to_insert.append(
-            dict(
-                organization_id=org_id,
-                user_id=user_id,
-                folder=name,
-                can_edit=bool(f.can_edit),
-            )
-        )
-    if to_insert:
-        db.execute(insert(IndicatorFolderPermission), to_insert)
+        can_edit[name] = can_edit.get(name, False) or bool(f.can_edit)
+    rows = [
+        dict(organization_id=org_id, user_id=user_id, folder=name, can_edit=edit)
+        for name, edit in can_edit.items()
+    ]
+    owned = (
+        IndicatorFolderPermission.organization_id == org_id,
+        IndicatorFolderPermission.user_id == user_id,
+    )
+    try:
+        with db.begin_nested():
+            if rows:
+                db.execute(_FOLDER_UPSERT, rows)
+            db.execute(delete(IndicatorFolderPermission).where(*owned, IndicatorFolderPermission.folder.not_in(list(can_edit))))
+    except DBAPIError:
+        # Banco sem o índice único: apaga tudo e insere de novo
+        db.execute(delete(IndicatorFolderPermission).where(*owned))
+        if rows:
+            db.execute(insert(IndicatorFolderPermission), rows)
 
 
 @router.post('/members', response_model=MemberOut)
 def add_member(payload: MemberInviteIn, db: DbSession, ctx=Depends(get_current_ctx)):
-    ensure_can_manage_members(db, ctx.organization_id, ctx.user_id)
+    ensure_can_manage_members(db, ctx)
     user = db.scalar(select(User).where(User.email == payload.email))
     if not user:
         if not payload.password or not payload.name:
@@ -191,13 +222,7 @@ def add_member(payload: MemberInviteIn, db: DbSession, ctx=Depends(get_current_c
 
 @router.put('/members/{user_id}', response_model=MemberOut)
 def update_member(user_id: int, payload: MemberUpdateIn, db: DbSession, ctx=Depends(get_current_ctx)):
-    ensure_can_manage_members(db, ctx.organization_id, ctx.user_id)
-    membership = db.scalar(
-        select(Membership).where(
-            Membership.user_id == user_id,
-            Membership.organization_id == ctx.organization_id,
-        )
-    )
+    membership = ensure_can_manage_members(db, ctx, user_id)
     if not membership:
         raise HTTPException(status_code=404, detail="Membro não encontrado")
 
@@ -224,8 +249,6 @@ def update_member(user_id: int, payload: MemberUpdateIn, db: DbSession, ctx=Depe
         user.password_hash = hash_password(payload.password)
 
     db.commit()
-    if user:
-        db.refresh(user)
     folders = [
         IndicatorFolderPermissionOut(folder=perm.folder, can_edit=perm.can_edit)
         for perm in db.execute(
@@ -250,7 +273,7 @@ def update_member(user_id: int, payload: MemberUpdateIn, db: DbSession, ctx=Depe
 
 @router.delete('/members/{user_id}')
 def remove_member(user_id: int, db: DbSession, ctx=Depends(get_current_ctx)):
-    ensure_can_manage_members(db, ctx.organization_id, ctx.user_id)
+    ensure_can_manage_members(db, ctx)
     db.execute(delete(Membership).where(Membership.user_id == user_id, Membership.organization_id == ctx.organization_id))
     db.execute(
         delete(IndicatorFolderPermission).where(
@@ -267,7 +290,7 @@ def org_info(db: DbSession, ctx=Depends(get_current_ctx)):
     org = db.scalar(select(Organization).where(Organization.id == ctx.organization_id))
     if not org:
         raise HTTPException(status_code=404, detail="Organization not found")
-    m = db.scalar(select(Membership).where(Membership.organization_id == ctx.organization_id, Membership.user_id == ctx.user_id))
+    m = ctx.membership or get_membership_record(db, ctx.organization_id, ctx.user_id)
     role = (m.role if m else None) or 'Viewer'
     can_manage_members = bool(m.can_manage_members) if m else False
     if m and (m.role or '').lower() in ('owner', 'admin'):
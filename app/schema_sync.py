@@ -0,0 +1,234 @@
+import hashlib
+from sqlalchemy import Column, DateTime, Float, Integer, MetaData, String, Table, UniqueConstraint, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+
+
+# Colunas adicionadas fora das migrations (bancos locais antigos). O tipo é
+# compilado para o dialeto em uso, então o mesmo mapa serve SQLite e Postgres.
+OPTIONAL_COLUMNS = {
+    'curated_records': {
+        'devedor': String(200),
+        'cpf_cnpj': String(32),
+        'processo': String(100),
+        'credor_code': String(50),
+        'vl_saldo': Float(),
+        'dt_ultimo_credito': DateTime(),
+        'portador': String(100),
+        'motivo_devolucao': String(200),
+        'vl_honorario_devedor': Float(),
+        'vl_tx_contrato': Float(),
+        'comercial': String(100),
+        'cobrador': String(100),
+        'dt_encerrado': DateTime(),
+        'dias_vencidos_cadastro': Integer(),
+        'ym': String(7),
+    },
+    'datasets': {'credor_code': String(50)},
+    'indicators': {'credor_code': String(50)},
+    'indicator_categories': {'color': String(7)},
+}
+
+
+# Preenchimento das linhas antigas quando a coluna derivada acaba de ser criada. Só
+# SQLite: no Postgres o UPDATE da tabela inteira na mesma transação do ADD COLUMN seguraria
+# o ACCESS EXCLUSIVE (e as leituras de todos os workers) até o fim; lá o backfill é da
+# migration 0010, em lotes e fora dessa transação
+COLUMN_BACKFILL = {
+    ('curated_records', 'ym'): "UPDATE curated_records SET ym = strftime('%Y-%m', dt_cadastro) WHERE dt_cadastro IS NOT NULL",
+}
+
+
+# Postgres: DEFAULT das colunas que o COPY não envia. Bancos criados pelo create_all
+# antigo têm created_at NOT NULL sem DEFAULT (o default era só do Python)
+COLUMN_DEFAULTS = {
+    ('staging_records', 'created_at'): 'CURRENT_TIMESTAMP',
+    ('curated_records', 'created_at'): 'CURRENT_TIMESTAMP',
+}
+
+
+def _column_specs(dialect) -> dict:
+    return {
+        (table, name): f"ADD COLUMN {name} {type_.compile(dialect=dialect)}"
+        for table, columns in OPTIONAL_COLUMNS.items()
+        for name, type_ in columns.items()
+    }
+
+
+# Índices dos predicados quentes (cron e APIs), só para bancos SQLite locais criados pelo
+# create_all. No Postgres quem cria são as migrations 0005/0006/0008/0009/0010/0012
+# (CONCURRENTLY, com INCLUDE): um CREATE INDEX comum aqui travaria a escrita em
+# curated_records durante todo o build no primeiro boot após o deploy.
+OPTIONAL_INDEXES = {
+    'ix_data_sources_recurring': ('data_sources', "CREATE INDEX IF NOT EXISTS ix_data_sources_recurring ON data_sources (is_recurring) WHERE is_recurring"),
+    'ix_curated_records_org_credor': ('curated_records', "CREATE INDEX IF NOT EXISTS ix_curated_records_org_credor ON curated_records (organization_id, credor_code)"),
+    'ix_job_runs_target': ('job_runs', "CREATE INDEX IF NOT EXISTS ix_job_runs_target ON job_runs (target_type, target_id, started_at)"),
+    'ix_job_runs_org_started': ('job_runs', "CREATE INDEX IF NOT EXISTS ix_job_runs_org_started ON job_runs (organization_id, started_at)"),
+    # Sem INCLUDE no SQLite: colunas extras entram na chave (índice cobrindo)
+    'ix_memberships_lookup': ('memberships', "CREATE INDEX IF NOT EXISTS ix_memberships_lookup ON memberships (user_id, organization_id, role)"),
+    # Agregados de /indicators (mês a mês, UF, faixas por vencimento) como index-only scans
+    'ix_curated_records_org_dtcad': ('curated_records', "CREATE INDEX IF NOT EXISTS ix_curated_records_org_dtcad ON curated_records (organization_id, dt_cadastro, vl_titulo, uf, situacao_processo)"),
+    # dt_cadastro junto: os filtros from/to do mapa por UF também saem do índice
+    'ix_curated_records_org_uf_dtcad': ('curated_records', "CREATE INDEX IF NOT EXISTS ix_curated_records_org_uf_dtcad ON curated_records (organization_id, uf, vl_titulo, dt_cadastro)"),
+    # valor-mes-a-mes agrupa pela coluna ym na ordem do índice (sem sort/hash)
+    'ix_curated_records_org_ym': ('curated_records', "CREATE INDEX IF NOT EXISTS ix_curated_records_org_ym ON curated_records (organization_id, ym, vl_titulo, dt_cadastro, uf, situacao_processo)"),
+    'ix_curated_records_org_venc': ('curated_records', "CREATE INDEX IF NOT EXISTS ix_curated_records_org_venc ON curated_records (organization_id, dt_vencimento, vl_titulo, vl_total_repasse)"),
+}
+
+# "ADD COLUMN ..." já compilados para os dialetos usados (outros compilam na hora)
+_DDL_BY_DIALECT = {
+    'postgresql': _column_specs(postgresql.dialect()),
+    'sqlite': _column_specs(sqlite.dialect()),
+}
+
+
+# Tabela de categorias (pastas de indicadores), sem model ORM
+indicator_categories = Table(
+    'indicator_categories',
+    MetaData(),
+    Column('id', Integer, primary_key=True),
+    Column('organization_id', Integer, nullable=False),
+    Column('name', String(200), nullable=False),
+    Column('color', String(7)),
+    UniqueConstraint('organization_id', 'name'),
+)
+
+# Incrementar sempre que OPTIONAL_COLUMNS ou as tabelas acima mudarem
+SCHEMA_VERSION = '8'
+_SENTINEL_KEY = 'startup_ddl'
+_TABLES_KEY = 'metadata_sig'
+# Chave arbitrária do advisory lock (Postgres) que serializa o DDL entre workers
+_ADVISORY_LOCK_KEY = 7263001
+
+
+def _sentinel(engine: Engine, key: str) -> str | None:
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT v FROM schema_migrations WHERE k = :k"), {"k": key}).scalar()
+    except Exception:
+        # tabela sentinela ainda não existe
+        return None
+
+
+def _schema_is_current(engine: Engine) -> bool:
+    return _sentinel(engine, _SENTINEL_KEY) == SCHEMA_VERSION
+
+
+def _apply_missing(conn: Connection) -> None:
+    insp = inspect(conn)
+    tables = set(insp.get_table_names())
+    if 'indicator_categories' not in tables:
+        indicator_categories.create(conn)
+        tables.add('indicator_categories')
+    is_pg = conn.dialect.name == 'postgresql'
+    ddl = _DDL_BY_DIALECT.get(conn.dialect.name) or _column_specs(conn.dialect)
+    pending: list[str] = []
+    backfill: list[str] = []
+    for table, columns in OPTIONAL_COLUMNS.items():
+        if table not in tables:
+            continue
+        existing = {c['name'] for c in insp.get_columns(table)}
+        added = [name for name in columns if name not in existing]
+        if not added:
+            continue
+        specs = [ddl[(table, name)] for name in added]
+        if is_pg:
+            # Postgres aceita vários ADD COLUMN num único ALTER TABLE
+            pending.append(f"ALTER TABLE {table} " + ", ".join(specs))
+        else:
+            # SQLite: um ADD COLUMN por ALTER
+            pending.extend(f"ALTER TABLE {table} {spec}" for spec in specs)
+        for name in added:
+            stmt = COLUMN_BACKFILL.get((table, name))
+            if stmt and not is_pg:
+                backfill.append(stmt)
+    # Backfill antes dos índices: o UPDATE não paga manutenção de índice novo
+    pending.extend(backfill)
+    if is_pg:
+        for (table, name), default in COLUMN_DEFAULTS.items():
+            if table not in tables:
+                continue
+            col = next((c for c in insp.get_columns(table) if c['name'] == name), None)
+            if col is not None and col.get('default') is None:
+                # Só catálogo: não reescreve a tabela
+                pending.append(f"ALTER TABLE {table} ALTER COLUMN {name} SET DEFAULT {default}")
+    if conn.dialect.name == 'sqlite':
+        for name, (table, stmt) in OPTIONAL_INDEXES.items():
+            if table in tables and name not in {ix['name'] for ix in insp.get_indexes(table)}:
+                pending.append(stmt)
+    if not pending:
+        return
+    if is_pg:
+        # Todo o DDL num único envio (protocolo simples aceita vários comandos): 1 round-trip
+        conn.exec_driver_sql(";\n".join(pending))
+    else:
+        for sql in pending:
+            conn.exec_driver_sql(sql)
+
+
+def _mark(conn: Connection, key: str, value: str) -> None:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_migrations (k VARCHAR(50) PRIMARY KEY, v VARCHAR(100))"))
+    conn.execute(text("DELETE FROM schema_migrations WHERE k = :k"), {"k": key})
+    conn.execute(text("INSERT INTO schema_migrations (k, v) VALUES (:k, :v)"), {"k": key, "v": value})
+
+
+def _mark_current(conn: Connection) -> None:
+    _mark(conn, _SENTINEL_KEY, SCHEMA_VERSION)
+
+
+# (engine, tabela, colunas) -> existe índice/constraint único exatamente nessas colunas
+_unique_keys: dict = {}
+
+
+def has_unique_key(engine: Engine, table: str, columns: tuple[str, ...]) -> bool:
+    """True se `table` tem um índice ou constraint único em `columns` (alvo possível de
+    ON CONFLICT). Introspecção uma vez por processo; a migration que cria o índice vem
+    com deploy/restart."""
+    key = (engine, table, columns)
+    found = _unique_keys.get(key)
+    if found is None:
+        insp = inspect(engine)
+        uniques = [ix['column_names'] for ix in insp.get_indexes(table) if ix.get('unique')]
+        uniques += [uc['column_names'] for uc in insp.get_unique_constraints(table)]
+        found = _unique_keys[key] = any(tuple(cols) == columns for cols in uniques)
+    return found
+
+
+def metadata_signature(metadata: MetaData) -> str:
+    # Muda sempre que uma tabela/coluna/tipo dos models muda
+    sig = [(t.name, sorted((c.name, str(c.type)) for c in t.columns)) for t in metadata.sorted_tables]
+    return hashlib.sha1(repr(sig).encode()).hexdigest()
+
+
+def ensure_tables(engine: Engine, metadata: MetaData) -> bool:
+    """create_all só quando os models mudaram desde o último boot; retorna True se rodou."""
+    sig = metadata_signature(metadata)
+    if _sentinel(engine, _TABLES_KEY) == sig:
+        return False
+    metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _mark(conn, _TABLES_KEY, sig)
+    return True
+
+
+def ensure_schema(engine: Engine) -> bool:
+    """Cria apenas colunas/tabelas que faltam; retorna True se algo foi verificado."""
+    if _schema_is_current(engine):
+        return False
+    with engine.connect() as conn:
+        is_pg = conn.dialect.name == 'postgresql'
+        if is_pg:
+            # Só um worker roda o DDL; os demais seguem sem esperar
+            locked = conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": _ADVISORY_LOCK_KEY}).scalar()
+            conn.commit()
+            if not locked:
+                return False
+        try:
+            with conn.begin():
+                _apply_missing(conn)
+                _mark_current(conn)
+        finally:
+            if is_pg:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _ADVISORY_LOCK_KEY})
+                conn.commit()
+    return True
@@ -127,6 +127,18 @@ class DashboardCreateIn(BaseModel):
     theme_json: Optional[dict] = None
 
 
+class DashboardSummaryOut(BaseModel):
+    # Listagem: sem layout_json/theme_json (use GET /dashboards/{id} para o completo)
+    id: int
+    name: str
+    description: Optional[str]
+    is_public: bool
+    public_token: Optional[str]
+
+    class Config:
+        from_attributes = True
+
+
 class DashboardOut(BaseModel):
     id: int
     name: str
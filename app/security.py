@@ -8,6 +8,12 @@ from app.settings import settings
 
 # Use pbkdf2_sha256 as default to avoid bcrypt 72-byte limit issues on some platforms.
 pwd_context = CryptContext(schemes=["pbkdf2_sha256", "bcrypt"], deprecated="auto")
+# Carrega o handler padrão já no import, não na primeira request de login
+pwd_context.handler()
+
+# Chave e algoritmos do JWT resolvidos uma vez
+_SIGNING_KEY = settings.JWT_SECRET.encode()
+_JWT_ALGORITHMS = [settings.JWT_ALG]
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -22,21 +28,22 @@ def hash_password(password: str) -> str:
         return pwd_context.hash(password[:72])
 
 
-def create_access_token(*, user_id: int, organization_id: int, expires_minutes: int = 60 * 24) -> str:
+def create_access_token(*, user_id: int, organization_id: int, role: Optional[str] = None, expires_minutes: int = 60 * 24) -> str:
     now = datetime.now(tz=timezone.utc)
     payload = {
         "sub": str(user_id),
         "org": organization_id,
+        "role": role,
         "iat": int(now.timestamp()),
         "exp": int((now + timedelta(minutes=expires_minutes)).timestamp()),
     }
-    token = jwt.encode(payload, settings.JWT_SECRET, algorithm=settings.JWT_ALG)
+    token = jwt.encode(payload, _SIGNING_KEY, algorithm=settings.JWT_ALG)
     return token
 
 
 def decode_token(token: str) -> dict:
     try:
-        return jwt.decode(token, settings.JWT_SECRET, algorithms=[settings.JWT_ALG])
+        return jwt.decode(token, _SIGNING_KEY, algorithms=_JWT_ALGORITHMS)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expirado")
     except jwt.InvalidTokenError:
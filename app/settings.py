@@ -10,10 +10,25 @@ class Settings(BaseSettings):
     JWT_SECRET: str = "change_me"
     JWT_ALG: str = "HS256"
     REDIS_URL: str = "redis://localhost:6379/0"
+    # Cache dos agregados de /indicators no Redis (compartilhado entre workers); requer o pacote redis
+    RESULT_CACHE_REDIS: bool = False
     GOOGLE_CLIENT_ID: Optional[str] = None
     GOOGLE_CLIENT_SECRET: Optional[str] = None
     GOOGLE_REDIRECT_URI: Optional[str] = None
     CRON_DEFAULT_MINUTES: int = 60
+    # Handlers síncronos rodam no threadpool do anyio (padrão 40); o pool do banco acompanha
+    THREADPOOL_SIZE: int = 50
+    DB_POOL_SIZE: int = 20
+    DB_MAX_OVERFLOW: int = 30
+    # Espera máxima por uma conexão livre: falha rápido em vez de enfileirar por 30s
+    DB_POOL_TIMEOUT: int = 5
+    # Opcional: SELECT 1 no checkout, para redes que derrubam conexões ociosas antes do recycle
+    DB_POOL_PRE_PING: bool = False
+    # Pula o create_all no boot quando o hash dos models não mudou
+    NEXEN_FAST_STARTUP: bool = False
+    # Processos (spawn) que convertem lotes de CSV em paralelo à escrita; 0 = tudo no
+    # processo do worker. Opt-in: cada worker web teria o próprio pool e o ganho não foi medido
+    CSV_PREP_WORKERS: int = 0
 
     @field_validator('CRON_DEFAULT_MINUTES', mode='before')
     @classmethod
@@ -1,22 +1,152 @@
-import io
-from typing import List, Dict
+import csv
+from datetime import date, datetime
+from typing import BinaryIO, Dict, Iterator, List
 import pandas as pd
+try:
+    import pyarrow.csv as pacsv
+except Exception:  # pyarrow é opcional; sem ele fica o read_csv do pandas
+    pacsv = None
+try:
+    from python_calamine import CalamineWorkbook
+except Exception:  # python-calamine é opcional; sem ele o xlsx é lido pelo openpyxl
+    CalamineWorkbook = None
 
 
-def load_csv_bytes(data: bytes, sep: str = ",") -> List[Dict]:
-    df = pd.read_csv(io.BytesIO(data), sep=sep)
-    return df.to_dict(orient='records')
+# Bytes por bloco do leitor do pyarrow (cada bloco vira um lote)
+ARROW_BLOCK_SIZE = 8 << 20
+# Amostra do início do arquivo usada para detectar o separador
+SNIFF_SIZE = 32 << 10
+_DELIMITERS = (',', ';', '\t', '|')
 
 
-def load_xlsx_bytes(data: bytes) -> List[Dict]:
-    # Be explicit with engine to avoid pandas guessing issues
-    # Read everything as object to preserve strings like CPFs and avoid float conversions
-    bio = io.BytesIO(data)
+def sniff_delimiter(fileobj: BinaryIO, default: str = ",") -> str:
+    """Separador do CSV pelas primeiras linhas (o arquivo volta para a posição original).
+
+    Cada candidato é aplicado com o csv.reader (aspas respeitadas: "1.234,50" num CSV
+    com ";" não conta vírgula). Vence o que divide as linhas no mesmo número de campos
+    (>1) com mais frequência; empate fica com o que gera mais campos.
+    """
+    pos = fileobj.tell()
+    sample = fileobj.read(SNIFF_SIZE)
+    fileobj.seek(pos)
+    text = sample.decode('utf-8-sig', errors='ignore')
+    lines = text.splitlines()
+    if len(sample) == SNIFF_SIZE and len(lines) > 1:
+        # última linha provavelmente cortada no meio
+        lines = lines[:-1]
+    lines = [ln for ln in lines if ln.strip()]
+    if not lines:
+        return default
+    best, best_score = default, (0, 0)
+    for delim in _DELIMITERS:
+        widths = [len(row) for row in csv.reader(lines, delimiter=delim)]
+        width = max(set(widths), key=widths.count)
+        if width < 2:
+            continue
+        score = (widths.count(width), width)
+        if score > best_score:
+            best, best_score = delim, score
+    return best
+
+
+def iter_csv_frames(fileobj: BinaryIO, size: int, sep: str = ",") -> Iterator[pd.DataFrame]:
+    """Lê o CSV em pedaços: só um DataFrame por vez.
+
+    Com pyarrow os lotes são blocos de ARROW_BLOCK_SIZE bytes (tokenização em C,
+    multi-thread); sem ele, pandas em lotes de até `size` linhas.
+    """
+    if pacsv is not None:
+        yield from _iter_arrow_frames(fileobj, sep)
+        return
+    yield from pd.read_csv(fileobj, sep=sep, chunksize=size)
+
+
+def _iter_arrow_frames(fileobj: BinaryIO, sep: str) -> Iterator[pd.DataFrame]:
+    # Cabeçalho lido à parte: mesmos nomes do pandas e todas as colunas como texto
+    # (sem inferência por bloco, que quebra quando um bloco posterior muda de tipo;
+    # a conversão fica com os conversores da curadoria). Vazio vira None.
+    first = fileobj.readline()
+    if not first.strip():
+        return
+    headers = _pandas_headers(next(csv.reader([first.decode('utf-8-sig')], delimiter=sep)))
+    reader = pacsv.open_csv(
+        fileobj,
+        read_options=pacsv.ReadOptions(column_names=headers, block_size=ARROW_BLOCK_SIZE),
+        parse_options=pacsv.ParseOptions(delimiter=sep),
+        convert_options=pacsv.ConvertOptions(
+            column_types={h: 'string' for h in headers}, strings_can_be_null=True, quoted_strings_can_be_null=True,
+        ),
+    )
+    for batch in reader:
+        if batch.num_rows:
+            yield batch.to_pandas()
+
+
+def _pandas_headers(cells) -> List[str]:
+    # Mesmos nomes que o pandas daria: "Unnamed: N" para vazios e ".1", ".2" em repetidos
+    headers: List[str] = []
+    seen: Dict[str, int] = {}
+    for i, cell in enumerate(cells):
+        name = f"Unnamed: {i}" if cell is None or str(cell).strip() == '' else str(cell)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        headers.append(name)
+    return headers
+
+
+def _calamine_value(v):
+    # Mesmos tipos que o openpyxl entrega: vazio é None, número inteiro é int, data é datetime
+    if v == '':
+        return None
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    if isinstance(v, date) and not isinstance(v, datetime):
+        return datetime(v.year, v.month, v.day)
+    return v
+
+
+def _iter_calamine_rows(fileobj: BinaryIO) -> Iterator[Dict]:
+    rows = CalamineWorkbook.from_filelike(fileobj).get_sheet_by_index(0).iter_rows()
+    first = next(rows, None)
+    if first is None:
+        return
+    headers = _pandas_headers(first)
+    width = len(headers)
+    for values in rows:
+        values = [_calamine_value(v) for v in values[:width]]
+        if all(v is None for v in values):
+            continue
+        yield dict(zip(headers, values + [None] * (width - len(values))))
+
+
+def iter_xlsx_rows(fileobj: BinaryIO) -> Iterator[Dict]:
+    """Linhas da primeira planilha como dicts, lidas em streaming.
+
+    Com python-calamine (parser em Rust) quando instalado; senão openpyxl read_only.
+    Nada é materializado no lado Python: nem o workbook nem a lista de linhas. Valores
+    saem como estão nas células (CPFs em texto continuam texto). Linhas totalmente
+    vazias são puladas.
+    """
+    if CalamineWorkbook is not None:
+        yield from _iter_calamine_rows(fileobj)
+        return
+    from openpyxl import load_workbook
+
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
     try:
-        df = pd.read_excel(bio, engine="openpyxl", dtype=object)
-    except Exception:
-        # Fallback: let pandas guess if openpyxl is not available for some reason
-        bio.seek(0)
-        df = pd.read_excel(bio, dtype=object)
-    # Keep column names as-is; transform layer normalizes keys
-    return df.to_dict(orient='records')
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        first = next(rows, None)
+        if first is None:
+            return
+        headers = _pandas_headers(first)
+        width = len(headers)
+        for values in rows:
+            if all(v is None for v in values):
+                continue
+            # read_only pode devolver linhas mais curtas que o cabeçalho
+            yield dict(zip(headers, tuple(values[:width]) + (None,) * (width - len(values))))
+    finally:
+        wb.close()
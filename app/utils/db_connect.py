@@ -1,17 +1,73 @@
+from collections import OrderedDict
+from threading import Lock
+
 from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine
+from sqlalchemy.engine import Engine, make_url
+
+
+# Engines das fontes externas reaproveitados entre execuções (LRU por URL)
+ENGINE_CACHE_SIZE = 64
+_engines: "OrderedDict[str, Engine]" = OrderedDict()
+_engines_lock = Lock()
+
+
+# Timeout de conexão (s) das fontes externas: host fora do ar falha rápido, sem prender
+# a thread do /datasources/test ou do cron até o timeout TCP do sistema
+CONNECT_TIMEOUT = 5
+_TIMEOUT_ARG = {'postgresql': 'connect_timeout', 'mysql': 'connect_timeout'}
+
+
+def _pool_kwargs(url: str) -> dict:
+    # SQLite não usa QueuePool com tamanho configurável
+    try:
+        backend = make_url(url).get_backend_name()
+    except Exception:
+        return {}
+    if backend == 'sqlite':
+        return {}
+    kwargs = {"pool_size": 5, "max_overflow": 5, "pool_recycle": 1800}
+    if backend in _TIMEOUT_ARG:
+        kwargs["connect_args"] = {_TIMEOUT_ARG[backend]: CONNECT_TIMEOUT}
+    return kwargs
 
 
 def make_engine(url: str) -> Engine:
-    return create_engine(url, pool_pre_ping=True, future=True)
+    return create_engine(url, pool_pre_ping=True, future=True, **_pool_kwargs(url))
+
+
+def get_engine(url: str) -> Engine:
+    """Engine em cache para a URL; o mais antigo é descartado (dispose) ao estourar o limite."""
+    with _engines_lock:
+        eng = _engines.get(url)
+        if eng is not None:
+            _engines.move_to_end(url)
+            return eng
+        eng = make_engine(url)
+        _engines[url] = eng
+        if len(_engines) > ENGINE_CACHE_SIZE:
+            _, evicted = _engines.popitem(last=False)
+            evicted.dispose()
+        return eng
+
+
+def _discard_engine(url: str) -> None:
+    with _engines_lock:
+        eng = _engines.pop(url, None)
+    if eng is not None:
+        eng.dispose()
 
 
 def test_connection(url: str) -> tuple[bool, str | None]:
+    # Mesmo engine do cache: a fonte testada e salva em seguida já tem conexão aberta;
+    # URL que falha não fica ocupando o cache
+    try:
+        engine = get_engine(url)
+    except Exception as e:
+        return False, str(e)
     try:
-        engine = make_engine(url)
         with engine.connect() as conn:
             conn.execute(text("SELECT 1"))
         return True, None
     except Exception as e:
+        _discard_engine(url)
         return False, str(e)
-
@@ -1,65 +1,92 @@
+import re
+from functools import lru_cache
 from typing import Dict, Any
 
+from sqlalchemy import TextClause, text
+
 
 ALLOWED_SQL_PREFIX = "select"
 
+# very naive sanitization: one precompiled pass for semicolons and DDL/DML keywords
+_BLOCKED = re.compile(
+    r";|\b(?:insert|update|delete|drop|alter|create|truncate|grant|revoke|attach|pragma|vacuum|exec)\b",
+    re.IGNORECASE,
+)
+
 
+@lru_cache(maxsize=1024)
 def is_safe_select(sql: str) -> bool:
+    # Memoizado: o SQL de um indicador quase nunca muda entre execuções
     # tolerate UTF-8 BOM and leading whitespace
     s = sql.lstrip('\ufeff').strip()
     # Allow trailing semicolon by stripping it before validation
     if s.endswith(';'):
         s = s[:-1].strip()
-    lower = s.lower()
-    if not lower.startswith(ALLOWED_SQL_PREFIX):
+    if s[:len(ALLOWED_SQL_PREFIX)].lower() != ALLOWED_SQL_PREFIX:
         return False
-    # very naive sanitization: disallow semicolons and common DDL/DML
-    banned = [";", " drop ", " delete ", " update ", " insert ", " alter ", " create "]
-    return not any(b in lower for b in banned)
+    return _BLOCKED.search(s) is None
 
 
-def apply_placeholders(sql: str, allowed_filters: Dict[str, Any]) -> tuple[str, Dict[str, Any]]:
-    # Replace known placeholders with SQLAlchemy bind params
-    # {{tenant_id}} -> :tenant_id, {{from}} -> :from, {{to}} -> :to, {{filter:campo}} -> AND campo=:campo
-    params: Dict[str, Any] = {}
+@lru_cache(maxsize=1024)
+def _render_placeholders(sql: str, date_field: str | None, has_from: bool, has_to: bool,
+                         filters: tuple[tuple[str, bool], ...]) -> tuple[str, tuple[str, ...]]:
+    # Depende só do template e de quais filtros vieram preenchidos (não dos valores):
+    # o mesmo indicador rodado de novo reaproveita o SQL já montado
     s = sql.replace("{{tenant_id}}", ":tenant_id")
+    bound: list[str] = []
 
     # Optional: replace a chosen date column placeholder {{date_field}}
     # We only allow safe identifier characters to avoid SQL injection.
-    df = allowed_filters.get("date_field")
-    if df is not None:
-        safe = ''.join(ch for ch in str(df) if ch.isalnum() or ch in ('_', '.'))
+    if date_field is not None:
+        safe = ''.join(ch for ch in date_field if ch.isalnum() or ch in ('_', '.'))
         if not safe:
             safe = 'dt_cadastro'
         s = s.replace("{{date_field}}", safe)
-    else:
-        # If not provided, keep as-is (so SQLs sem placeholder continuam funcionando)
-        pass
+    # If not provided, keep as-is (so SQLs sem placeholder continuam funcionando)
 
-    if "from" in allowed_filters and allowed_filters.get("from") is not None:
+    if has_from:
         s = s.replace("{{from}}", ":from")
-        params["from"] = allowed_filters["from"]
+        bound.append("from")
     else:
         s = s.replace("{{from}}", "NULL")
 
-    if "to" in allowed_filters and allowed_filters.get("to") is not None:
+    if has_to:
         s = s.replace("{{to}}", ":to")
-        params["to"] = allowed_filters["to"]
+        bound.append("to")
     else:
         s = s.replace("{{to}}", "NULL")
 
     # simple filter injections
-    for k, v in allowed_filters.items():
-        if k in ("from", "to", "tenant_id"):
-            continue
+    for k, present in filters:
         placeholder = f"{{{{filter:{k}}}}}"
-        if placeholder in s and v is not None:
+        if placeholder in s and present:
             s = s.replace(placeholder, f" AND {k} = :{k} ")
-            params[k] = v
+            bound.append(k)
         elif placeholder in s:
             s = s.replace(placeholder, "")
 
+    return s, tuple(bound)
+
+
+def apply_placeholders(sql: str, allowed_filters: Dict[str, Any]) -> tuple[str, Dict[str, Any]]:
+    # Replace known placeholders with SQLAlchemy bind params
+    # {{tenant_id}} -> :tenant_id, {{from}} -> :from, {{to}} -> :to, {{filter:campo}} -> AND campo=:campo
+    df = allowed_filters.get("date_field")
+    s, bound = _render_placeholders(
+        sql,
+        None if df is None else str(df),
+        allowed_filters.get("from") is not None,
+        allowed_filters.get("to") is not None,
+        tuple((k, v is not None) for k, v in allowed_filters.items() if k not in ("from", "to", "tenant_id")),
+    )
+    params: Dict[str, Any] = {k: allowed_filters[k] for k in bound}
     if "tenant_id" in allowed_filters:
         params["tenant_id"] = allowed_filters["tenant_id"]
 
     return s, params
+
+
+@lru_cache(maxsize=1024)
+def cached_text(sql: str) -> TextClause:
+    # Um TextClause por SQL distinto: sem reparse dos binds a cada execução
+    return text(sql)
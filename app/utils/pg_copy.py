@@ -0,0 +1,123 @@
+import io
+import json
+import struct
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, List, Sequence
+
+from sqlalchemy import JSON, BigInteger, Boolean, DateTime, Float, Integer, Table, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session
+try:
+    import orjson
+except Exception:  # orjson é opcional; sem ele fica o json da stdlib
+    orjson = None
+
+
+# COPY no formato binário do Postgres: cada valor já vai no formato interno do tipo
+# (int/float/timestamp sem virar texto nem ser re-parseado pelo servidor).
+# Layout: cabeçalho fixo, por linha int16 nº de campos e por campo int32 tamanho +
+# bytes (tamanho -1 = NULL), e int16 -1 no fim.
+_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_TRAILER = struct.pack('>h', -1)
+_NULL = struct.pack('>i', -1)
+_LEN = struct.Struct('>i')
+_INT4 = struct.Struct('>ii')
+_INT8 = struct.Struct('>iq')
+_FLOAT8 = struct.Struct('>id')
+_BOOL = struct.Struct('>i?')
+# timestamp: microssegundos desde 2000-01-01
+_PG_EPOCH = datetime(2000, 1, 1)
+# Commit das cargas via COPY sem esperar o flush do WAL (SET LOCAL: só a transação da
+# carga). Uma queda logo após o commit pode perder o último lote, mas não corrompe nada
+# e o arquivo/consulta de origem pode ser reingerido.
+COPY_ASYNC_COMMIT = True
+
+
+def supports_copy(db: Session) -> bool:
+    bind = db.get_bind()
+    return bind.dialect.name == 'postgresql' and bind.dialect.driver in ('psycopg2', 'psycopg')
+
+
+def _text(v: Any) -> bytes:
+    b = (v if isinstance(v, str) else str(v)).encode()
+    return _LEN.pack(len(b)) + b
+
+
+def _dumps(v: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(v, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(v, ensure_ascii=False, default=str).encode()
+
+
+def _json(v: Any) -> bytes:
+    b = _dumps(v)
+    return _LEN.pack(len(b)) + b
+
+
+def _jsonb(v: Any) -> bytes:
+    # jsonb binário = byte de versão (1) + texto
+    b = b'\x01' + _dumps(v)
+    return _LEN.pack(len(b)) + b
+
+
+def _timestamp(v: Any) -> bytes:
+    if not isinstance(v, datetime):
+        v = datetime(v.year, v.month, v.day)
+    elif v.tzinfo is not None:
+        # coluna sem fuso: guarda o instante em UTC
+        v = v.astimezone(timezone.utc).replace(tzinfo=None)
+    d = v - _PG_EPOCH
+    return _INT8.pack(8, (d.days * 86400 + d.seconds) * 1000000 + d.microseconds)
+
+
+def _encoder(column) -> Callable[[Any], bytes]:
+    type_ = column.type
+    if isinstance(type_, JSONB):
+        return _jsonb
+    if isinstance(type_, JSON):
+        return _json
+    if isinstance(type_, Boolean):
+        return lambda v: _BOOL.pack(1, bool(v))
+    if isinstance(type_, BigInteger):
+        return lambda v: _INT8.pack(8, int(v))
+    if isinstance(type_, Integer):
+        return lambda v: _INT4.pack(4, int(v))
+    if isinstance(type_, Float):
+        return lambda v: _FLOAT8.pack(8, float(v))
+    if isinstance(type_, DateTime):
+        return _timestamp
+    # String/Text (varchar e text têm o mesmo formato binário)
+    return _text
+
+
+def _binary_buffer(encoders: List[Callable[[Any], bytes]], rows: Iterable[Sequence[Any]]) -> io.BytesIO:
+    buf = io.BytesIO()
+    write = buf.write
+    write(_HEADER)
+    fields = struct.pack('>h', len(encoders))
+    for row in rows:
+        write(fields)
+        for enc, v in zip(encoders, row):
+            write(_NULL if v is None else enc(v))
+    write(_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+def copy_rows(db: Session, table: Table, columns: List[str], rows: Iterable[Sequence[Any]]) -> None:
+    """COPY ... FROM STDIN (BINARY) na conexão da sessão, dentro da transação corrente.
+
+    O formato de cada campo sai do tipo da coluna no Table (JSON recebe o objeto,
+    não o texto já serializado).
+    """
+    sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)"
+    buf = _binary_buffer([_encoder(table.c[name]) for name in columns], rows)
+    if COPY_ASYNC_COMMIT:
+        db.execute(text("SET LOCAL synchronous_commit = off"))
+    raw = db.connection().connection.dbapi_connection
+    with raw.cursor() as cur:
+        if hasattr(cur, 'copy_expert'):
+            cur.copy_expert(sql, buf)  # psycopg2
+        else:
+            with cur.copy(sql) as cp:  # psycopg 3
+                cp.write(buf.getvalue())
@@ -0,0 +1,100 @@
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Hashable
+
+from app.settings import settings
+try:
+    import redis
+except Exception:  # redis é opcional; sem ele o cache fica só em memória
+    redis = None
+
+
+# Cache dos agregados dos painéis (corpo JSON já serializado). A chave inclui o
+# tenant e a "geração" dele: qualquer ingestão/limpeza incrementa a geração e as
+# entradas antigas deixam de ser encontradas (saem pelo LRU ou pelo TTL).
+#
+# Em memória (por processo) por padrão. Com RESULT_CACHE_REDIS a geração e os
+# corpos ficam no Redis, compartilhados entre workers: uma ingestão em qualquer
+# processo invalida todos, então o TTL pode ser maior.
+RESULT_CACHE_TTL = 60
+RESULT_CACHE_SIZE = 1024
+REDIS_CACHE_TTL = 300
+REDIS_KEY_PREFIX = "nx"
+# Timeout curto e pausa após falha: Redis fora do ar degrada para o cache local
+REDIS_TIMEOUT = 0.25
+REDIS_RETRY_AFTER = 30
+_entries: "OrderedDict[tuple, tuple[float, bytes]]" = OrderedDict()
+_generations: dict[int, int] = {}
+_lock = Lock()
+_redis = None
+_redis_down_until = 0.0
+
+
+def _redis_client():
+    global _redis
+    if redis is None or not settings.RESULT_CACHE_REDIS or time.monotonic() < _redis_down_until:
+        return None
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.REDIS_URL, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT)
+    return _redis
+
+
+def _redis_failed() -> None:
+    global _redis_down_until
+    _redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+
+
+def _gen_key(organization_id: int) -> str:
+    return f"{REDIS_KEY_PREFIX}:org:{organization_id}:gen"
+
+
+def invalidate_tenant(organization_id: int) -> None:
+    with _lock:
+        _generations[organization_id] = _generations.get(organization_id, 0) + 1
+    client = _redis_client()
+    if client is not None:
+        try:
+            client.incr(_gen_key(organization_id))
+        except Exception:
+            _redis_failed()
+
+
+def _cached_redis(client, endpoint: str, organization_id: int, params: Hashable, compute: Callable[[], bytes]) -> bytes:
+    gen = client.get(_gen_key(organization_id)) or b"0"
+    digest = hashlib.sha1(repr(params).encode()).hexdigest()
+    key = f"{REDIS_KEY_PREFIX}:org:{organization_id}:{gen.decode()}:{endpoint}:{digest}"
+    hit = client.get(key)
+    if hit is not None:
+        return hit
+    value = compute()
+    try:
+        client.set(key, value, ex=REDIS_CACHE_TTL)
+    except redis.RedisError:
+        # resultado já calculado; só não fica guardado
+        _redis_failed()
+    return value
+
+
+def cached_result(endpoint: str, organization_id: int, params: Hashable, compute: Callable[[], bytes]) -> bytes:
+    client = _redis_client()
+    if client is not None:
+        try:
+            return _cached_redis(client, endpoint, organization_id, params, compute)
+        except redis.RedisError:
+            _redis_failed()
+    key = (endpoint, organization_id, _generations.get(organization_id, 0), params)
+    now = time.monotonic()
+    with _lock:
+        hit = _entries.get(key)
+        if hit is not None and hit[0] > now:
+            _entries.move_to_end(key)
+            return hit[1]
+    value = compute()
+    with _lock:
+        _entries[key] = (now + RESULT_CACHE_TTL, value)
+        _entries.move_to_end(key)
+        while len(_entries) > RESULT_CACHE_SIZE:
+            _entries.popitem(last=False)
+    return value
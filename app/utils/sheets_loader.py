@@ -1,13 +1,62 @@
-from typing import List, Dict
+from threading import Lock
+from typing import List, Dict, Tuple
 import gspread
+from gspread.utils import absolute_range_name, numericise
 
 
-def load_sheet(spreadsheet_id: str, range_name: str) -> List[Dict]:
-    # This function uses the default credentials available to gspread.
+_client = None
+_client_lock = Lock()
+
+
+def _http():
+    # Cliente autenticado uma vez por processo (o gspread.oauth() relê credentials.json e
+    # token.json a cada chamada); o token de acesso é renovado pela própria sessão.
     # In production, configure OAuth and store per-tenant tokens.
-    gc = gspread.oauth()  # expects credentials.json and token.json in working dir
-    sh = gc.open_by_key(spreadsheet_id)
-    ws = sh.worksheet(range_name) if ":" not in range_name else sh.worksheet(range_name.split("!")[-1])
-    values = ws.get_all_records()
-    return values
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = gspread.oauth()  # expects credentials.json and token.json in working dir
+        return _client.http_client
+
+
+def _sheet_title(range_name: str) -> str:
+    # "Aba" ou "Aba!A1:Z": só o nome da aba
+    return range_name.split("!")[0]
+
+
+def _batch_get(spreadsheet_id: str, range_name: str, ranges: List[str]) -> List[List]:
+    # Um único values.batchGet com os ranges já qualificados pela aba, sem os GETs de
+    # metadados do open_by_key/worksheet
+    title = _sheet_title(range_name)
+    resp = _http().values_batch_get(spreadsheet_id, [absolute_range_name(title, r) for r in ranges])
+    return [vr.get("values", []) for vr in resp.get("valueRanges", [])]
+
+
+def _records(header: List, rows: List[List]) -> List[Dict]:
+    width = len(header)
+    return [
+        {h: numericise(v) for h, v in zip(header, list(values) + [""] * (width - len(values)))}
+        for values in rows
+    ]
+
+
+def load_sheet(spreadsheet_id: str, range_name: str) -> List[Dict]:
+    # Mesmo resultado do get_all_records: 1ª linha é o cabeçalho, valores numericizados
+    (values,) = _batch_get(spreadsheet_id, range_name, [None])
+    if not values:
+        return []
+    header, *rows = values
+    return _records(header, rows)
+
+
+def load_sheet_since(spreadsheet_id: str, range_name: str, last_row: int = 1) -> Tuple[List[Dict], int]:
+    """Lê só as linhas após `last_row` (1 = cabeçalho) e retorna (registros, novo cursor).
 
+    Cabeçalho e dados vêm num único values.batchGet em vez de carregar a aba inteira.
+    """
+    start = max(int(last_row or 1), 1) + 1
+    header_range, data_range = _batch_get(spreadsheet_id, range_name, ["1:1", f"A{start}:ZZ"])
+    header = header_range[0] if header_range else []
+    records = _records(header, [values for values in data_range if any(str(v).strip() for v in values)])
+    # a API corta linhas vazias no fim, então len(data_range) chega até a última linha preenchida
+    return records, start - 1 + len(data_range)
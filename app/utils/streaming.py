@@ -0,0 +1,77 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Iterator
+
+from sqlalchemy.engine import Connection, Result
+try:
+    import orjson
+except Exception:  # orjson é opcional; sem ele fica o json da stdlib
+    orjson = None
+
+
+# Linhas por fetch do cursor (e por pedaço enviado ao cliente)
+STREAM_CHUNK_SIZE = 1000
+
+
+def _json_default(value):
+    # Mesmas conversões do jsonable_encoder para o que o driver costuma devolver
+    if isinstance(value, Decimal):
+        # numeric inteiro continua inteiro (10, não 10.0), como no decimal_encoder do FastAPI
+        exponent = value.as_tuple().exponent
+        return int(value) if isinstance(exponent, int) and exponent >= 0 else float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _dumps(row: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(row, default=_json_default)
+    return json.dumps(row, default=_json_default, ensure_ascii=False).encode()
+
+
+def _json_chunks(result: Result, key: str | None) -> Iterator[bytes]:
+    # key=None: só o array, para as listagens que devolvem [...] direto
+    yield b"[" if key is None else b'{"' + key.encode() + b'":['
+    first = True
+    for part in result.mappings().partitions(STREAM_CHUNK_SIZE):
+        body = b",".join(_dumps(dict(row)) for row in part)
+        yield body if first else b"," + body
+        first = False
+    yield b"]" if key is None else b"]}"
+
+
+def json_rows(result: Result, key: str | None = "rows") -> bytes:
+    """Corpo {"<key>": [...]} (ou [...] com key=None) inteiro, para resultados pequenos.
+
+    Serializa direto do cursor: sem a lista de RowMapping do .all(), sem a segunda
+    lista de dicts e sem o jsonable_encoder da resposta padrão.
+    """
+    try:
+        return b"".join(_json_chunks(result, key))
+    finally:
+        result.close()
+
+
+def close_stream(conn: Connection, result: Result) -> None:
+    """Fecha resultado e conexão do streaming; idempotente (roda no fim do gerador e
+    de novo no background da resposta, que cobre o gerador nunca iniciado)."""
+    try:
+        result.close()
+    finally:
+        conn.close()
+
+
+def stream_json_rows(conn: Connection, result: Result, key: str = "rows") -> Iterator[bytes]:
+    """Gera {"<key>": [...]} em pedaços a partir de um resultado aberto.
+
+    Memória proporcional ao pedaço, não ao total de linhas. Fecha a conexão ao fim
+    (ou se o cliente desconectar), já que ela vive além da sessão do request; quem
+    devolve a resposta também agenda close_stream, pois se o cliente cair antes do
+    corpo começar o gerador nunca roda.
+    """
+    try:
+        yield from _json_chunks(result, key)
+    finally:
+        close_stream(conn, result)
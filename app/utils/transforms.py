@@ -1,13 +1,40 @@
 from __future__ import annotations
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, date
-from typing import Iterable, Dict, Any, List
+from functools import lru_cache
+from itertools import chain
+from threading import Lock
+from typing import Iterable, Iterator, Dict, Any, List
 import math
+import multiprocessing
 from typing import cast
 from dateutil import parser as dateparser
+from sqlalchemy import func, insert, text
 from sqlalchemy.orm import Session
 
 from app.models import CuratedRecord, StagingRecord
+from app.settings import settings
+from app.utils.pg_copy import copy_rows, supports_copy
+from app.utils.result_cache import invalidate_tenant
 import unicodedata
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except Exception:  # pyarrow é opcional; sem ele a conversão é por valor
+    pa = pc = None
+
+
+# Tamanho dos lotes de INSERT (um executemany por lote)
+STAGING_BATCH_SIZE = 10000
+# Curados têm ~25 colunas: lote menor, com commit por lote
+CURATED_BATCH_SIZE = 2000
+# Processos que convertem lotes de CSV em paralelo à escrita (0 = tudo no processo atual)
+CSV_PREP_WORKERS = settings.CSV_PREP_WORKERS
+# Lotes convertidos que podem esperar pela escrita
+CSV_PREP_AHEAD = 2
+_prep_pool: ProcessPoolExecutor | None = None
+_prep_lock = Lock()
 
 
 KEY_MAP = {
@@ -39,31 +66,33 @@ KEY_MAP = {
 }
 
 
+# Separadores comuns viram "_" numa única passada (str.translate)
+_SEP_TT = str.maketrans({ch: '_' for ch in ' /.-\\'})
+
+
+@lru_cache(maxsize=4096)
 def _norm_key(k: str) -> str:
-    # normalize accents and common separators
+    # normalize accents and common separators; cabeçalhos se repetem em todas as linhas
     if not isinstance(k, str):
         k = str(k)
     s = unicodedata.normalize('NFKD', k)
     s = ''.join(ch for ch in s if not unicodedata.combining(ch))
-    s = s.strip().lower()
-    for ch in [' ', '/', '.', '-', '\\']:
-        s = s.replace(ch, '_')
+    s = s.strip().lower().translate(_SEP_TT)
     while '__' in s:
         s = s.replace('__', '_')
     return s
 
 
 def _find(row: Dict[str, Any], target_key: str):
+    # row já vem com as chaves normalizadas (_norm_key)
     candidates = set(KEY_MAP.get(target_key, []))
     # pass 1: exact match against known aliases
-    for k, v in row.items():
-        nk = _norm_key(k)
+    for nk, v in row.items():
         if nk in candidates or nk == target_key:
             return v
     # pass 2: fuzzy contains to be resilient to variações de cabeçalhos
     tk = target_key
-    for k, v in row.items():
-        nk = _norm_key(k)
+    for nk, v in row.items():
         if tk == 'cpf_cnpj':
             if ('cpf' in nk) or ('cnpj' in nk) or ('cpf_cgc' in nk) or ('cpfcnpj' in nk):
                 return v
@@ -83,117 +112,458 @@ def _find(row: Dict[str, Any], target_key: str):
     return None
 
 
+# dd/mm/aaaa com hora (sem hora é montado direto em _to_dt)
+_DMY_TIME_FORMATS = ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M')
+
+
 def _to_dt(v):
     if v in (None, ""):
         return None
-    try:
-        import pandas as pd  # type: ignore
-        if pd.isna(v):
-            return None
-    except Exception:
-        pass
-    # pandas.Timestamp
-    try:
-        if hasattr(v, "to_pydatetime"):
-            return v.to_pydatetime()
-    except Exception:
-        pass
+    # Sem pandas por valor: driver SQL/openpyxl já entregam datetime, e
+    # pandas.Timestamp/NaT são subclasses de datetime (NaT é o único != de si mesmo)
     if isinstance(v, datetime):
-        return v
+        if v != v:
+            return None
+        return v.to_pydatetime() if hasattr(v, "to_pydatetime") else v
     if isinstance(v, date):
         return datetime(v.year, v.month, v.day)
     # Convert known NaT/NaN strings to None
     s = str(v).strip()
     if s.lower() in ("nat", "nan", "none", "null"):
         return None
+    # Formatos das planilhas (ISO e dd/mm/aaaa) sem o dateutil, que tenta formato por
+    # formato a cada valor; o dateutil fica só para o que sobrar
+    if len(s) >= 10:
+        try:
+            if s[4] == '-':
+                return datetime.fromisoformat(s)
+            if s[2] == '/' and s[5] == '/':
+                if len(s) == 10:
+                    return datetime(int(s[6:]), int(s[3:5]), int(s[:2]))
+                for fmt in _DMY_TIME_FORMATS:
+                    try:
+                        return datetime.strptime(s, fmt)
+                    except ValueError:
+                        pass
+        except ValueError:
+            pass
+    # Mesma ordem do atalho acima para toda data sem o ano na frente (dd-mm-aaaa,
+    # d/m/aaaa, dd.mm.aa...): dia primeiro. Ano na frente (2024/01/05, 20240105) segue ano-mês-dia
     try:
-        return dateparser.parse(s)
+        return dateparser.parse(s, dayfirst=not s[:4].isdigit())
     except Exception:
         return None
 
 
+# "1.234,56" -> "1234.56" numa passada só (milhar some, vírgula vira ponto)
+_NUM_TT = str.maketrans({'.': '', ',': '.'})
+
+
 def _to_float(v):
     if v in (None, ""):
         return None
-    # Handle pandas/NumPy NaN
-    try:
-        import math, numpy as np  # type: ignore
-        if (isinstance(v, float) and (math.isnan(v) or math.isinf(v))) or (hasattr(np, 'isnan') and isinstance(v, (np.floating,)) and np.isnan(v)):
-            return None
-    except Exception:
-        pass
+    # Já numérico (pandas/openpyxl/driver SQL): sem ida e volta por str; NaN/inf viram NULL
+    # (np.float64 é subclasse de float)
+    if isinstance(v, float):
+        return None if (math.isnan(v) or math.isinf(v)) else float(v)
+    if type(v) is int:
+        return float(v)
     s = str(v).strip()
     if s.lower() in ("nan", "nat", "none", "null"):
         return None
     try:
-        return float(s.replace('.', '').replace(',', '.')) if (',' in s and s.count(',')==1 and '.' in s) else float(s.replace(',', '.'))
+        return float(s.translate(_NUM_TT)) if (s.count(',') == 1 and '.' in s) else float(s.replace(',', '.'))
     except Exception:
         return None
 
+# Número já no formato do float() depois da troca de separadores (o resto vira NULL)
+_FLOAT_RE = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+
+
+def _to_float_series(series) -> List[Any]:
+    """_to_float de uma coluna de texto inteira do DataFrame, com pyarrow.compute.
+
+    Mesmo resultado do _to_float por valor ("1.234,56" e "1234,56" viram 1234.56; o que
+    não converte vira None), em laços C sobre o buffer Arrow em vez de uma chamada Python
+    por célula. Sem pyarrow, ou coluna que não é texto, cai no _to_float por valor.
+    """
+    if pc is not None and series.dtype.kind == 'O':
+        try:
+            txt = pc.utf8_trim_whitespace(pa.array(series, type=pa.string(), from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # objeto misto (números e texto na mesma coluna)
+            txt = None
+        if txt is not None:
+            # Milhar com ponto só quando há exatamente uma vírgula decimal
+            br = pc.and_(pc.equal(pc.count_substring(txt, ','), 1), pc.match_substring(txt, '.'))
+            txt = pc.replace_substring(pc.if_else(br, pc.replace_substring(txt, '.', ''), txt), ',', '.')
+            txt = pc.if_else(pc.match_substring_regex(txt, _FLOAT_RE), txt, None)
+            return pc.cast(txt, pa.float64()).to_pylist()
+    return [_to_float(v) for v in series.tolist()]
+
+
 def _to_int(v):
     if v in (None, ""):
         return None
-    try:
-        import math, numpy as np  # type: ignore
-        if (isinstance(v, float) and (math.isnan(v) or math.isinf(v))) or (hasattr(np, 'isnan') and isinstance(v, (np.floating,)) and np.isnan(v)):
-            return None
-    except Exception:
-        pass
+    if type(v) is int:
+        return v
+    # float (ex.: coluna inteira com vazios vira float64 no pandas): 30.0 -> 30
+    if isinstance(v, float):
+        return None if (math.isnan(v) or math.isinf(v)) else int(v)
     s = str(v).strip()
     if s.lower() in ("nan", "nat", "none", "null"):
         return None
     try:
         # remove separadores e converte
-        s2 = s.replace('.', '').replace(',', '.')
-        return int(float(s2))
+        return int(float(s.translate(_NUM_TT)))
     except Exception:
         return None
 
 
-def materialize_curated(staging_rows: Iterable[Dict[str, Any]], organization_id: int, db: Session, credor_code: str | None = None) -> int:
-    # Ingesta em lotes para bases grandes
-    batch: list[CuratedRecord] = []
+def _to_uf(v):
+    # UF canônica (" sp" -> "SP"): o GROUP BY do mapa não separa grafias; vazio/NaN viram NULL
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return None
+    s = str(v).strip().upper()
+    return s or None
+
+
+def _to_uf_series(series) -> List[Any]:
+    # _to_uf da coluna inteira (pyarrow.compute); coluna só ASCII (o normal para UF) usa
+    # ascii_upper, que não decodifica UTF-8. Sem pyarrow ou coluna não texto: por valor
+    if pc is not None and series.dtype.kind == 'O':
+        try:
+            txt = pc.utf8_trim_whitespace(pa.array(series, type=pa.string(), from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            txt = None
+        if txt is not None:
+            ascii_only = pc.all(pc.string_is_ascii(txt)).as_py() is not False
+            txt = pc.ascii_upper(txt) if ascii_only else pc.utf8_upper(txt)
+            return pc.if_else(pc.equal(txt, ''), None, txt).to_pylist()
+    return [_to_uf(v) for v in series.tolist()]
+
+
+def iter_batches(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for r in rows:
+        batch.append(r)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _ym(dt: datetime | None) -> str | None:
+    return dt.strftime('%Y-%m') if dt else None
+
+
+@lru_cache(maxsize=256)
+def _dict_plan(keys: tuple) -> Dict[str, Any]:
+    # Campo curado -> chave original, resolvido uma vez por conjunto de cabeçalhos
+    # (em CSV/planilha todas as linhas têm as mesmas chaves). Chaves que normalizam
+    # igual ficam com a última, como no dict normalizado por linha de antes.
+    header_row: Dict[str, Any] = {}
+    for k in keys:
+        header_row[_norm_key(k)] = k
+    plan = {}
+    for field in KEY_MAP:
+        src = _find(header_row, field)
+        if src is not None:
+            plan[field] = src
+    return plan
+
+
+def _curated_values(raw: Dict[str, Any], organization_id: int, credor_code: str | None) -> Dict[str, Any]:
+    plan = _dict_plan(tuple(raw))
+    get = {field: raw[src] for field, src in plan.items()}.get
+    dt_cadastro = _to_dt(get('dt_cadastro'))
+    return dict(
+        organization_id=organization_id,
+        credor_code=(credor_code or get('credor_code') or None),
+        uf=_to_uf(get('uf')),
+        processo=( get('processo') or None ),
+        devedor=( get('devedor') or None ),
+        cpf_cnpj=( get('cpf_cnpj') or None ),
+        faixa_vencimento=( get('faixa_vencimento') or None ),
+        dt_vencimento=_to_dt(get('dt_vencimento')),
+        vl_titulo=_to_float(get('vl_titulo')),
+        situacao_processo=( get('situacao_processo') or None ),
+        vl_total_repasse=_to_float(get('vl_total_repasse')),
+        vl_saldo=_to_float(get('vl_saldo')),
+        dt_ultimo_credito=_to_dt(get('dt_ultimo_credito')),
+        portador=( get('portador') or None ),
+        motivo_devolucao=( get('motivo_devolucao') or None ),
+        vl_honorario_devedor=_to_float(get('vl_honorario_devedor')),
+        vl_tx_contrato=_to_float(get('vl_tx_contrato')),
+        comercial=( get('comercial') or None ),
+        cobrador=( get('cobrador') or None ),
+        dt_encerrado=_to_dt(get('dt_encerrado')),
+        dias_vencidos_cadastro=_to_int(get('dias_vencidos_cadastro')),
+        dt_cadastro=dt_cadastro,
+        ym=_ym(dt_cadastro),
+    )
+
+
+def materialize_curated(staging_rows: Iterable[Dict[str, Any]], organization_id: int, db: Session, credor_code: str | None = None,
+                        chunk_size: int = CURATED_BATCH_SIZE, commit: bool = True) -> int:
+    # Ingesta em lotes para bases grandes: um INSERT executemany (Core) por lote,
+    # ou COPY binário no Postgres; commit=False deixa a transação para quem chama
     count = 0
-    BATCH_SIZE = 2000
-    for raw in staging_rows:
-        row = {(_norm_key(k)): v for k, v in raw.items()}
-        cur = CuratedRecord(
-            organization_id=organization_id,
-            credor_code=(credor_code or _find(row, 'credor_code')),
-            uf=( _find(row, 'uf') or None ),
-            processo=( _find(row, 'processo') or None ),
-            devedor=( _find(row, 'devedor') or None ),
-            cpf_cnpj=( _find(row, 'cpf_cnpj') or None ),
-            faixa_vencimento=( _find(row, 'faixa_vencimento') or None ),
-            dt_vencimento=_to_dt(_find(row, 'dt_vencimento')),
-            vl_titulo=_to_float(_find(row, 'vl_titulo')),
-            situacao_processo=( _find(row, 'situacao_processo') or None ),
-            vl_total_repasse=_to_float(_find(row, 'vl_total_repasse')),
-            vl_saldo=_to_float(_find(row, 'vl_saldo')),
-            dt_ultimo_credito=_to_dt(_find(row, 'dt_ultimo_credito')),
-            portador=( _find(row, 'portador') or None ),
-            motivo_devolucao=( _find(row, 'motivo_devolucao') or None ),
-            vl_honorario_devedor=_to_float(_find(row, 'vl_honorario_devedor')),
-            vl_tx_contrato=_to_float(_find(row, 'vl_tx_contrato')),
-            comercial=( _find(row, 'comercial') or None ),
-            cobrador=( _find(row, 'cobrador') or None ),
-            dt_encerrado=_to_dt(_find(row, 'dt_encerrado')),
-            dias_vencidos_cadastro=_to_int(_find(row, 'dias_vencidos_cadastro')),
-            dt_cadastro=_to_dt(_find(row, 'dt_cadastro')),
-        )
-        batch.append(cur)
-        count += 1
-        if len(batch) >= BATCH_SIZE:
-            db.add_all(batch)
+    use_copy = supports_copy(db)
+    for chunk in iter_batches(staging_rows, chunk_size):
+        keys = tuple(chunk[0])
+        if all(tuple(raw) == keys for raw in chunk):
+            # Cabeçalho único no lote (planilha/xlsx/Sheets): plano resolvido uma vez e
+            # conversão coluna a coluna, como no CSV, sem montar um dict curado por linha
+            plan = _dict_plan(keys)
+            columns = {src: [raw[src] for raw in chunk] for src in plan.values()}
+            fields, values = _curated_columns(plan, columns, len(chunk), organization_id, credor_code)
+            _write_curated(fields, values, organization_id, db, commit)
+            count += len(chunk)
+            continue
+        values = [_curated_values(raw, organization_id, credor_code) for raw in chunk]
+        if use_copy:
+            copy_rows(db, CuratedRecord.__table__, list(values[0]), [tuple(v.values()) for v in values])
+        else:
+            db.execute(insert(CuratedRecord.__table__).values(created_at=func.now()), values)
+        if commit:
             db.commit()
-            batch.clear()
-    if batch:
-        db.add_all(batch)
-        db.commit()
+        count += len(chunk)
+    # Agregados em cache do tenant ficam obsoletos
+    invalidate_tenant(organization_id)
     return count
 
 
+# Conversão aplicada a cada campo curado (None = texto, vazio vira NULL)
+_FIELD_CONVERTERS = {
+    'dt_vencimento': _to_dt, 'dt_ultimo_credito': _to_dt, 'dt_encerrado': _to_dt, 'dt_cadastro': _to_dt,
+    'vl_titulo': _to_float, 'vl_total_repasse': _to_float, 'vl_saldo': _to_float,
+    'vl_honorario_devedor': _to_float, 'vl_tx_contrato': _to_float,
+    'dias_vencidos_cadastro': _to_int,
+    'uf': _to_uf,
+}
+
+# Versão por coluna (DataFrame) dos conversores que têm uma
+_SERIES_CONVERTERS = {_to_float: _to_float_series, _to_uf: _to_uf_series}
+
+
+def curated_plan(columns: List[str]) -> Dict[str, int]:
+    # Resolve uma vez, pelos cabeçalhos, qual coluna alimenta cada campo curado
+    # (lotes do mesmo CSV/consulta repetem os cabeçalhos: o plano sai do cache)
+    return _columns_plan(tuple(columns))
+
+
+@lru_cache(maxsize=256)
+def _columns_plan(columns: tuple) -> Dict[str, int]:
+    header_row = {_norm_key(c): i for i, c in enumerate(columns)}
+    plan = {}
+    for field in KEY_MAP:
+        idx = _find(header_row, field)
+        if idx is not None:
+            plan[field] = idx
+    return plan
+
+
+def materialize_curated_columns(plan: Dict[str, int], rows: List[tuple], organization_id: int, db: Session, credor_code: str | None = None) -> int:
+    """Variante de materialize_curated para linhas em tupla com cabeçalho fixo (resultado SQL).
+
+    Converte coluna a coluna a partir do plano, sem normalizar chaves por linha.
+    """
+    if not rows:
+        return 0
+    return _materialize_columns(plan, list(zip(*rows)), len(rows), organization_id, db, credor_code)
+
+
+def materialize_curated_frame(df, organization_id: int, db: Session, credor_code: str | None = None) -> int:
+    """Variante de materialize_curated para um lote de CSV já em DataFrame.
+
+    Só as colunas do plano saem do DataFrame (uma lista por coluna); sem dict por linha.
+    """
+    if df.empty:
+        return 0
+    return _write_curated(*_curated_frame_columns(df, organization_id, credor_code), organization_id, db)
+
+
+def _curated_frame_columns(df, organization_id: int, credor_code: str | None) -> tuple[List[str], List[List[Any]]]:
+    plan = curated_plan([str(c) for c in df.columns])
+    # Valores monetários e UF convertidos pela coluna inteira (vetorizado)
+    converted = {
+        field: _SERIES_CONVERTERS[_FIELD_CONVERTERS[field]](df.iloc[:, idx])
+        for field, idx in plan.items() if _FIELD_CONVERTERS.get(field) in _SERIES_CONVERTERS
+    }
+    columns: Dict[int, List[Any]] = {idx: df.iloc[:, idx].tolist() for field, idx in plan.items() if field not in converted}
+    return _curated_columns(plan, columns, len(df), organization_id, credor_code, converted)
+
+
+def _prepare_csv_batch(df, organization_id: int, credor_code: str | None):
+    """Parte CPU de um lote de CSV, sem banco (pode rodar num processo do pool):
+    linhas do staging já serializáveis e colunas do curado já convertidas."""
+    staging = _frame_to_jsonable(df)
+    return staging, _curated_frame_columns(df, organization_id, credor_code)
+
+
+def _write_csv_batch(prepared, organization_id: int, db: Session) -> int:
+    staging, (fields, values) = prepared
+    _insert_staging(staging, organization_id, db)
+    db.commit()
+    return _write_curated(fields, values, organization_id, db)
+
+
+def _csv_prep_pool() -> ProcessPoolExecutor | None:
+    # Criado no primeiro CSV com mais de um lote; spawn (fork com threads vivas no
+    # processo web pode herdar locks presos). Com CSV_PREP_WORKERS = 0 fica tudo no processo.
+    global _prep_pool
+    if CSV_PREP_WORKERS < 1:
+        return None
+    with _prep_lock:
+        if _prep_pool is None:
+            _prep_pool = ProcessPoolExecutor(max_workers=CSV_PREP_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _prep_pool
+
+
+def shutdown_csv_prep_pool() -> None:
+    # Desligamento do app: encerra os processos do pool, se algum CSV chegou a criá-lo
+    global _prep_pool
+    with _prep_lock:
+        pool, _prep_pool = _prep_pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def ingest_csv_file(fileobj, organization_id: int, db: Session, credor_code: str | None = None) -> int:
+    """Staging + curado de um CSV inteiro, em lotes de STAGING_BATCH_SIZE linhas."""
+    from app.utils.csv_loader import iter_csv_frames, sniff_delimiter
+
+    frames = iter_csv_frames(fileobj, STAGING_BATCH_SIZE, sep=sniff_delimiter(fileobj))
+    first = next(frames, None)
+    if first is None:
+        return 0
+    second = next(frames, None)
+    pool = _csv_prep_pool() if second is not None else None
+    if pool is None:
+        # Um lote só (ou pool desligado): conversão e escrita em sequência
+        count = 0
+        for df in chain([first], [] if second is None else [second], frames):
+            count += _write_csv_batch(_prepare_csv_batch(df, organization_id, credor_code), organization_id, db)
+        return count
+    # Vários lotes: o pool converte os próximos enquanto este processo grava o atual;
+    # no máximo CSV_PREP_AHEAD lotes convertidos esperando (memória limitada)
+    count = 0
+    pending: deque = deque()
+    for df in chain([first, second], frames):
+        pending.append(pool.submit(_prepare_csv_batch, df, organization_id, credor_code))
+        if len(pending) > CSV_PREP_AHEAD:
+            count += _write_csv_batch(pending.popleft().result(), organization_id, db)
+    while pending:
+        count += _write_csv_batch(pending.popleft().result(), organization_id, db)
+    return count
+
+
+def _materialize_columns(plan: Dict[str, int], columns, n: int, organization_id: int, db: Session, credor_code: str | None,
+                         converted: Dict[str, List[Any]] | None = None) -> int:
+    fields, values = _curated_columns(plan, columns, n, organization_id, credor_code, converted)
+    return _write_curated(fields, values, organization_id, db)
+
+
+def _curated_columns(plan: Dict[str, int], columns, n: int, organization_id: int, credor_code: str | None,
+                     converted: Dict[str, List[Any]] | None = None) -> tuple[List[str], List[List[Any]]]:
+    # columns: posição -> valores da coluna (lista de colunas ou dict com as do plano);
+    # converted: campos que já chegam convertidos
+    converted = converted or {}
+    fields: List[str] = ['organization_id']
+    values: List[List[Any]] = [[organization_id] * n]
+    for field in KEY_MAP:
+        conv = _FIELD_CONVERTERS.get(field)
+        if field == 'credor_code' and credor_code:
+            out = [credor_code] * n
+        elif field in converted:
+            out = converted[field]
+        else:
+            idx = plan.get(field)
+            col = columns[idx] if idx is not None else (None,) * n
+            out = [conv(v) for v in col] if conv is not None else [v or None for v in col]
+        fields.append(field)
+        values.append(out)
+        if field == 'dt_cadastro':
+            fields.append('ym')
+            values.append([_ym(v) for v in out])
+    return fields, values
+
+
+def _write_curated(fields: List[str], values: List[List[Any]], organization_id: int, db: Session, commit: bool = True) -> int:
+    # values: uma lista por campo, todas do mesmo tamanho
+    if not values[0]:
+        return 0
+    if supports_copy(db):
+        copy_rows(db, CuratedRecord.__table__, fields, zip(*values))
+    else:
+        db.execute(insert(CuratedRecord.__table__).values(created_at=func.now()), [dict(zip(fields, vals)) for vals in zip(*values)])
+    if commit:
+        db.commit()
+    invalidate_tenant(organization_id)
+    return len(values[0])
+
+
+# Tipo de destino de cada campo curado no caminho INSERT ... SELECT (Postgres)
+_SQL_CASTS = {
+    'dt_vencimento': 'TIMESTAMP', 'dt_ultimo_credito': 'TIMESTAMP', 'dt_encerrado': 'TIMESTAMP', 'dt_cadastro': 'TIMESTAMP',
+    'vl_titulo': 'DOUBLE PRECISION', 'vl_total_repasse': 'DOUBLE PRECISION', 'vl_saldo': 'DOUBLE PRECISION',
+    'vl_honorario_devedor': 'DOUBLE PRECISION', 'vl_tx_contrato': 'DOUBLE PRECISION',
+    'dias_vencidos_cadastro': 'INTEGER',
+}
+
+
+def materialize_from_query(query: str, organization_id: int, db: Session, credor_code: str | None = None) -> int:
+    """Staging + curadoria direto no servidor quando a fonte SQL é o próprio banco.
+
+    Só os cabeçalhos passam pelo Python (mesmo mapeamento de KEY_MAP); as linhas
+    nunca saem do Postgres. Valores que o CAST não aceita (ex.: "1.234,50") geram
+    erro, e quem chama deve voltar para o caminho em Python.
+    """
+    query = query.strip().rstrip(';')
+    prep = db.get_bind().dialect.identifier_preparer
+    cols = list(db.execute(text(f"SELECT * FROM ({query}) q LIMIT 0")).keys())
+    header_row = {_norm_key(c): c for c in cols}
+    targets = ['organization_id', 'credor_code', 'created_at']
+    exprs = [':org', 'COALESCE(:credor, {})', 'now()']
+    credor_src = _find(header_row, 'credor_code')
+    exprs[1] = exprs[1].format(f"CAST(q.{prep.quote(credor_src)} AS VARCHAR)" if credor_src else 'NULL')
+    for field in KEY_MAP:
+        src = _find(header_row, field)
+        if field == 'credor_code' or not src:
+            continue
+        value = f"NULLIF(TRIM(CAST(q.{prep.quote(src)} AS VARCHAR)), '')"
+        if field == 'uf':
+            value = f"UPPER({value})"
+        targets.append(field)
+        exprs.append(f"CAST({value} AS {_SQL_CASTS[field]})" if field in _SQL_CASTS else value)
+        if field == 'dt_cadastro':
+            targets.append('ym')
+            exprs.append(f"TO_CHAR({exprs[-1]}, 'YYYY-MM')")
+    params = {"org": organization_id, "credor": credor_code}
+    # Texto ambíguo (05/03/2024) no CAST com dia primeiro, como o _to_dt; só nesta transação
+    db.execute(text("SET LOCAL datestyle = 'ISO, DMY'"))
+    db.execute(
+        text(f"INSERT INTO staging_records (organization_id, raw_json, created_at) SELECT :org, to_json(q), now() FROM ({query}) q"),
+        params,
+    )
+    result = db.execute(
+        text(f"INSERT INTO curated_records ({', '.join(targets)}) SELECT {', '.join(exprs)} FROM ({query}) q"),
+        params,
+    )
+    db.commit()
+    invalidate_tenant(organization_id)
+    return result.rowcount
+
+
 def _to_jsonable(value: Any) -> Any:
+    # Escalares Python (driver SQL, Sheets, CSV texto) saem direto, sem tocar no numpy
+    kind = type(value)
+    if value is None or kind is str or kind is int or kind is bool:
+        return value
+    if kind is float:
+        return None if (math.isnan(value) or math.isinf(value)) else value
     try:
         import numpy as np  # type: ignore
     except Exception:  # pragma: no cover - numpy may not be present but we handle generically
@@ -231,8 +601,80 @@ def _row_to_jsonable(row: Dict[str, Any]) -> Dict[str, Any]:
     return {k: _to_jsonable(v) for k, v in row.items()}
 
 
-def store_staging(rows: List[Dict[str, Any]], organization_id: int, db: Session) -> int:
-    for r in rows:
-        db.add(StagingRecord(organization_id=organization_id, raw_json=_row_to_jsonable(r)))
+def _column_to_jsonable(series) -> List[Any]:
+    # Texto, inteiro e float do DataFrame em bloco (NaN/inf viram None); o resto por valor
+    import numpy as np
+    import pandas as pd
+    kind = series.dtype.kind
+    if isinstance(series.dtype, pd.StringDtype) or kind in 'iub':
+        return series.astype(object).where(series.notna(), None).tolist()
+    if kind == 'f':
+        values = series.astype(object).where(np.isfinite(series), None)
+        return values.tolist()
+    return [_to_jsonable(v) for v in series.tolist()]
+
+
+def _frame_to_jsonable(df) -> List[Dict[str, Any]]:
+    """Mesmo que _row_to_jsonable em cada linha de df.to_dict('records'), coluna a coluna."""
+    names = list(df.columns)
+    columns = [_column_to_jsonable(df.iloc[:, i]) for i in range(df.shape[1])]
+    return [dict(zip(names, vals)) for vals in zip(*columns)]
+
+
+def store_staging_batch(rows: List[Dict[str, Any]], organization_id: int, db: Session) -> int:
+    # Um único executemany para o lote inteiro (sem commit; quem chama decide)
+    return _insert_staging([_row_to_jsonable(r) for r in rows], organization_id, db)
+
+
+def _insert_staging(rows: List[Dict[str, Any]], organization_id: int, db: Session) -> int:
+    # rows já passaram pelo _row_to_jsonable
+    if not rows:
+        return 0
+    if supports_copy(db):
+        # Postgres: COPY é bem mais rápido que o INSERT multi-VALUES (created_at vem do DEFAULT)
+        copy_rows(db, StagingRecord.__table__, ['organization_id', 'raw_json'], ((organization_id, r) for r in rows))
+        return len(rows)
+    db.execute(insert(StagingRecord.__table__).values(created_at=func.now()), [{"organization_id": organization_id, "raw_json": r} for r in rows])
+    return len(rows)
+
+
+def store_staging(rows: List[Dict[str, Any]], organization_id: int, db: Session, chunk_size: int = STAGING_BATCH_SIZE) -> int:
+    for chunk in iter_batches(rows, chunk_size):
+        store_staging_batch(chunk, organization_id, db)
     db.commit()
     return len(rows)
+
+
+# Linhas amostradas por índice no ANALYZE do SQLite: estatísticas aproximadas com custo fixo
+_SQLITE_ANALYSIS_LIMIT = 1000
+
+
+# Postgres: ANALYZE explícito só quando a carga é grande perto da tabela (mesma ideia do
+# autovacuum_analyze_scale_factor); cargas menores ficam para o autovacuum
+_PG_ANALYZE_FRACTION = 0.1
+
+
+def refresh_curated_stats(db: Session, rows: int) -> None:
+    """Atualiza as estatísticas do planner após uma carga em massa de `rows` linhas.
+
+    Sem elas o planner pode ignorar os índices cobrindo dos agregados logo após a
+    primeira ingestão. No Postgres o ANALYZE pega um lock que conflita consigo mesmo e
+    com o autovacuum (as fontes paralelas do cron fariam fila nele), então só roda para
+    cargas relevantes. Falha aqui não invalida a ingestão já gravada.
+    """
+    if rows <= 0:
+        return
+    try:
+        if db.get_bind().dialect.name == 'sqlite':
+            db.execute(text(f"PRAGMA analysis_limit = {_SQLITE_ANALYSIS_LIMIT}"))
+        else:
+            # reltuples < 0 (ou 0): tabela nunca analisada
+            reltuples = db.execute(text("SELECT reltuples FROM pg_class WHERE oid = 'curated_records'::regclass")).scalar()
+            if reltuples and reltuples > 0 and rows < _PG_ANALYZE_FRACTION * reltuples:
+                db.rollback()
+                return
+        # Postgres amostra a tabela (custo limitado por default_statistics_target)
+        db.execute(text("ANALYZE curated_records"))
+        db.commit()
+    except Exception:
+        db.rollback()
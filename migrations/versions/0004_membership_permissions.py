@@ -2,6 +2,7 @@ from __future__ import annotations
 from alembic import op
 import sqlalchemy as sa
 from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
 
 
 revision = '0004_membership_permissions'
@@ -13,25 +14,40 @@ depends_on = None
 def upgrade() -> None:
     bind = op.get_bind()
     inspector = inspect(bind)
+    # Colunas lidas uma vez; as checagens abaixo são só lookups
+    membership_cols = {col['name']: col for col in inspector.get_columns('memberships')}
 
-    def ensure_column(table: str, column: sa.Column):
-        if column.name not in [col['name'] for col in inspector.get_columns(table)]:
-            op.add_column(table, column)
+    new_cols = [
+        sa.Column('can_manage_datasources', sa.Boolean(), server_default=sa.false(), nullable=False),
+        sa.Column('can_manage_datasets', sa.Boolean(), server_default=sa.false(), nullable=False),
+        sa.Column('can_manage_indicators', sa.Boolean(), server_default=sa.false(), nullable=False),
+        sa.Column('can_manage_members', sa.Boolean(), server_default=sa.false(), nullable=False),
+    ]
+    missing = [col for col in new_cols if col.name not in membership_cols]
+    if missing and bind.dialect.name == 'postgresql':
+        # Postgres aceita vários ADD COLUMN num único ALTER TABLE (um lock só)
+        specs = ", ".join(f"ADD COLUMN {CreateColumn(col).compile(dialect=bind.dialect)}" for col in missing)
+        op.execute(f"ALTER TABLE memberships {specs}")
+    else:
+        # SQLite: ADD COLUMN só mexe no schema (sem reescrever a tabela), um por ALTER
+        for col in missing:
+            op.add_column('memberships', col)
 
-    ensure_column('memberships', sa.Column('can_manage_datasources', sa.Boolean(), server_default=sa.false(), nullable=False))
-    ensure_column('memberships', sa.Column('can_manage_datasets', sa.Boolean(), server_default=sa.false(), nullable=False))
-    ensure_column('memberships', sa.Column('can_manage_indicators', sa.Boolean(), server_default=sa.false(), nullable=False))
-    ensure_column('memberships', sa.Column('can_manage_members', sa.Boolean(), server_default=sa.false(), nullable=False))
+    # Só as colunas que têm default (as recém-criadas e as antigas que ainda o tenham);
+    # SQLite não altera default de coluna, então lá os defaults ficam
+    flags = [
+        col.name for col in new_cols
+        if col.name not in membership_cols or membership_cols[col.name].get('default') is not None
+    ]
+    if flags and bind.dialect.name == 'postgresql':
+        # Um único ALTER TABLE: um lock e uma atualização do catálogo para as colunas
+        op.execute("ALTER TABLE memberships " + ", ".join(f"ALTER COLUMN {col} DROP DEFAULT" for col in flags))
+    elif bind.dialect.name != 'sqlite':
+        for col in flags:
+            op.alter_column('memberships', col, server_default=None)
 
-    try:
-        op.alter_column('memberships', 'can_manage_datasources', server_default=None)
-        op.alter_column('memberships', 'can_manage_datasets', server_default=None)
-        op.alter_column('memberships', 'can_manage_indicators', server_default=None)
-        op.alter_column('memberships', 'can_manage_members', server_default=None)
-    except Exception:
-        pass
-
-    if 'indicator_folder_permissions' not in inspector.get_table_names():
+    # has_table: uma consulta ao catálogo só para essa tabela, sem listar todas
+    if not inspector.has_table('indicator_folder_permissions'):
         op.create_table(
             'indicator_folder_permissions',
             sa.Column('id', sa.Integer(), primary_key=True),
@@ -40,18 +56,15 @@ def upgrade() -> None:
             sa.Column('folder', sa.String(length=120), nullable=False),
             sa.Column('can_edit', sa.Boolean(), nullable=False, server_default=sa.false()),
             sa.Column('created_at', sa.DateTime(), server_default=sa.func.now()),
+            # Índice junto da tabela: criado no mesmo create_table, sem try/except à parte
+            sa.Index('ix_indicator_folder_perm_org_user', 'organization_id', 'user_id'),
         )
-        try:
-            op.create_index('ix_indicator_folder_perm_org_user', 'indicator_folder_permissions', ['organization_id', 'user_id'], unique=False)
-        except Exception:
-            pass
 
 
 def downgrade() -> None:
-    try:
+    indexes = {ix['name'] for ix in inspect(op.get_bind()).get_indexes('indicator_folder_permissions')}
+    if 'ix_indicator_folder_perm_org_user' in indexes:
         op.drop_index('ix_indicator_folder_perm_org_user', table_name='indicator_folder_permissions')
-    except Exception:
-        pass
     op.drop_table('indicator_folder_permissions')
     op.drop_column('memberships', 'can_manage_members')
     op.drop_column('memberships', 'can_manage_indicators')
@@ -0,0 +1,42 @@
+from __future__ import annotations
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+revision = '0005_hot_path_indexes'
+down_revision = '0004_membership_permissions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    is_pg = bind.dialect.name == 'postgresql'
+
+    # credor_code pode ter sido criado só pelo startup da app
+    if 'credor_code' not in [col['name'] for col in inspector.get_columns('curated_records')]:
+        op.add_column('curated_records', sa.Column('credor_code', sa.String(length=50), nullable=True))
+
+    # Postgres: CONCURRENTLY não bloqueia escrita na tabela, mas não roda dentro de transação
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_data_sources_recurring', 'data_sources', ['is_recurring'], unique=False,
+            postgresql_where=sa.text('is_recurring'), sqlite_where=sa.text('is_recurring'),
+            postgresql_concurrently=is_pg, if_not_exists=True,
+        )
+        op.create_index(
+            'ix_curated_records_org_credor', 'curated_records', ['organization_id', 'credor_code'], unique=False,
+            postgresql_concurrently=is_pg, if_not_exists=True,
+        )
+        op.create_index(
+            'ix_job_runs_target', 'job_runs', ['target_type', 'target_id', 'started_at'], unique=False,
+            postgresql_concurrently=is_pg, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_job_runs_target', table_name='job_runs', if_exists=True)
+    op.drop_index('ix_curated_records_org_credor', table_name='curated_records', if_exists=True)
+    op.drop_index('ix_data_sources_recurring', table_name='data_sources', if_exists=True)
@@ -0,0 +1,24 @@
+from __future__ import annotations
+from alembic import op
+
+
+revision = '0006_memberships_lookup'
+down_revision = '0005_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        # role servido direto do índice em /auth/me e /auth/login
+        op.create_index(
+            'ix_memberships_lookup', 'memberships', ['user_id', 'organization_id'], unique=False,
+            postgresql_include=['role'], if_not_exists=True,
+        )
+    else:
+        op.create_index('ix_memberships_lookup', 'memberships', ['user_id', 'organization_id', 'role'], unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memberships_lookup', table_name='memberships', if_exists=True)
@@ -0,0 +1,22 @@
+from __future__ import annotations
+from alembic import op
+
+
+revision = '0007_indicators_org_key_unique'
+down_revision = '0006_memberships_lookup'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Mantém só o indicador mais antigo de cada (org, key) antes de exigir unicidade
+    op.execute(
+        "DELETE FROM indicators WHERE id NOT IN "
+        "(SELECT MIN(id) FROM indicators GROUP BY organization_id, key)"
+    )
+    # Alvo do INSERT ... ON CONFLICT (organization_id, key) do bootstrap
+    op.create_index('ux_indicators_org_key', 'indicators', ['organization_id', 'key'], unique=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ux_indicators_org_key', table_name='indicators', if_exists=True)
@@ -0,0 +1,33 @@
+from __future__ import annotations
+from alembic import op
+
+
+revision = '0008_curated_aggregate_indexes'
+down_revision = '0007_indicators_org_key_unique'
+branch_labels = None
+depends_on = None
+
+
+# (nome, chave, colunas só lidas pelos agregados de /indicators)
+INDEXES = [
+    ('ix_curated_records_org_dtcad', ['organization_id', 'dt_cadastro'], ['vl_titulo', 'uf', 'situacao_processo']),
+    ('ix_curated_records_org_uf', ['organization_id', 'uf'], ['vl_titulo']),
+    # as faixas são calculadas a partir do dt_vencimento
+    ('ix_curated_records_org_venc', ['organization_id', 'dt_vencimento'], ['vl_titulo', 'vl_total_repasse']),
+]
+
+
+def upgrade() -> None:
+    is_pg = op.get_bind().dialect.name == 'postgresql'
+    # Postgres: INCLUDE deixa os valores na folha (index-only scan); SQLite: tudo na chave
+    with op.get_context().autocommit_block():
+        for name, key, include in INDEXES:
+            op.create_index(
+                name, 'curated_records', key if is_pg else key + include, unique=False,
+                postgresql_include=include, postgresql_concurrently=is_pg, if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    for name, _key, _include in reversed(INDEXES):
+        op.drop_index(name, table_name='curated_records', if_exists=True)
@@ -0,0 +1,35 @@
+from __future__ import annotations
+from alembic import op
+
+
+revision = '0009_curated_uf_covering'
+down_revision = '0008_curated_aggregate_indexes'
+branch_labels = None
+depends_on = None
+
+
+# mapa-por-uf filtra por dt_cadastro (from/to); sem ela na folha o índice por UF
+# não cobre a consulta e cada linha volta à tabela
+NAME = 'ix_curated_records_org_uf_dtcad'
+KEY = ['organization_id', 'uf']
+INCLUDE = ['vl_titulo', 'dt_cadastro']
+
+
+def upgrade() -> None:
+    is_pg = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index(
+            NAME, 'curated_records', KEY if is_pg else KEY + INCLUDE, unique=False,
+            postgresql_include=INCLUDE, postgresql_concurrently=is_pg, if_not_exists=True,
+        )
+        op.drop_index('ix_curated_records_org_uf', table_name='curated_records', if_exists=True, postgresql_concurrently=is_pg)
+
+
+def downgrade() -> None:
+    is_pg = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_curated_records_org_uf', 'curated_records', ['organization_id', 'uf'] if is_pg else ['organization_id', 'uf', 'vl_titulo'],
+            unique=False, postgresql_include=['vl_titulo'], postgresql_concurrently=is_pg, if_not_exists=True,
+        )
+        op.drop_index(NAME, table_name='curated_records', if_exists=True, postgresql_concurrently=is_pg)
@@ -0,0 +1,48 @@
+from __future__ import annotations
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0010_curated_ym'
+down_revision = '0009_curated_uf_covering'
+branch_labels = None
+depends_on = None
+
+
+# valor-mes-a-mes agrupa pelo ano-mês gravado na ingestão em vez de
+# strftime/TO_CHAR por linha; o índice entrega os grupos já ordenados
+INDEX = 'ix_curated_records_org_ym'
+KEY = ['organization_id', 'ym']
+INCLUDE = ['vl_titulo', 'dt_cadastro', 'uf', 'situacao_processo']
+# Linhas (faixa de id) por transação do backfill no Postgres
+BACKFILL_BATCH = 50000
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    is_pg = bind.dialect.name == 'postgresql'
+    cols = {c['name'] for c in sa.inspect(bind).get_columns('curated_records')}
+    if 'ym' not in cols:
+        op.add_column('curated_records', sa.Column('ym', sa.String(length=7), nullable=True))
+    ym = "TO_CHAR(dt_cadastro, 'YYYY-MM')" if is_pg else "strftime('%Y-%m', dt_cadastro)"
+    backfill = f"UPDATE curated_records SET ym = {ym} WHERE ym IS NULL AND dt_cadastro IS NOT NULL"
+    if not is_pg:
+        op.execute(backfill)
+    # Postgres: INCLUDE deixa os valores na folha; SQLite: tudo na chave
+    with op.get_context().autocommit_block():
+        if is_pg:
+            # O bloco já commitou o ADD COLUMN (o ACCESS EXCLUSIVE sai aqui); o backfill vai
+            # em faixas de id, cada uma na própria transação, com leituras liberadas entre elas
+            lo, hi = op.get_bind().execute(sa.text("SELECT MIN(id), MAX(id) FROM curated_records")).one()
+            for start in range(lo or 0, (hi or -1) + 1, BACKFILL_BATCH):
+                op.execute(sa.text(f"{backfill} AND id >= :lo AND id < :hi").bindparams(lo=start, hi=start + BACKFILL_BATCH))
+        op.create_index(
+            INDEX, 'curated_records', KEY if is_pg else KEY + INCLUDE, unique=False,
+            postgresql_include=INCLUDE, postgresql_concurrently=is_pg, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(INDEX, table_name='curated_records', if_exists=True)
+    with op.batch_alter_table('curated_records') as batch:
+        batch.drop_column('ym')
@@ -0,0 +1,19 @@
+from __future__ import annotations
+from alembic import op
+
+
+revision = '0011_curated_uf_upper'
+down_revision = '0010_curated_ym'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # A ingestão passou a gravar a UF em maiúsculas e sem espaços; alinha as linhas antigas
+    # para o mapa por UF não separar "sp" de "SP" (nem criar um grupo de string vazia)
+    op.execute("UPDATE curated_records SET uf = NULLIF(UPPER(TRIM(uf)), '') WHERE (uf IS NOT NULL AND uf <> UPPER(TRIM(uf))) OR uf = ''")
+
+
+def downgrade() -> None:
+    # Normalização sem volta: a grafia original não é guardada
+    pass
@@ -0,0 +1,28 @@
+from __future__ import annotations
+from alembic import op
+
+
+revision = '0012_job_runs_org_started'
+down_revision = '0011_curated_uf_upper'
+branch_labels = None
+depends_on = None
+
+
+# queries_today do /meta/summary (e listagens de jobs recentes) filtram por tenant e
+# intervalo de started_at; o btree serve tanto ordem crescente quanto decrescente
+NAME = 'ix_job_runs_org_started'
+
+
+def upgrade() -> None:
+    is_pg = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.create_index(
+            NAME, 'job_runs', ['organization_id', 'started_at'], unique=False,
+            postgresql_concurrently=is_pg, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    is_pg = op.get_bind().dialect.name == 'postgresql'
+    with op.get_context().autocommit_block():
+        op.drop_index(NAME, table_name='job_runs', if_exists=True, postgresql_concurrently=is_pg)
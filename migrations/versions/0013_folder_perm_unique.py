@@ -0,0 +1,31 @@
+from __future__ import annotations
+from alembic import op
+
+
+revision = '0013_folder_perm_unique'
+down_revision = '0012_job_runs_org_started'
+branch_labels = None
+depends_on = None
+
+
+NAME = 'ux_indicator_folder_perm_org_user_folder'
+
+
+def upgrade() -> None:
+    # Pasta repetida para o mesmo membro (ex.: uma linha com e outra sem edição): fica a
+    # mais antiga, com a permissão mais ampla, antes de exigir unicidade
+    op.execute(
+        "UPDATE indicator_folder_permissions SET can_edit = TRUE WHERE NOT can_edit AND EXISTS ("
+        "SELECT 1 FROM indicator_folder_permissions p WHERE p.organization_id = indicator_folder_permissions.organization_id "
+        "AND p.user_id = indicator_folder_permissions.user_id AND p.folder = indicator_folder_permissions.folder AND p.can_edit)"
+    )
+    op.execute(
+        "DELETE FROM indicator_folder_permissions WHERE id NOT IN "
+        "(SELECT MIN(id) FROM indicator_folder_permissions GROUP BY organization_id, user_id, folder)"
+    )
+    # Alvo do INSERT ... ON CONFLICT (organization_id, user_id, folder) de /org/members
+    op.create_index(NAME, 'indicator_folder_permissions', ['organization_id', 'user_id', 'folder'], unique=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    op.drop_index(NAME, table_name='indicator_folder_permissions', if_exists=True)
@@ -0,0 +1,30 @@
+from __future__ import annotations
+from alembic import op
+
+
+revision = '0014_folder_perm_covering'
+down_revision = '0013_folder_perm_unique'
+branch_labels = None
+depends_on = None
+
+
+UNIQUE = 'ux_indicator_folder_perm_org_user_folder'
+# (organization_id, user_id) é prefixo do índice único: o antigo só custa escrita
+OLD = 'ix_indicator_folder_perm_org_user'
+COLUMNS = ['organization_id', 'user_id', 'folder']
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        # can_edit na folha: as pastas de um membro (listagem e respostas de /org/members)
+        # saem do índice, sem visitar a tabela
+        op.drop_index(UNIQUE, table_name='indicator_folder_permissions', if_exists=True)
+        op.create_index(UNIQUE, 'indicator_folder_permissions', COLUMNS, unique=True, postgresql_include=['can_edit'])
+    op.drop_index(OLD, table_name='indicator_folder_permissions', if_exists=True)
+
+
+def downgrade() -> None:
+    op.create_index(OLD, 'indicator_folder_permissions', ['organization_id', 'user_id'], unique=False, if_not_exists=True)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index(UNIQUE, table_name='indicator_folder_permissions', if_exists=True)
+        op.create_index(UNIQUE, 'indicator_folder_permissions', COLUMNS, unique=True)
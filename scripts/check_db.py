@@ -1,17 +1,19 @@
 import sqlite3
-from pprint import pprint
+import sys
 
-conn = sqlite3.connect('local.db')
+# Somente leitura: não cria o arquivo se faltar nem prepara journal de escrita
+conn = sqlite3.connect('file:local.db?mode=ro', uri=True)
 cur = conn.cursor()
-print('tables:')
-for r in cur.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY 1"):
-    print(' -', r[0])
+tables = cur.execute("SELECT name FROM sqlite_master WHERE type='table' ORDER BY 1").fetchall()
+columns = cur.execute('PRAGMA table_info(indicators)').fetchall()
+rows = cur.execute('SELECT id, key, name, fmt, category FROM indicators ORDER BY id DESC LIMIT 5').fetchall()
+conn.close()
 
-print('\nindicators columns:')
-for r in cur.execute('PRAGMA table_info(indicators)'):
-    print(r)
-
-print('\nindicators sample:')
-rows = list(cur.execute('SELECT id, key, name, fmt, category FROM indicators ORDER BY id DESC LIMIT 5'))
-for r in rows:
-    print(r)
+# Saída montada e escrita de uma vez
+out = ['tables:']
+out.extend(f' - {r[0]}' for r in tables)
+out.append('\nindicators columns:')
+out.extend(str(r) for r in columns)
+out.append('\nindicators sample:')
+out.extend(str(r) for r in rows)
+sys.stdout.write('\n'.join(out) + '\n')
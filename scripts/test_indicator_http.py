@@ -1,42 +1,124 @@
+import base64
+import http.client
 import json
-import urllib.request
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
 
 
 BASE_URL = "http://127.0.0.1:8000"
+# Quantas vezes rodar o indicador e quantas execuções em paralelo
+# (python test_indicator_http.py [N] [CONCORRENCIA])
+RUNS = max(int(sys.argv[1]), 1) if len(sys.argv) > 1 else 1
+CONCURRENCY = int(sys.argv[2]) if len(sys.argv) > 2 else 1
 
+# Uma conexão keep-alive por thread (sem handshake TCP por request; HTTPConnection
+# não pode ser compartilhada entre threads)
+_base = urlsplit(BASE_URL)
+_local = threading.local()
+_conns: list[http.client.HTTPConnection] = []
+_JSON = {"Content-Type": "application/json"}
 
-def request(method: str, path: str, token: str | None = None, payload: dict | None = None):
-    url = f"{BASE_URL}{path}"
-    data = json.dumps(payload).encode("utf-8") if payload is not None else None
-    headers = {"Content-Type": "application/json"} if payload is not None else {}
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-    req = urllib.request.Request(url, data=data, headers=headers, method=method)
-    with urllib.request.urlopen(req) as resp:
-        body = resp.read().decode("utf-8")
-        status = resp.status
-    return status, body
 
+def _conn() -> http.client.HTTPConnection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = http.client.HTTPConnection(_base.hostname, _base.port)
+        _conns.append(conn)
+    return conn
 
-def main():
-    status, body = request(
-        "POST",
-        "/auth/dev-login",
-        payload={
-            "email": "owner@devalor.com",
-            "name": "Owner",
-            "org_name": "Devalor Solucoes",
-            "org_slug": "devalor_solucoes",
-        },
-    )
+
+def request(method: str, path: str, headers: dict | None = None, body: bytes | None = None):
+    conn = _conn()
+    conn.request(method, path, body=body, headers=headers or {})
+    resp = conn.getresponse()
+    # Corpo lido inteiro (exigido para reusar a conexão), mas devolvido em bytes: só a
+    # resposta do login é parseada, as demais viram uma prévia curta
+    return resp.status, resp.read()
+
+
+def _preview(body: bytes, size: int = 200) -> str:
+    return body[:size].decode("utf-8", errors="replace")
+
+
+# Token do dev-login reaproveitado entre execuções até perto do exp (por servidor/e-mail)
+TOKEN_CACHE = Path("~/.cache/nexen_dev_token.json").expanduser()
+TOKEN_MARGIN = 60
+LOGIN = {
+    "email": "owner@devalor.com",
+    "name": "Owner",
+    "org_name": "Devalor Solucoes",
+    "org_slug": "devalor_solucoes",
+}
+
+
+def _token_exp(token: str) -> int:
+    # Só lê o exp do payload (sem verificar assinatura: quem valida é o servidor)
+    payload = token.split(".")[1]
+    return int(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))).get("exp") or 0)
+
+
+def _cached_token() -> str | None:
+    try:
+        cached = json.loads(TOKEN_CACHE.read_text())
+        if cached.get("base_url") != BASE_URL or cached.get("email") != LOGIN["email"]:
+            return None
+        token = cached["access_token"]
+        return token if _token_exp(token) > time.time() + TOKEN_MARGIN else None
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+
+def _store_token(token: str) -> None:
+    try:
+        TOKEN_CACHE.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(TOKEN_CACHE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"base_url": BASE_URL, "email": LOGIN["email"], "access_token": token}, f)
+    except OSError:
+        pass
+
+
+def _login() -> str:
+    status, body = request("POST", "/auth/dev-login", _JSON, json.dumps(LOGIN).encode("utf-8"))
     print("Login status:", status)
     token = json.loads(body)["access_token"]
-    status, body = request("GET", "/indicators", token=token)
+    _store_token(token)
+    return token
+
+
+def main():
+    token = _cached_token()
+    if token is None:
+        token = _login()
+    else:
+        print("Login: token em cache")
+    # Cabeçalhos e corpo montados uma vez para todas as chamadas autenticadas
+    auth = {"Authorization": f"Bearer {token}"}
+    status, body = request("GET", "/indicators", auth)
+    if status == 401:
+        # Token do cache recusado (outra chave/banco no servidor): login de novo
+        auth = {"Authorization": f"Bearer {_login()}"}
+        status, body = request("GET", "/indicators", auth)
+    auth_json = {**auth, **_JSON}
     print("List status:", status)
-    print("List body:", body[:200], "...")
-    status, body = request("POST", "/indicators/27/run", token=token, payload={})
+    print("List body:", _preview(body), "...")
+    empty = b"{}"
+    run = lambda _: request("POST", "/indicators/27/run", auth_json, empty)
+    if CONCURRENCY > 1:
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+            results = list(pool.map(run, range(RUNS)))
+    else:
+        results = [run(i) for i in range(RUNS)]
+    status, body = results[-1]
     print("Run status:", status)
-    print("Run body:", body[:200], "...")
+    print("Run body:", _preview(body), "...")
+    for conn in _conns:
+        conn.close()
 
 
 if __name__ == "__main__":